@@ -3,29 +3,90 @@ from config import Config
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_migrate import Migrate
+from app.hashing import PasswordHasher
+from app.identity import IdentityCache
+from app.page_cache import PageCache
+from app.instrumentation import Instrumentation
+from app.engine_profiles import engine_options, install_pragmas
+from app.replicas import RoutingSession, init_replicas, replica_binds
+from app.templating import jinja_options, precompile_templates
 
 # Create SQLAlchemy instance without initializing it yet
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate(db)
 login_manager = LoginManager()
 login_manager.login_view = "auth.login"
+# The JSON API answers 401 rather than redirecting to the login page
+login_manager.blueprint_login_views = {"api": None}
+password_hasher = PasswordHasher()
+identity_cache = IdentityCache()
+page_cache = PageCache()
+instrumentation = Instrumentation()
 
+# Export the figures of the hasher and caches at /metrics alongside the request figures
+instrumentation.add_collector('password_hash', password_hasher.stats, {
+    'in_flight': ('gauge', 'Password hashes running or waiting.'),
+    'completed': ('counter', 'Password hashes completed.'),
+    'rejected': ('counter', 'Password hashes turned away because the queue was full.'),
+    'failed': ('counter', 'Password hashes that raised an error.'),
+    'average_latency_ms': ('gauge', 'Average latency of a password hash in milliseconds.'),
+    'max_latency_ms': ('gauge', 'Slowest password hash in milliseconds.'),
+})
+for _name, _cache in (('identity_cache', identity_cache), ('page_cache', page_cache)):
+    instrumentation.add_collector(_name, _cache.stats, {
+        'entries': ('gauge', 'Entries held in process.'),
+        'hits': ('counter', 'Lookups answered from the cache.'),
+        'misses': ('counter', 'Lookups that had to load or render.'),
+        'evictions': ('counter', 'Entries evicted to stay within the size limit.'),
+        'invalidations': ('counter', 'Entries dropped because the data changed.'),
+    })
 
-def create_app():
+
+def create_app(config_class=Config):
     app = Flask(__name__, template_folder='templates')
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
+
+    # Bound the template cache and add the bytecode cache before the Jinja environment is created
+    app.jinja_options = jinja_options(app)
 
     # Initialize extensions within the application context
     with app.app_context():
+        # Tune the database engines with the configured profile
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+            app.config['DATABASE_PROFILE'], app.config['SQLALCHEMY_DATABASE_URI'],
+            app.config.get('SQLALCHEMY_ENGINE_OPTIONS'))
+
+        # Add the read replica bind, if one is configured
+        app.config['SQLALCHEMY_BINDS'] = replica_binds(app)
+
         # Initialize the SQLAlchemy extension
         db.init_app(app)
+        init_replicas(app)
+        for engine in db.engines.values():
+            install_pragmas(engine, app.config['DATABASE_PROFILE'])
 
         # Initialize flask migrate
         migrate.init_app(app, db)
 
         # Initialize the login_manager and set the login view
         login_manager.init_app(app)
-       
+
+        # Initialize the password hasher
+        password_hasher.init_app(app)
+
+        # Initialize the cache of logged in member identities
+        identity_cache.init_app(app, db.session)
+
+        # Initialize the cache of rendered listing fragments
+        page_cache.init_app(app)
+
+        # Time the requests and their SQL statements for /metrics
+        instrumentation.init_app(app, db.engines.values())
+
+        # Bump the table versions read by the JSON API and the page cache as writes commit
+        from app.versions import watch_table_versions
+        watch_table_versions(db.engine, db.session)
+
 
         # Register blueprints
         from app.routes.auth import bp as auth_bp
@@ -40,5 +101,16 @@ def create_app():
         from app.routes.transactions import bp as transaction_bp
         app.register_blueprint(transaction_bp)
 
+        from app.routes.api import bp as api_bp
+        app.register_blueprint(api_bp)
+
+        # Register the command line commands
+        from app.commands import register_commands
+        register_commands(app)
+
+        # Compile every template now rather than on the first request that renders it
+        if app.config['TEMPLATE_PRECOMPILE']:
+            precompile_templates(app)
+
 
     return app
@@ -0,0 +1,206 @@
+"""
+A module that keeps daily circulation rollups and answers the analytics reports from them.
+
+Three tables hold, per day, per book and day, and per member and day, the loans issued and
+returned and the fees charged and paid at those returns. Issues count on their borrowed date and
+returns on their return date. issue_book, return_book and the circulation batch add their changes
+with one upsert per table in the same transaction as the loan, so the rollups never drift from
+the transactions they summarize. backfill_rollups rebuilds them from the history in chunks of
+transaction ids. The reports only ever read the rollups, so their cost depends on the number of
+days and books or members in the range, not on the number of transactions.
+"""
+import time
+from collections import defaultdict
+from datetime import date
+from sqlalchemy import delete, func, literal, select
+from app.models import Book, DailyBookCirculation, DailyCirculation, DailyMemberCirculation, Member, Transaction, db
+
+# Figures summed by every rollup, in table order
+MEASURES = ('issues', 'returns', 'fees_charged', 'revenue')
+
+# Each rollup with the transaction column it is grouped by besides the day
+ROLLUPS = (
+    (DailyCirculation, None),
+    (DailyBookCirculation, 'book_id'),
+    (DailyMemberCirculation, 'member_id'),
+)
+
+
+class BackfillRun:
+    """
+    A class that holds the figures of a rollup backfill
+    """
+
+    def __init__(self):
+        self.chunks = 0
+        self.transactions = 0
+        self.elapsed = 0.0
+
+
+def _insert(table):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError('Analytics rollups are only implemented for SQLite and PostgreSQL')
+    return insert(table)
+
+
+def _upsert(statement, table, key):
+    """
+    Make an insert into a rollup add its figures to the row of the same key when there is one
+    """
+    keys = ['day'] + ([key] if key else [])
+    return statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: table.c[name] + statement.excluded[name] for name in MEASURES})
+
+
+def record_circulation(issues=(), returns=()):
+    """
+    Add loans issued, given as (day, book_id, member_id), and loans returned, given as
+    (day, book_id, member_id, total_fee, amount_paid), to the rollups in the current transaction
+    """
+    changes = {model: defaultdict(lambda: [0, 0, 0.0, 0.0]) for model, _ in ROLLUPS}
+    for day, book_id, member_id in issues:
+        for model, key in ROLLUPS:
+            value = {'book_id': book_id, 'member_id': member_id}.get(key)
+            if key is None or value is not None:
+                changes[model][(day, value)][0] += 1
+    for day, book_id, member_id, total_fee, amount_paid in returns:
+        for model, key in ROLLUPS:
+            value = {'book_id': book_id, 'member_id': member_id}.get(key)
+            if key is None or value is not None:
+                figures = changes[model][(day, value)]
+                figures[1] += 1
+                figures[2] += total_fee or 0
+                figures[3] += amount_paid or 0
+
+    for model, key in ROLLUPS:
+        if not changes[model]:
+            continue
+        table = model.__table__
+        rows = []
+        for (day, value), figures in changes[model].items():
+            row = dict(zip(MEASURES, figures), day=day)
+            if key:
+                row[key] = value
+            rows.append(row)
+        db.session.execute(_upsert(_insert(table), table, key), rows)
+
+
+def _chunk_select(key, chunk, returned):
+    """
+    Select the rollup rows of the loans issued (or returned) in a chunk of transactions
+    """
+    day = Transaction.return_date if returned else Transaction.borrowed_date
+    columns = [day.label('day')]
+    group_by = [day]
+    conditions = [chunk, day.isnot(None)]
+    if key:
+        column = getattr(Transaction, key)
+        columns.append(column.label(key))
+        group_by.append(column)
+        conditions.append(column.isnot(None))
+    if returned:
+        columns += [literal(0).label('issues'), func.count().label('returns'),
+                    func.sum(func.coalesce(Transaction.total_fee, 0)).label('fees_charged'),
+                    func.sum(func.coalesce(Transaction.amount_paid, 0)).label('revenue')]
+    else:
+        columns += [func.count().label('issues'), literal(0).label('returns'),
+                    literal(0.0).label('fees_charged'), literal(0.0).label('revenue')]
+    return select(*columns).where(*conditions).group_by(*group_by)
+
+
+def backfill_rollups(chunk_size=100000, progress=None):
+    """
+    Rebuild every rollup from the transactions, committing once per chunk of transaction ids.
+    Loans issued or returned while it runs may be counted twice, so run it before the app takes
+    traffic or in a quiet period. Returns the BackfillRun
+    """
+    started = time.perf_counter()
+    run = BackfillRun()
+    for model, _ in ROLLUPS:
+        db.session.execute(delete(model))
+    db.session.commit()
+
+    first, last = db.session.execute(
+        select(func.min(Transaction.transaction_id), func.max(Transaction.transaction_id))).one()
+    if first is not None:
+        for start in range(first, last + 1, chunk_size):
+            chunk = Transaction.transaction_id.between(start, start + chunk_size - 1)
+            for model, key in ROLLUPS:
+                table = model.__table__
+                names = ['day'] + ([key] if key else []) + list(MEASURES)
+                for returned in (False, True):
+                    db.session.execute(_upsert(_insert(table).from_select(names, _chunk_select(key, chunk, returned)),
+                                               table, key))
+            db.session.commit()
+            run.chunks += 1
+            run.transactions = min(start + chunk_size - 1, last) - first + 1
+            if progress:
+                progress(run)
+    run.elapsed = time.perf_counter() - started
+    return run
+
+
+def default_range(today=None):
+    """
+    Return the first day of the current month and today, the range the reports show by default
+    """
+    today = today or date.today()
+    return today.replace(day=1), today
+
+
+def daily_totals(start, end):
+    """
+    Return the DailyCirculation rows from start to end, both included, oldest first
+    """
+    return db.session.execute(
+        select(DailyCirculation).where(DailyCirculation.day.between(start, end)).order_by(DailyCirculation.day)
+    ).scalars().all()
+
+
+def range_totals(start, end):
+    """
+    Return the sums of every figure from start to end as a dict
+    """
+    row = db.session.execute(
+        select(*[func.coalesce(func.sum(getattr(DailyCirculation, name)), 0).label(name) for name in MEASURES])
+        .where(DailyCirculation.day.between(start, end))
+    ).one()
+    return dict(row._mapping)
+
+
+def _top(model, key, label_model, label, start, end, limit, by):
+    figures = (select(getattr(model, key).label('id'),
+                      *[func.sum(getattr(model, name)).label(name) for name in MEASURES])
+               .where(model.day.between(start, end))
+               .group_by(getattr(model, key))
+               .order_by(func.sum(getattr(model, by)).desc(), getattr(model, key))
+               .limit(limit)
+               .subquery('figures'))
+    # Names are looked up for the few rows left, deleted books and members keep their figures
+    return db.session.execute(
+        select(figures, getattr(label_model, label).label(label))
+        .outerjoin(label_model, label_model.id == figures.c.id)
+        .order_by(figures.c[by].desc(), figures.c.id)
+    ).all()
+
+
+def top_books(start, end, limit=10, by='issues'):
+    """
+    Return (id, issues, returns, fees_charged, revenue, title) for the books with the most of a
+    figure from start to end
+    """
+    return _top(DailyBookCirculation, 'book_id', Book, 'title', start, end, limit, by)
+
+
+def top_members(start, end, limit=10, by='issues'):
+    """
+    Return (id, issues, returns, fees_charged, revenue, fullname) for the members with the most of
+    a figure from start to end
+    """
+    return _top(DailyMemberCirculation, 'member_id', Member, 'fullname', start, end, limit, by)
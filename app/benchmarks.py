@@ -0,0 +1,628 @@
+"""
+A module that times library workloads against a throwaway SQLite database.
+
+Each benchmark builds its own app on a temporary database file, so it never touches the library
+database. The circulation and engine benchmarks return (label, operations, seconds) rows for the
+command line to print. The route suite loads a synthetic library and drives every blueprint route
+through the test client, recording latency percentiles, queries per request and peak memory, which
+can be saved as a baseline and compared against on later runs.
+"""
+import io
+import itertools
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from config import Config
+
+# How much a route's p95 latency and peak memory may grow over the baseline before it is a regression
+LATENCY_THRESHOLD = 0.25
+MEMORY_THRESHOLD = 0.5
+
+# Latency and memory changes smaller than these are noise, whatever the threshold
+LATENCY_FLOOR_MS = 2.0
+MEMORY_FLOOR_KIB = 64
+
+# Status codes a route may answer with during the suite
+EXPECTED_STATUSES = (200, 302, 304)
+
+
+class BenchmarkConfig(Config):
+    """
+    A class that configures a benchmark app: a temporary database, no CSRF, no login and inline hashing
+    """
+    WTF_CSRF_ENABLED = False
+    LOGIN_DISABLED = True
+    PASSWORD_HASH_WORKERS = 0
+    SECRET_KEY = Config.SECRET_KEY or 'benchmark'
+
+
+@contextmanager
+def benchmark_app(**settings):
+    """
+    Yield an app with a fresh schema on a temporary SQLite database, removed afterwards. settings
+    override the benchmark configuration
+    """
+    from app import create_app, db
+
+    directory = tempfile.mkdtemp(prefix='lms-benchmark-')
+    path = os.path.join(directory, 'benchmark.db')
+    settings.setdefault('SQLALCHEMY_DATABASE_URI', f'sqlite:///{path}')
+
+    app = create_app(type('TemporaryConfig', (BenchmarkConfig,), settings))
+    try:
+        with app.app_context():
+            # Only the primary: a replica gets its schema by syncing, and earlier apps may have left
+            # their bind keys on the shared metadata
+            db.create_all(bind_key=None)
+            yield app
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+def seed_loans(count):
+    """
+    Add count members and count single-copy books to the benchmark database
+    """
+    from app.models import Book, Member, db
+
+    db.session.execute(Member.__table__.insert(), [
+        {'id': i, 'username': f'member{i}', 'fullname': f'Member {i}', 'email': f'member{i}@example.com',
+         'outstanding_debt': 0} for i in range(1, count + 1)])
+    db.session.execute(Book.__table__.insert(), [
+        {'id': i, 'title': f'Book {i}', 'author': f'Author {i}', 'isbn': f'isbn-{i}', 'publisher': 'Benchmark',
+         'Quantity': 1} for i in range(1, count + 1)])
+    db.session.commit()
+
+
+def _check_returned(count):
+    from app.models import Transaction
+
+    returned = Transaction.query.filter(Transaction.return_date.isnot(None)).count()
+    if returned != count:
+        raise RuntimeError(f'Expected {count} returned loans, found {returned}')
+
+
+def _timed(label, count, function):
+    started = time.perf_counter()
+    function()
+    return label, count, time.perf_counter() - started
+
+
+def benchmark_circulation(count=200, batch_size=None):
+    """
+    Issue and return count books through the single-item routes and through the batch endpoint
+    """
+    results = []
+
+    with benchmark_app() as app:
+        seed_loans(count)
+        client = app.test_client()
+
+        def issue_singly():
+            for i in range(1, count + 1):
+                client.post('/issue-book', data={'member': i, 'book': i})
+
+        def return_singly():
+            for transaction_id in range(1, count + 1):
+                client.post(f'/return-book/{transaction_id}',
+                            data={'transaction_id': transaction_id, 'days_rented': 0, 'total_fee': 50,
+                                  'Amount_paid': 50})
+
+        results.append(_timed('issue_book, one request per book', count, issue_singly))
+        results.append(_timed('return_book, one request per book', count, return_singly))
+        _check_returned(count)
+
+    with benchmark_app() as app:
+        seed_loans(count)
+        client = app.test_client()
+        size = batch_size or app.config['CIRCULATION_BATCH_LIMIT']
+
+        def run_batches(operations):
+            for start in range(0, len(operations), size):
+                response = client.post('/circulation/batch', json={'operations': operations[start:start + size]})
+                if response.status_code != 200 or response.get_json()['failed']:
+                    raise RuntimeError(f'Batch failed: {response.get_data(as_text=True)[:200]}')
+
+        issues = [{'op': 'issue', 'member_id': i, 'book_id': i} for i in range(1, count + 1)]
+        returns = [{'op': 'return', 'transaction_id': i, 'amount_paid': 50} for i in range(1, count + 1)]
+        results.append(_timed(f'circulation batch issues, {size} per request', count, lambda: run_batches(issues)))
+        results.append(_timed(f'circulation batch returns, {size} per request', count, lambda: run_batches(returns)))
+        _check_returned(count)
+
+    return results
+
+
+def benchmark_engine(profile, readers=4, writers=2, seconds=5.0, rows=10000):
+    """
+    Run reader and writer threads against one database for a number of seconds with the engine
+    profile, and count the reads, writes and lock errors
+    """
+    from sqlalchemy import select, update
+    from sqlalchemy.exc import OperationalError
+    from app.models import Book, db
+
+    with benchmark_app(DATABASE_PROFILE=profile) as app:
+        seed_loans(rows)
+        counts = {'read': 0, 'write': 0, 'error': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def worker(kind):
+            done = errors = 0
+            with app.app_context():
+                while time.perf_counter() < deadline:
+                    start = random.randint(1, rows)
+                    try:
+                        if kind == 'read':
+                            # A page of the catalog, as all_books reads it
+                            db.session.execute(
+                                select(Book).where(Book.id >= start).order_by(Book.id).limit(50)).all()
+                            db.session.rollback()
+                        else:
+                            # A copy issued and one returned, as issue_book and return_book write them
+                            db.session.execute(update(Book).where(Book.id == start).values(Quantity=Book.Quantity - 1))
+                            db.session.commit()
+                            db.session.execute(update(Book).where(Book.id == start).values(Quantity=Book.Quantity + 1))
+                            db.session.commit()
+                        done += 1
+                    except OperationalError:
+                        db.session.rollback()
+                        errors += 1
+            with lock:
+                counts[kind] += done
+                counts['error'] += errors
+
+        threads = [threading.Thread(target=worker, args=('read',)) for _ in range(readers)]
+        threads += [threading.Thread(target=worker, args=('write',)) for _ in range(writers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    return [
+        (f'{profile}: reads ({readers} threads)', counts['read'], elapsed),
+        (f'{profile}: write transactions ({writers} threads)', counts['write'] * 2, elapsed),
+        (f'{profile}: lock errors', counts['error'], elapsed),
+    ]
+
+
+def benchmark_templates(renders=300):
+    """
+    Render pages with the template cache off, so every render parses its templates again, and with
+    the bounded cache. Then time compiling every template at startup from source and from the
+    bytecode cache
+    """
+    from app.templating import precompile_templates
+
+    pages = ('/login', '/add-book', '/issue-book', '/all-books', '/transactions', '/home')
+    results = []
+    for label, size in (('template cache off', 0), ('bounded template cache', 400)):
+        with benchmark_app(TEMPLATE_CACHE_SIZE=size, PAGE_CACHE_SIZE=0) as app:
+            seed_loans(50)
+            client = app.test_client()
+
+            def render():
+                for i in range(renders):
+                    response = client.get(pages[i % len(pages)])
+                    if response.status_code != 200:
+                        raise RuntimeError(f'{pages[i % len(pages)]} answered {response.status_code}')
+
+            results.append(_timed(f'{label}: page renders', renders, render))
+
+    directory = tempfile.mkdtemp(prefix='lms-bytecode-')
+    try:
+        for label in ('startup compile from source', 'startup compile from bytecode cache'):
+            with benchmark_app(TEMPLATE_BYTECODE_DIR=directory) as app:
+                count, seconds = precompile_templates(app)
+                results.append((f'{label}: templates', count, seconds))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+# Dependencies only some requests or commands need, which must not be imported while the app starts
+LAZY_MODULES = ('requests', 'numpy', 'flask_bootstrap')
+
+STARTUP_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+from app import create_app
+create_app()
+print(f'startup {(time.perf_counter() - started) * 1000:.1f}', file=sys.stderr)
+"""
+
+
+def parse_importtime(output):
+    """
+    Return the cumulative import time in microseconds of each module in python -X importtime output
+    """
+    imports = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports[name.strip()] = int(cumulative)
+    return imports
+
+
+def benchmark_startup(runs=5):
+    """
+    Create the app in runs fresh interpreters under python -X importtime. Returns the startup times
+    in milliseconds and the import times of the slowest run
+    """
+    import subprocess
+    import sys
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = []
+    slowest = None
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT], cwd=root,
+                                   capture_output=True, text=True, check=True)
+        milliseconds = float(completed.stderr.strip().splitlines()[-1].split()[-1])
+        timings.append(milliseconds)
+        if slowest is None or milliseconds >= max(timings):
+            slowest = parse_importtime(completed.stderr)
+    return timings, slowest
+
+
+class BenchmarkState:
+    """
+    A class that hands out the rows the route benchmarks work on, so no two write requests collide
+    """
+
+    def __init__(self, library, seed=0, pool_size=1000):
+        from sqlalchemy import select
+        from app.models import Book, Member, Transaction, db
+
+        self.library = library
+        self.random = random.Random(seed)
+        self._unique = itertools.count(1)
+
+        open_members = select(Transaction.member_id).where(Transaction.return_date.is_(None),
+                                                           Transaction.member_id.isnot(None))
+        self.free_members = db.session.scalars(
+            select(Member.id).where(Member.id.notin_(open_members)).order_by(Member.id.desc()).limit(pool_size)).all()
+        self.available_books = db.session.scalars(
+            select(Book.id).where(Book.Quantity >= 2).order_by(Book.id.desc()).limit(pool_size)).all()
+        self.open_loans = db.session.scalars(
+            select(Transaction.transaction_id).where(Transaction.return_date.is_(None))
+            .order_by(Transaction.transaction_id).limit(pool_size)).all()
+
+        # A member with a password to log in as
+        self.username, self.password = 'benchlogin', 'benchmark1'
+        member = Member(username=self.username, fullname='Bench Login', email='benchlogin@example.org')
+        member.create_password(self.password)
+        db.session.add(member)
+        db.session.commit()
+
+    def unique(self):
+        return next(self._unique)
+
+    def book_id(self):
+        return self.random.randint(1, self.library.books)
+
+    def member_id(self):
+        return self.random.randint(1, self.library.members)
+
+    def book(self, book_id=None):
+        from app.models import Book, db
+
+        book = db.session.get(Book, book_id or self.book_id())
+        return {'title': book.title, 'author': book.author, 'isbn': book.isbn, 'publisher': book.publisher}
+
+    def member(self, member_id):
+        from app.models import Member, db
+
+        member = db.session.get(Member, member_id)
+        debt = member.outstanding_debt or 0
+        return {'username': member.username, 'fullname': member.fullname, 'email': member.email,
+                'outstanding_debt': debt, 'displayed_debt': debt}
+
+    def word(self):
+        from app.synthetic import TITLE_WORDS
+
+        return self.random.choice(TITLE_WORDS)
+
+    def name(self):
+        from app.synthetic import FIRST_NAMES
+
+        return self.random.choice(FIRST_NAMES)
+
+
+class RouteBenchmark:
+    """
+    A class that describes the requests of one route benchmark. target is a url, or a function of
+    the BenchmarkState returning the url or (url, body), called before each request outside the timing.
+    expected holds the statuses the route may answer with
+    """
+
+    def __init__(self, name, method, target, body='data', iterations=None, expected=EXPECTED_STATUSES):
+        self.name = name
+        self.method = method
+        self.target = target
+        self.body = body
+        self.iterations = iterations
+        self.expected = expected
+
+    def build(self, state):
+        """
+        Return the url and test client arguments of the next request
+        """
+        target = self.target(state) if callable(self.target) else self.target
+        url, body = target if isinstance(target, tuple) else (target, None)
+        arguments = {'method': self.method}
+        if body is not None:
+            arguments[self.body] = body
+        return url, arguments
+
+
+def _register(state):
+    n = state.unique()
+    return '/register', {'username': f'bench{n}', 'fullname': 'Bench Member', 'email': f'bench{n}@example.org',
+                         'password': 'benchmark1', 'confirm_password': 'benchmark1'}
+
+
+def _import_selected(state):
+    selected = {'title': f'Imported {state.word()}', 'authors': state.name(), 'isbn': f'F{state.unique():012d}',
+                'publisher': 'Frappe'}
+    return '/import-books/selected', {'quantity': 1, 'selected': json.dumps(selected)}
+
+
+def _add_book(state):
+    return '/add-book', {'title': f'Added {state.word()}', 'author': state.name(),
+                         'isbn': f'A{state.unique():012d}', 'publisher': 'Benchmark', 'quantity': 3}
+
+
+def _ingest_upload(state):
+    rows = ['title,author,isbn,publisher,quantity']
+    for _ in range(20):
+        rows.append(f'Ingested {state.word()},{state.name()} Writer,I{state.unique():012d},Benchmark,2')
+    return '/ingest-books', {'file': (io.BytesIO('\n'.join(rows).encode()), 'books.csv')}
+
+
+def _delete_book(state):
+    book = state.book(state.available_books.pop())
+    return f"/delete-book?isbn={book['isbn']}", {**book, 'quantity': 1}
+
+
+def _update_book(state):
+    book_id = state.book_id()
+    return f'/update-book/{book_id}', state.book(book_id)
+
+
+def _update_member(state):
+    member_id = state.member_id()
+    return f'/update-members/{member_id}', state.member(member_id)
+
+
+def _add_member(state):
+    n = state.unique()
+    return '/add-members', {'username': f'added{n}', 'fullname': 'Added Member', 'email': f'added{n}@example.org'}
+
+
+def _issue_book(state):
+    return '/issue-book', {'member': state.free_members.pop(), 'book': state.available_books.pop()}
+
+
+def _return_book(state):
+    transaction_id = state.open_loans.pop()
+    return f'/return-book/{transaction_id}', {'transaction_id': transaction_id, 'days_rented': 0, 'total_fee': 50,
+                                              'Amount_paid': 50}
+
+
+def _circulation_batch(state, size=20):
+    operations = [{'op': 'issue', 'member_id': state.free_members.pop(), 'book_id': state.available_books.pop()}
+                  for _ in range(size)]
+    return '/circulation/batch', {'operations': operations}
+
+
+# Every blueprint route. The search POST of import_books is left out because it calls the Frappe API
+ROUTE_BENCHMARKS = [
+    RouteBenchmark('auth.login GET', 'GET', '/login'),
+    RouteBenchmark('auth.login POST', 'POST',
+                   lambda state: ('/login', {'username': state.username, 'password': state.password})),
+    RouteBenchmark('auth.register GET', 'GET', '/register'),
+    RouteBenchmark('auth.register POST', 'POST', _register),
+    RouteBenchmark('auth.home', 'GET', '/home'),
+    RouteBenchmark('auth.logout', 'GET', '/logout'),
+    RouteBenchmark('auth.hashing_stats', 'GET', '/hashing-stats'),
+    RouteBenchmark('auth.identity_cache_stats', 'GET', '/identity-cache-stats'),
+    RouteBenchmark('auth.page_cache_stats', 'GET', '/page-cache-stats'),
+    RouteBenchmark('book.import_books GET', 'GET', '/import-books'),
+    RouteBenchmark('book.import_selected_books', 'POST', _import_selected),
+    RouteBenchmark('book.add_book GET', 'GET', '/add-book'),
+    RouteBenchmark('book.add_book POST', 'POST', _add_book),
+    RouteBenchmark('book.ingest_books_file GET', 'GET', '/ingest-books'),
+    RouteBenchmark('book.ingest_books_file POST', 'POST', _ingest_upload),
+    RouteBenchmark('book.delete_book GET', 'GET', lambda state: f"/delete-book?isbn={state.book()['isbn']}"),
+    RouteBenchmark('book.delete_book POST', 'POST', _delete_book),
+    RouteBenchmark('book.update_book GET', 'GET', lambda state: f'/update-book/{state.book_id()}'),
+    RouteBenchmark('book.update_book POST', 'POST', _update_book),
+    RouteBenchmark('book.search_books', 'GET', lambda state: f'/search-books?q={state.word()}'),
+    RouteBenchmark('book.all_books', 'GET', '/all-books'),
+    RouteBenchmark('book.all_books by title', 'GET', '/all-books?sort=title'),
+    RouteBenchmark('book.lookup_books', 'GET', lambda state: f'/books/lookup?q={state.word()[:3]}'),
+    RouteBenchmark('member.search_members', 'GET', lambda state: f'/search-members?q={state.name()}'),
+    RouteBenchmark('member.update_members GET', 'GET', lambda state: f'/update-members/{state.member_id()}'),
+    RouteBenchmark('member.update_members POST', 'POST', _update_member, expected=(302,)),
+    RouteBenchmark('member.delete_members GET', 'GET', lambda state: f'/delete-members/{state.member_id()}'),
+    RouteBenchmark('member.delete_members POST', 'POST', lambda state: f'/delete-members/{state.free_members.pop()}'),
+    RouteBenchmark('member.add_member GET', 'GET', '/add-members'),
+    RouteBenchmark('member.add_member POST', 'POST', _add_member),
+    RouteBenchmark('member.all_members', 'GET', '/all-members'),
+    RouteBenchmark('member.all_members by fullname', 'GET', '/all-members?sort=fullname'),
+    RouteBenchmark('member.lookup_members', 'GET', lambda state: f'/members/lookup?q={state.name()[:3]}'),
+    RouteBenchmark('transactions.issue_book GET', 'GET', '/issue-book'),
+    RouteBenchmark('transactions.issue_book POST', 'POST', _issue_book),
+    RouteBenchmark('transactions.return_book GET', 'GET', lambda state: f'/return-book/{state.open_loans[-1]}'),
+    RouteBenchmark('transactions.return_book POST', 'POST', _return_book),
+    RouteBenchmark('transactions.view_transactions', 'GET', '/transactions'),
+    RouteBenchmark('transactions.view_transactions by member', 'GET', lambda state: f'/transactions?member={state.member_id()}'),
+    RouteBenchmark('transactions.view_transactions open', 'GET', '/transactions?status=open'),
+    RouteBenchmark('transactions.overdue_report GET', 'GET', '/overdue'),
+    RouteBenchmark('transactions.overdue_report POST', 'POST', '/overdue', iterations=3),
+    RouteBenchmark('transactions.debt_report GET', 'GET', '/debts'),
+    RouteBenchmark('transactions.analytics_report', 'GET', '/analytics'),
+    RouteBenchmark('transactions.circulation_batch', 'POST', _circulation_batch, body='json'),
+    RouteBenchmark('api.list_books', 'GET', '/api/v1/books'),
+    RouteBenchmark('api.get_book', 'GET', lambda state: f'/api/v1/books/{state.book_id()}'),
+    RouteBenchmark('api.list_members', 'GET', '/api/v1/members'),
+    RouteBenchmark('api.get_member', 'GET', lambda state: f'/api/v1/members/{state.member_id()}'),
+    RouteBenchmark('api.list_transactions', 'GET', '/api/v1/transactions?status=open'),
+    RouteBenchmark('api.get_transaction', 'GET', lambda state: f'/api/v1/transactions/{state.open_loans[0]}'),
+    RouteBenchmark('api.analytics_daily', 'GET', '/api/v1/analytics/daily'),
+    RouteBenchmark('api.analytics_books', 'GET', '/api/v1/analytics/books?by=revenue'),
+    RouteBenchmark('api.analytics_members', 'GET', '/api/v1/analytics/members'),
+    RouteBenchmark('api.export', 'GET', '/api/v1/export/books.csv?compress=gzip', iterations=3),
+]
+
+
+class QueryCounter:
+    """
+    A class that counts the statements the engines execute while it is active
+    """
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+
+        self.engines = list(engines)
+        self.count = 0
+        self.active = False
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._executed)
+
+    def _executed(self, *args):
+        if self.active:
+            self.count += 1
+
+    def remove(self):
+        from sqlalchemy import event
+
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self._executed)
+
+
+def _percentile(latencies, percent):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def run_route_benchmark(client, benchmark, state, counter, iterations, warmup=2):
+    """
+    Time iterations requests of one route after warmup untimed ones, then trace one more request's
+    memory. Returns the result dict of the route
+    """
+    latencies = []
+    queries = 0
+    unexpected = []
+    for iteration in range(warmup + iterations + 1):
+        url, arguments = benchmark.build(state)
+        traced = iteration == warmup + iterations
+        if traced:
+            tracemalloc.start()
+        counter.count = 0
+        counter.active = True
+        started = time.perf_counter()
+        response = client.open(url, **arguments)
+        # Read the whole body, so streamed responses are timed to their last byte and closed in order
+        response.get_data()
+        response.close()
+        elapsed = time.perf_counter() - started
+        counter.active = False
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if response.status_code not in benchmark.expected:
+            unexpected.append(response.status_code)
+        if warmup <= iteration < warmup + iterations:
+            latencies.append(elapsed * 1000)
+            queries += counter.count
+
+    return {
+        'requests': iterations,
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'p99_ms': _percentile(latencies, 99),
+        'max_ms': max(latencies),
+        'queries': queries / iterations,
+        'peak_kib': peak / 1024,
+        'unexpected_statuses': sorted(set(unexpected)),
+    }
+
+
+def benchmark_routes(books=10000, members=10000, transactions=100000, seed=0, iterations=20, routes=None):
+    """
+    Load a synthetic library and run the route benchmarks whose name starts with one of routes
+    (all by default). Returns the report: the dataset and the result of each route
+    """
+    from app import db
+    from app.synthetic import finish_library, generate_library
+
+    selected = [benchmark for benchmark in ROUTE_BENCHMARKS
+                if not routes or any(benchmark.name.startswith(route) for route in routes)]
+    with benchmark_app() as app:
+        library = generate_library(books, members, transactions, seed=seed)
+        finish_library()
+        # Each request may consume rows: a circulation batch issues 20 books to 20 members
+        state = BenchmarkState(library, seed, pool_size=(iterations + 3) * 30)
+        client = app.test_client()
+        counter = QueryCounter(db.engines.values())
+        results = {}
+        try:
+            for benchmark in selected:
+                results[benchmark.name] = run_route_benchmark(client, benchmark, state, counter,
+                                                              benchmark.iterations or iterations)
+        finally:
+            counter.remove()
+
+    return {'dataset': library.as_dict(), 'iterations': iterations, 'results': results}
+
+
+def save_baseline(report, path):
+    """
+    Write a route benchmark report to path as the baseline of later runs
+    """
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare_to_baseline(report, baseline, latency_threshold=LATENCY_THRESHOLD, memory_threshold=MEMORY_THRESHOLD):
+    """
+    Return a message for every route of report that got slower, ran more queries or used more
+    memory than in baseline, beyond the thresholds
+    """
+    if report['dataset'] != baseline['dataset']:
+        raise ValueError(f"The baseline was recorded on another dataset: {baseline['dataset']}")
+
+    regressions = []
+    for name, result in report['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        if result['unexpected_statuses'] and not before['unexpected_statuses']:
+            regressions.append(f"{name}: answered {', '.join(map(str, result['unexpected_statuses']))}")
+        if result['p95_ms'] > before['p95_ms'] * (1 + latency_threshold) + LATENCY_FLOOR_MS:
+            regressions.append(f"{name}: p95 {before['p95_ms']:.1f} ms -> {result['p95_ms']:.1f} ms")
+        if result['queries'] > before['queries']:
+            regressions.append(f"{name}: {before['queries']:g} -> {result['queries']:g} queries per request")
+        if result['peak_kib'] > before['peak_kib'] * (1 + memory_threshold) + MEMORY_FLOOR_KIB:
+            regressions.append(f"{name}: peak memory {before['peak_kib']:.0f} KiB -> {result['peak_kib']:.0f} KiB")
+    return regressions
@@ -0,0 +1,188 @@
+"""
+A module that writes books to the catalog in batches
+"""
+import csv
+import io
+import json
+import time
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+from app.models import Book, db
+
+
+def merge_book_rows(rows):
+    """
+    Merge rows sharing an ISBN into one row whose Quantity is the sum of theirs
+    """
+    merged = {}
+    for row in rows:
+        if row['isbn'] in merged:
+            merged[row['isbn']]['Quantity'] += row['Quantity']
+        else:
+            merged[row['isbn']] = dict(row)
+    return list(merged.values())
+
+
+def upsert_books(rows):
+    """
+    Add rows (dicts of title, author, isbn, publisher and Quantity) to the catalog in the current
+    transaction. New ISBNs are inserted and the Quantity of existing ISBNs is incremented by one
+    INSERT ... ON CONFLICT statement executed for all rows. The caller commits.
+    """
+    rows = merge_book_rows(rows)
+    if not rows:
+        return 0
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        # A single-row statement executed with many parameter sets is compiled only once
+        statement = insert(Book.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=[Book.isbn],
+            set_={'Quantity': Book.Quantity + statement.excluded.Quantity},
+        )
+        db.session.execute(statement, rows)
+        return len(rows)
+
+    # Databases without ON CONFLICT support fall back to one lookup per ISBN
+    existing = {book.isbn: book for book in Book.query.filter(Book.isbn.in_([row['isbn'] for row in rows]))}
+    for row in rows:
+        if row['isbn'] in existing:
+            existing[row['isbn']].Quantity += row['Quantity']
+        else:
+            db.session.add(Book(**row))
+    return len(rows)
+
+
+class IngestReport:
+    """
+    A class that collects the outcome of a bulk load: row counts, per-row errors and throughput
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.loaded = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def read_book_rows(stream, file_format):
+    """
+    Stream (line number, row, error) tuples from a CSV or JSONL text stream.
+
+    Column names are matched case-insensitively and 'authors' is accepted for 'author', so Frappe
+    exports can be loaded as they are.
+    """
+    def normalize_row(row):
+        row = {(key or '').strip().lower(): value for key, value in row.items()}
+        if 'author' not in row and 'authors' in row:
+            row['author'] = row.pop('authors')
+        return row
+
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, normalize_row(row), None
+        return
+
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exception:
+            yield line_number, None, f'invalid JSON: {exception}'
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, 'expected a JSON object'
+            continue
+        yield line_number, normalize_row(row), None
+
+
+def copy_books(rows):
+    """
+    PostgreSQL only: COPY rows into a temporary staging table and upsert them into books from there
+    """
+    connection = db.session.connection()
+    connection.execute(text(
+        'CREATE TEMP TABLE IF NOT EXISTS books_staging '
+        '(title text, author text, isbn text, publisher text, "Quantity" integer) ON COMMIT DELETE ROWS'
+    ))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row['title'], row['author'], row['isbn'], row['publisher'], row['Quantity']])
+    buffer.seek(0)
+
+    cursor = connection.connection.cursor()
+    cursor.copy_expert('COPY books_staging (title, author, isbn, publisher, "Quantity") FROM STDIN WITH (FORMAT csv)',
+                       buffer)
+    connection.execute(text(
+        'INSERT INTO books (title, author, isbn, publisher, "Quantity") '
+        'SELECT min(title), min(author), isbn, min(publisher), sum("Quantity") FROM books_staging GROUP BY isbn '
+        'ON CONFLICT (isbn) DO UPDATE SET "Quantity" = books."Quantity" + excluded."Quantity"'
+    ))
+
+
+def _load_batch(batch, report):
+    books = [book for _, book in batch]
+    try:
+        if db.session.get_bind().dialect.name == 'postgresql':
+            copy_books(books)
+        else:
+            upsert_books(books)
+        db.session.commit()
+        report.loaded += len(batch)
+        return
+    except SQLAlchemyError:
+        db.session.rollback()
+
+    # Find the offending rows by loading the failed batch one row at a time
+    for line_number, book in batch:
+        try:
+            upsert_books([book])
+            db.session.commit()
+            report.loaded += 1
+        except SQLAlchemyError as exception:
+            db.session.rollback()
+            report.errors.append((line_number, str(getattr(exception, 'orig', None) or exception)))
+
+
+def ingest_books(rows, validate, batch_size=1000):
+    """
+    Load (line number, row, error) tuples into the catalog, committing every batch_size valid rows.
+
+    Every row is checked with validate, which returns the book for upsert_books and a dict of
+    errors. Invalid rows are recorded in the report and skipped without aborting the load.
+    """
+    report = IngestReport()
+    batch = []
+    for line_number, row, error in rows:
+        report.rows += 1
+        if error is None:
+            book, errors = validate(row)
+            if errors:
+                error = '; '.join(f"{field}: {' '.join(messages)}" for field, messages in errors.items())
+        if error:
+            report.errors.append((line_number, error))
+            continue
+
+        batch.append((line_number, book))
+        if len(batch) >= batch_size:
+            _load_batch(batch, report)
+            batch = []
+
+    if batch:
+        _load_batch(batch, report)
+    report.finish()
+    return report
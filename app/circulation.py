@@ -0,0 +1,257 @@
+"""
+A module that issues and returns many books in one transaction.
+
+A batch is a list of operations, {"op": "issue", "member_id": ..., "book_id": ...} or
+{"op": "return", "transaction_id": ..., "amount_paid": ...}, checked in order against the members,
+books and open loans fetched with a few IN (...) queries. Valid operations are applied together with
+set-based statements and committed once; invalid ones are reported and skipped. If another request
+changes the same loans, copies or debts between the checks and the writes, the whole batch is rolled
+back with CirculationConflict.
+"""
+from datetime import date
+from sqlalchemy import bindparam, delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from app.analytics import record_circulation
+from app.debts import post_returns
+from app.fees import MAX_OUTSTANDING_DEBT, loan_fee
+from app.models import Book, FeeAccrual, Member, Transaction, db
+
+
+class CirculationConflict(Exception):
+    """
+    Raised when the loans or copies a batch checked were changed before it was applied
+    """
+
+
+class CirculationResult:
+    """
+    A class that holds the outcome of one operation of a batch
+    """
+
+    def __init__(self, index, op):
+        self.index = index
+        self.op = op
+        self.error = None
+        self.values = {}
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def fail(self, error):
+        self.error = error
+        return self
+
+    def to_dict(self):
+        result = {'index': self.index, 'op': self.op, 'status': 'ok' if self.ok else 'error'}
+        if self.ok:
+            result.update(self.values)
+        else:
+            result['error'] = self.error
+        return result
+
+
+def _integer(operation, field):
+    value = operation.get(field)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f'{field} must be an integer')
+    return value
+
+
+def _amount(operation, field):
+    value = operation.get(field, 0)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ValueError(f'{field} must be a non-negative number')
+    return float(value)
+
+
+def parse_operations(operations):
+    """
+    Turn the raw operations of a batch into (result, arguments) pairs. Malformed operations get a
+    failed result and None arguments
+    """
+    parsed = []
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        result = CirculationResult(index, op)
+        try:
+            if op == 'issue':
+                arguments = (_integer(operation, 'member_id'), _integer(operation, 'book_id'))
+            elif op == 'return':
+                arguments = (_integer(operation, 'transaction_id'), _amount(operation, 'amount_paid'))
+            else:
+                raise ValueError("op must be 'issue' or 'return'")
+        except ValueError as exception:
+            parsed.append((result.fail(str(exception)), None))
+            continue
+        parsed.append((result, arguments))
+    return parsed
+
+
+def _fetch(parsed):
+    """
+    Fetch everything the batch needs to be checked with four IN (...) queries
+    """
+    return_ids = {arguments[0] for result, arguments in parsed if arguments and result.op == 'return'}
+    loans = {}
+    if return_ids:
+        loans = {loan.transaction_id: loan for loan in db.session.execute(
+            select(Transaction.transaction_id, Transaction.member_id, Transaction.book_id,
+                   Transaction.borrowed_date, Transaction.return_date)
+            .where(Transaction.transaction_id.in_(return_ids)))}
+
+    member_ids = {arguments[0] for result, arguments in parsed if arguments and result.op == 'issue'}
+    member_ids |= {loan.member_id for loan in loans.values() if loan.member_id is not None}
+    book_ids = {arguments[1] for result, arguments in parsed if arguments and result.op == 'issue'}
+    book_ids |= {loan.book_id for loan in loans.values() if loan.book_id is not None}
+
+    members = {}
+    open_loans = {}
+    if member_ids:
+        members = {member.id: member for member in db.session.execute(
+            select(Member.id, Member.fullname, func.coalesce(Member.outstanding_debt, 0).label('debt'))
+            .where(Member.id.in_(member_ids)))}
+        open_loans = dict(db.session.execute(
+            select(Transaction.member_id, Transaction.transaction_id)
+            .where(Transaction.member_id.in_(member_ids), Transaction.return_date.is_(None))).all())
+    books = {}
+    if book_ids:
+        books = {book.id: book for book in db.session.execute(
+            select(Book.id, Book.title, func.coalesce(Book.Quantity, 0).label('quantity'))
+            .where(Book.id.in_(book_ids)))}
+    return loans, members, books, open_loans
+
+
+def check_batch(parsed, today):
+    """
+    Check the operations in order against the fetched rows, as if each valid one had already been
+    applied. Returns the issues, returns and book quantity changes to apply
+    """
+    loans, members, books, open_loans = _fetch(parsed)
+    quantities = {book_id: book.quantity for book_id, book in books.items()}
+    debts = {member_id: member.debt for member_id, member in members.items()}
+    issues, returns = [], []
+    returned_ids = set()
+
+    for result, arguments in parsed:
+        if arguments is None:
+            continue
+
+        if result.op == 'issue':
+            member_id, book_id = arguments
+            if member_id not in members:
+                result.fail('Member not found')
+            elif book_id not in books:
+                result.fail('Book not found')
+            elif member_id in open_loans:
+                result.fail(f'{members[member_id].fullname} has already borrowed a book')
+            elif quantities[book_id] < 1:
+                result.fail(f"Book '{books[book_id].title}' is not available for issue")
+            else:
+                open_loans[member_id] = None
+                quantities[book_id] -= 1
+                issues.append((result, member_id, book_id))
+            continue
+
+        transaction_id, amount_paid = arguments
+        loan = loans.get(transaction_id)
+        if loan is None:
+            result.fail('Transaction not found')
+            continue
+        if loan.return_date is not None or transaction_id in returned_ids:
+            result.fail('This book has already been returned')
+            continue
+        days_rented, total_fee = loan_fee(loan.borrowed_date, today)
+        if amount_paid > total_fee:
+            result.fail(f'Please enter a lower amount. The fee due is {total_fee}')
+            continue
+        member_id = loan.member_id
+        if member_id in debts and debts[member_id] + total_fee - amount_paid > MAX_OUTSTANDING_DEBT:
+            result.fail(f'Outstanding debt cannot exceed Rs. {MAX_OUTSTANDING_DEBT}')
+            continue
+
+        returned_ids.add(transaction_id)
+        open_loans.pop(member_id, None)
+        if loan.book_id in quantities:
+            quantities[loan.book_id] += 1
+        if member_id in debts:
+            debts[member_id] += total_fee - amount_paid
+        result.values = {'transaction_id': transaction_id, 'days_rented': days_rented, 'total_fee': total_fee,
+                         'amount_paid': amount_paid}
+        returns.append((result, transaction_id, member_id if member_id in debts else None, loan.book_id, total_fee,
+                        amount_paid))
+
+    book_changes = {book_id: quantities[book_id] - books[book_id].quantity for book_id in books
+                    if quantities[book_id] != books[book_id].quantity}
+    return issues, returns, book_changes
+
+
+def _apply(issues, returns, book_changes, today):
+    if returns:
+        # Close the loans only if they are still open
+        returned = db.session.execute(
+            update(Transaction.__table__)
+            .where(Transaction.transaction_id == bindparam('key'), Transaction.return_date.is_(None))
+            .values(return_date=today, total_fee=bindparam('fee'), amount_paid=bindparam('paid')),
+            [{'key': transaction_id, 'fee': total_fee, 'paid': amount_paid}
+             for _, transaction_id, _, _, total_fee, amount_paid in returns]
+        ).rowcount
+        if returned != len(returns):
+            raise CirculationConflict('Some of the loans were returned by another request')
+        db.session.execute(delete(FeeAccrual).where(
+            FeeAccrual.transaction_id.in_([transaction_id for _, transaction_id, *_ in returns])))
+
+        # Charge the fees to the members, each only if their debt stays within the limit
+        if not post_returns([(member_id, transaction_id, total_fee, amount_paid)
+                             for _, transaction_id, member_id, _, total_fee, amount_paid in returns]):
+            raise CirculationConflict("Some of the members' debts were changed by another request")
+
+    if book_changes:
+        # Change each book's copies by the net of its issues and returns, never below zero
+        changed = db.session.execute(
+            update(Book.__table__)
+            .where(Book.id == bindparam('key'), func.coalesce(Book.Quantity, 0) + bindparam('change') >= 0)
+            .values(Quantity=func.coalesce(Book.Quantity, 0) + bindparam('change')),
+            [{'key': book_id, 'change': change} for book_id, change in book_changes.items()]
+        ).rowcount
+        if changed != len(book_changes):
+            raise CirculationConflict('Some of the books were issued by another request')
+
+    if issues:
+        # The partial unique index on open loans rejects a loan issued meanwhile by another request
+        table = Transaction.__table__
+        rows = [{'member_id': member_id, 'book_id': book_id, 'borrowed_date': today} for _, member_id, book_id in issues]
+        if db.session.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+            transaction_ids = db.session.execute(
+                table.insert().returning(table.c.transaction_id, sort_by_parameter_order=True), rows
+            ).scalars().all()
+        else:
+            transaction_ids = [db.session.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+        for (result, member_id, book_id), transaction_id in zip(issues, transaction_ids):
+            result.values = {'transaction_id': transaction_id, 'member_id': member_id, 'book_id': book_id}
+
+    record_circulation(
+        issues=[(today, book_id, member_id) for _, member_id, book_id in issues],
+        returns=[(today, book_id, member_id, total_fee, amount_paid)
+                 for _, _, member_id, book_id, total_fee, amount_paid in returns])
+
+
+def run_batch(operations, today=None):
+    """
+    Check and apply a batch of operations in one transaction. Returns a CirculationResult per
+    operation, in order. Raises CirculationConflict, after rolling back, if a concurrent request
+    changed the rows the batch depends on.
+    """
+    today = today or date.today()
+    parsed = parse_operations(operations)
+    try:
+        issues, returns, book_changes = check_batch(parsed, today)
+        _apply(issues, returns, book_changes, today)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise CirculationConflict('A member was issued a book by another request') from None
+    except CirculationConflict:
+        db.session.rollback()
+        raise
+    return [result for result, _ in parsed]
@@ -0,0 +1,385 @@
+"""
+A module that contains the flask command line commands used to maintain the library database
+"""
+import click
+
+
+@click.command('rebuild-search-index')
+def rebuild_search_index():
+    """
+    Rebuild the book and member search indexes from their tables
+    """
+    from app.search import rebuild_book_search, rebuild_member_search
+
+    dialect = rebuild_book_search()
+    click.echo(f'Book search index rebuilt ({dialect})')
+    rebuild_member_search()
+    click.echo('Member search index rebuilt')
+
+
+@click.command('ingest-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='File format, guessed from the extension by default.')
+@click.option('--batch-size', type=int, help='Rows committed per batch, INGEST_BATCH_SIZE by default.')
+def ingest_books_command(path, file_format, batch_size):
+    """
+    Bulk load books from a CSV or JSONL file, adding to the quantity of existing ISBNs
+    """
+    from flask import current_app
+    from app.catalog import ingest_books, read_book_rows
+    from app.routes.book import book_row_validator
+
+    file_format = file_format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    batch_size = batch_size or current_app.config['INGEST_BATCH_SIZE']
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        report = ingest_books(read_book_rows(stream, file_format), book_row_validator(), batch_size=batch_size)
+
+    for line_number, error in report.errors:
+        click.echo(f'line {line_number}: {error}', err=True)
+    click.echo(f'Loaded {report.loaded} of {report.rows} row(s) in {report.elapsed:.2f}s '
+               f'({report.rows_per_second:.0f} rows/s), {len(report.errors)} error(s)')
+
+
+@click.command('reconcile-counters')
+def reconcile_counters_command():
+    """
+    Recompute the home page counters from the tables
+    """
+    from app.counters import reconcile_counters
+
+    for name, value in reconcile_counters().items():
+        click.echo(f'{name}: {value}')
+
+
+@click.command('check-query-plans')
+@click.option('--verbose', is_flag=True, help='Print every plan, not only the failing ones.')
+def check_query_plans_command(verbose):
+    """
+    Fail if a hot query falls back to a full table scan (SQLite only)
+    """
+    from app.query_plans import check_query_plans
+
+    checks = check_query_plans()
+    failures = [check for check in checks if check.full_scans]
+    for check in checks:
+        if verbose or check.full_scans:
+            status = 'FULL SCAN' if check.full_scans else 'ok'
+            click.echo(f'{status}: {check.name}')
+            click.echo(f'  {check.statement}')
+            for step in check.plan:
+                click.echo(f'    {step}')
+    click.echo(f'{len(checks)} statement(s) checked, {len(failures)} with full table scans')
+    if failures:
+        raise SystemExit(1)
+
+
+@click.command('accrue-fees')
+@click.option('--as-of', type=click.DateTime(formats=['%Y-%m-%d']), help='Accrue fees as of this date, today by default.')
+@click.option('--batch-size', type=int, help='Rows read and written per batch, FEE_ACCRUAL_BATCH_SIZE by default.')
+def accrue_fees_command(as_of, batch_size):
+    """
+    Accrue the fees of every open loan, replace the snapshot and print the overdue report
+    """
+    from flask import current_app
+    from app.fees import accrue_fees
+
+    batch_size = batch_size or current_app.config['FEE_ACCRUAL_BATCH_SIZE']
+    run = accrue_fees(as_of.date() if as_of else None, batch_size=batch_size)
+
+    click.echo(f'Open loans as of {run.as_of}: {run.loans}, accrued Rs. {run.total_accrued:.2f}')
+    click.echo(f'Overdue: {run.overdue}, accrued Rs. {run.overdue_accrued:.2f}')
+    for label, loans, total in run.buckets():
+        click.echo(f'  {label:>12}: {loans:>8} loan(s)  Rs. {total:.2f}')
+    click.echo(f'Accrued in {run.elapsed:.2f}s ({run.loans / run.elapsed if run.elapsed else 0:.0f} loans/s)')
+
+
+@click.command('backfill-analytics')
+@click.option('--chunk-size', type=int, help='Transaction ids per chunk, ANALYTICS_BACKFILL_CHUNK_SIZE by default.')
+def backfill_analytics_command(chunk_size):
+    """
+    Rebuild the daily circulation rollups from the transactions, one committed chunk at a time
+    """
+    from flask import current_app
+    from app.analytics import backfill_rollups
+
+    def progress(run):
+        click.echo(f'{run.transactions} transaction id(s) summarized in {run.chunks} chunk(s)')
+
+    run = backfill_rollups(chunk_size or current_app.config['ANALYTICS_BACKFILL_CHUNK_SIZE'], progress)
+    click.echo(f'Rollups rebuilt in {run.elapsed:.2f}s')
+
+
+@click.command('export')
+@click.argument('name', type=click.Choice(['books', 'members', 'transactions']))
+@click.option('--output', '-o', default='-', show_default=True,
+              help='File to write, - for standard output. A .gz name turns on --gzip.')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='File format, guessed from the output name (csv by default).')
+@click.option('--fields', help='Comma separated fields to export, all by default.')
+@click.option('--filter', 'filters', multiple=True, metavar='NAME=VALUE',
+              help='Only export matching rows, e.g. status=open or borrowed_from=2024-01-01.')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('--batch-size', type=int, help='Rows fetched per batch, EXPORT_BATCH_SIZE by default.')
+def export_command(name, output, file_format, fields, filters, compress, batch_size):
+    """
+    Stream the books, members or transactions to a CSV or JSONL file
+    """
+    from flask import current_app
+    from app.exports import export_fields, export_filters, export_resource, stream_export
+
+    compress = compress or output.endswith('.gz')
+    base = output[:-3] if output.endswith('.gz') else output
+    file_format = file_format or ('jsonl' if base.lower().endswith(('.jsonl', '.json')) else 'csv')
+    try:
+        values = dict(item.split('=', 1) for item in filters)
+    except ValueError:
+        raise click.BadParameter('Filters are written NAME=VALUE', param_hint='--filter') from None
+    resource = export_resource(name)
+    try:
+        selected = export_fields(resource, fields)
+        conditions = export_filters(name, values)
+    except ValueError as exception:
+        raise click.UsageError(str(exception)) from None
+
+    chunks = stream_export(resource, selected, conditions, file_format, compress,
+                           batch_size or current_app.config['EXPORT_BATCH_SIZE'])
+    stream = click.get_binary_stream('stdout') if output == '-' else open(output, 'wb')
+    try:
+        for chunk in chunks:
+            stream.write(chunk)
+    finally:
+        if output != '-':
+            stream.close()
+
+
+@click.command('debt-report')
+@click.option('--limit', type=int, default=20, show_default=True, help='Debtors to list.')
+def debt_report_command(limit):
+    """
+    Print the members that owe the most and the age of what is owed
+    """
+    from app.debts import aging_buckets, top_debtors
+
+    for member_id, fullname, debt, since in top_debtors(limit):
+        click.echo(f'{member_id:>8}  {fullname:<30} Rs. {debt:>8.2f}  since {since.date() if since else "-"}')
+    for label, members, amount in aging_buckets():
+        click.echo(f'  {label:>12}: {members:>8} member(s)  Rs. {amount:.2f}')
+
+
+@click.command('reconcile-debts')
+def reconcile_debts_command():
+    """
+    Recompute the members' outstanding debts from the debt ledger where they disagree
+    """
+    from app.debts import reconcile_balances
+
+    click.echo(f'{reconcile_balances()} member balance(s) corrected')
+
+
+@click.group('benchmark')
+def benchmark():
+    """
+    Time library workloads against a throwaway SQLite database
+    """
+
+
+def echo_timings(results):
+    for label, operations, seconds in results:
+        click.echo(f'{label}: {operations} in {seconds:.2f}s ({operations / seconds if seconds else 0:.0f}/s)')
+
+
+@benchmark.command('circulation')
+@click.option('--count', type=int, default=200, show_default=True, help='Books issued and returned.')
+@click.option('--batch-size', type=int, help='Operations per batch request, CIRCULATION_BATCH_LIMIT by default.')
+def benchmark_circulation_command(count, batch_size):
+    """
+    Compare issuing and returning through the single-item routes and the batch endpoint
+    """
+    from app.benchmarks import benchmark_circulation
+
+    echo_timings(benchmark_circulation(count, batch_size))
+
+
+@benchmark.command('engine')
+@click.option('--profile', 'profiles', multiple=True, help='Engine profile to run, every profile by default.')
+@click.option('--readers', type=int, default=4, show_default=True, help='Reader threads.')
+@click.option('--writers', type=int, default=2, show_default=True, help='Writer threads.')
+@click.option('--seconds', type=float, default=5.0, show_default=True, help='Duration of each run.')
+def benchmark_engine_command(profiles, readers, writers, seconds):
+    """
+    Compare read and write throughput of the engine profiles under concurrent load (SQLite)
+    """
+    from app.benchmarks import benchmark_engine
+    from app.engine_profiles import PROFILES
+
+    for profile in profiles or PROFILES:
+        echo_timings(benchmark_engine(profile, readers, writers, seconds))
+
+
+@benchmark.command('templates')
+@click.option('--renders', type=int, default=300, show_default=True, help='Pages rendered per run.')
+def benchmark_templates_command(renders):
+    """
+    Compare page render time with and without the template cache, and startup compile time with and
+    without the bytecode cache
+    """
+    from app.benchmarks import benchmark_templates
+
+    echo_timings(benchmark_templates(renders))
+
+
+@benchmark.command('startup')
+@click.option('--runs', type=int, default=5, show_default=True, help='Fresh interpreters to start.')
+@click.option('--budget-ms', type=float, help='Fail above this median startup time, STARTUP_BUDGET_MS by default.')
+@click.option('--top', type=int, default=10, show_default=True, help='Slowest imports to list.')
+def benchmark_startup_command(runs, budget_ms, top):
+    """
+    Time importing and creating the app in fresh interpreters against the startup budget
+    """
+    import statistics
+    from flask import current_app
+    from app.benchmarks import LAZY_MODULES, benchmark_startup
+
+    budget_ms = budget_ms if budget_ms is not None else current_app.config['STARTUP_BUDGET_MS']
+    timings, imports = benchmark_startup(runs)
+    median = statistics.median(timings)
+    click.echo(f"Startup over {runs} run(s): median {median:.0f} ms, "
+               f"min {min(timings):.0f} ms, max {max(timings):.0f} ms (budget {budget_ms:.0f} ms)")
+    # Top-level packages only; each one's time includes its submodules
+    top_level = {name: microseconds for name, microseconds in imports.items() if '.' not in name}
+    for name, microseconds in sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:top]:
+        click.echo(f'  {microseconds / 1000:>8.1f} ms  {name}')
+
+    failures = [f'{name} is imported at startup' for name in LAZY_MODULES if name in imports]
+    if median > budget_ms:
+        failures.append(f'median startup {median:.0f} ms is over the {budget_ms:.0f} ms budget')
+    if failures:
+        raise click.ClickException('; '.join(failures))
+
+
+@benchmark.command('routes')
+@click.option('--books', type=int, default=10000, show_default=True, help='Books in the synthetic library.')
+@click.option('--members', type=int, default=10000, show_default=True, help='Members in the synthetic library.')
+@click.option('--transactions', type=int, default=100000, show_default=True,
+              help='Transactions in the synthetic library.')
+@click.option('--seed', type=int, default=0, show_default=True, help='Seed of the synthetic library.')
+@click.option('--iterations', type=int, default=20, show_default=True, help='Timed requests per route.')
+@click.option('--route', 'routes', multiple=True, help='Only run the routes whose name starts with this.')
+@click.option('--save-baseline', type=click.Path(dir_okay=False), help='Save the results as a baseline.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False),
+              help='Fail if a route regressed against this baseline.')
+@click.option('--latency-threshold', type=float, help='Allowed p95 latency growth, 0.25 (25%) by default.')
+@click.option('--memory-threshold', type=float, help='Allowed peak memory growth, 0.5 (50%) by default.')
+def benchmark_routes_command(books, members, transactions, seed, iterations, routes, save_baseline, baseline,
+                             latency_threshold, memory_threshold):
+    """
+    Time every route against a synthetic library: latency percentiles, queries and peak memory
+    """
+    from app import benchmarks
+
+    report = benchmarks.benchmark_routes(books, members, transactions, seed, iterations, routes)
+    click.echo(f"{'route':<40} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'peak KiB':>9}")
+    for name, result in report['results'].items():
+        click.echo(f"{name:<40} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+                   f"{result['queries']:>8.1f} {result['peak_kib']:>9.0f}")
+        if result['unexpected_statuses']:
+            click.echo(f"  unexpected status {', '.join(map(str, result['unexpected_statuses']))}", err=True)
+
+    if save_baseline:
+        benchmarks.save_baseline(report, save_baseline)
+        click.echo(f'Baseline saved to {save_baseline}')
+    if baseline:
+        try:
+            regressions = benchmarks.compare_to_baseline(
+                report, benchmarks.load_baseline(baseline),
+                latency_threshold if latency_threshold is not None else benchmarks.LATENCY_THRESHOLD,
+                memory_threshold if memory_threshold is not None else benchmarks.MEMORY_THRESHOLD)
+        except ValueError as error:
+            raise click.UsageError(str(error))
+        for regression in regressions:
+            click.echo(f'REGRESSION: {regression}', err=True)
+        if regressions:
+            raise click.ClickException(f'{len(regressions)} regression(s) against {baseline}')
+        click.echo(f'No regressions against {baseline}')
+
+
+@click.command('seed-library')
+@click.option('--books', type=int, default=100000, show_default=True)
+@click.option('--members', type=int, default=1000000, show_default=True)
+@click.option('--transactions', type=int, default=10000000, show_default=True)
+@click.option('--seed', type=int, default=0, show_default=True, help='The same seed loads the same library.')
+@click.option('--open-fraction', type=float, default=0.05, show_default=True,
+              help='Share of the transactions left open, at most one per member.')
+@click.option('--batch-size', type=int, default=100000, show_default=True, help='Rows written per statement.')
+def seed_library_command(books, members, transactions, seed, open_fraction, batch_size):
+    """
+    Bulk load a synthetic library into the empty library database, for performance work
+    """
+    from app.synthetic import finish_library, generate_library
+
+    try:
+        library = generate_library(books, members, transactions, seed, open_fraction, batch_size)
+    except ValueError as error:
+        raise click.UsageError(str(error))
+    click.echo(f'Loaded {library.books} books, {library.members} members and {library.transactions} '
+               f'transactions ({library.open_loans} open) in {library.elapsed:.1f}s')
+    finish_library()
+    click.echo('Search indexes, counters, fee accruals and analytics rollups rebuilt')
+
+
+@click.command('precompile-templates')
+def precompile_templates_command():
+    """
+    Compile every template, filling TEMPLATE_BYTECODE_DIR before the workers start
+    """
+    from flask import current_app
+    from app.templating import precompile_templates
+
+    count, seconds = precompile_templates(current_app)
+    directory = current_app.config.get('TEMPLATE_BYTECODE_DIR')
+    click.echo(f'Compiled {count} template(s) in {seconds:.2f}s'
+               + (f' into {directory}' if directory else ' (TEMPLATE_BYTECODE_DIR is not set, nothing was saved)'))
+
+
+@click.command('sync-replica')
+@click.option('--interval', type=float, help='Keep syncing every INTERVAL seconds instead of once.')
+def sync_replica_command(interval):
+    """
+    Copy the SQLite primary database onto the SQLite replica at DATABASE_REPLICA_URI
+    """
+    import time
+    from flask import current_app
+    from app.replicas import sync_sqlite_replica
+
+    replica_uri = current_app.config.get('DATABASE_REPLICA_URI')
+    if not replica_uri:
+        raise click.UsageError('DATABASE_REPLICA_URI is not set')
+    while True:
+        try:
+            pages = sync_sqlite_replica(current_app.config['SQLALCHEMY_DATABASE_URI'], replica_uri)
+        except ValueError as error:
+            raise click.UsageError(str(error))
+        click.echo(f'Replica synced ({pages} page(s))')
+        if interval is None:
+            return
+        time.sleep(interval)
+
+
+def register_commands(app):
+    """
+    Register the library commands with the flask command line
+    """
+    app.cli.add_command(rebuild_search_index)
+    app.cli.add_command(ingest_books_command)
+    app.cli.add_command(reconcile_counters_command)
+    app.cli.add_command(check_query_plans_command)
+    app.cli.add_command(accrue_fees_command)
+    app.cli.add_command(backfill_analytics_command)
+    app.cli.add_command(debt_report_command)
+    app.cli.add_command(export_command)
+    app.cli.add_command(reconcile_debts_command)
+    app.cli.add_command(benchmark)
+    app.cli.add_command(sync_replica_command)
+    app.cli.add_command(seed_library_command)
+    app.cli.add_command(precompile_templates_command)
@@ -0,0 +1,171 @@
+"""
+A module that maintains the dashboard counters shown on the home page.
+
+The counters table holds the rows of every counter. Triggers on the books, members and transaction
+tables adjust them in the same transaction as every insert, delete or return, so reading the
+dashboard is a single lookup of a few rows however large the tables grow. On PostgreSQL each
+counter is split over COUNTER_SHARDS rows and every change goes to a random one, so concurrent
+issues and returns do not all wait on the same row lock; the dashboard sums the rows. SQLite
+serializes writers anyway and keeps one row, shard 0, per counter.
+"""
+from sqlalchemy import DDL, event, func, select, text
+from app.models import Book, Counter, Member, Transaction, db
+
+COUNTERS = ('books', 'members', 'transactions', 'ongoing_issues')
+
+# Rows each counter is split over on PostgreSQL
+COUNTER_SHARDS = 16
+
+SQLITE_COUNTER_DDL = [
+    """CREATE TRIGGER IF NOT EXISTS counters_books_insert AFTER INSERT ON books BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'books' AND shard = 0;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS counters_books_delete AFTER DELETE ON books BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'books' AND shard = 0;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS counters_members_insert AFTER INSERT ON members BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'members' AND shard = 0;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS counters_members_delete AFTER DELETE ON members BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'members' AND shard = 0;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS counters_transaction_insert AFTER INSERT ON "transaction" BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'transactions' AND shard = 0;
+        UPDATE counters SET value = value + 1
+        WHERE name = 'ongoing_issues' AND shard = 0 AND new.return_date IS NULL;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS counters_transaction_delete AFTER DELETE ON "transaction" BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'transactions' AND shard = 0;
+        UPDATE counters SET value = value - 1
+        WHERE name = 'ongoing_issues' AND shard = 0 AND old.return_date IS NULL;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS counters_transaction_return AFTER UPDATE OF return_date ON "transaction" BEGIN
+        UPDATE counters
+        SET value = value + (new.return_date IS NULL) - (old.return_date IS NULL)
+        WHERE name = 'ongoing_issues' AND shard = 0;
+    END""",
+]
+
+SQLITE_COUNTER_TRIGGERS = ('counters_books_insert', 'counters_books_delete', 'counters_members_insert',
+                           'counters_members_delete', 'counters_transaction_insert',
+                           'counters_transaction_delete', 'counters_transaction_return')
+
+# The shard is picked once per row changed; picking it in the WHERE clause would draw a new one per row scanned
+POSTGRESQL_COUNTER_DDL = [
+    f"""CREATE OR REPLACE FUNCTION counters_count_rows() RETURNS trigger AS $$
+    DECLARE
+        picked integer := floor(random() * {COUNTER_SHARDS});
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE counters SET value = value + 1 WHERE name = TG_ARGV[0] AND shard = picked;
+        ELSE
+            UPDATE counters SET value = value - 1 WHERE name = TG_ARGV[0] AND shard = picked;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    f"""CREATE OR REPLACE FUNCTION counters_count_transactions() RETURNS trigger AS $$
+    DECLARE
+        picked integer := floor(random() * {COUNTER_SHARDS});
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE counters SET value = value + 1 WHERE name = 'transactions' AND shard = picked;
+            UPDATE counters SET value = value + 1
+            WHERE name = 'ongoing_issues' AND shard = picked AND NEW.return_date IS NULL;
+        ELSIF TG_OP = 'DELETE' THEN
+            UPDATE counters SET value = value - 1 WHERE name = 'transactions' AND shard = picked;
+            UPDATE counters SET value = value - 1
+            WHERE name = 'ongoing_issues' AND shard = picked AND OLD.return_date IS NULL;
+        ELSIF (NEW.return_date IS NULL) <> (OLD.return_date IS NULL) THEN
+            UPDATE counters
+            SET value = value + CASE WHEN NEW.return_date IS NULL THEN 1 ELSE -1 END
+            WHERE name = 'ongoing_issues' AND shard = picked;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    'DROP TRIGGER IF EXISTS counters_books ON books',
+    """CREATE TRIGGER counters_books AFTER INSERT OR DELETE ON books
+        FOR EACH ROW EXECUTE FUNCTION counters_count_rows('books')""",
+    'DROP TRIGGER IF EXISTS counters_members ON members',
+    """CREATE TRIGGER counters_members AFTER INSERT OR DELETE ON members
+        FOR EACH ROW EXECUTE FUNCTION counters_count_rows('members')""",
+    'DROP TRIGGER IF EXISTS counters_transaction ON "transaction"',
+    """CREATE TRIGGER counters_transaction AFTER INSERT OR DELETE OR UPDATE OF return_date ON "transaction"
+        FOR EACH ROW EXECUTE FUNCTION counters_count_transactions()""",
+]
+
+# Start every counter from the current row count in shard 0, leaving counters that already exist alone
+COUNTER_SEED_DDL = [
+    """INSERT INTO counters (name, shard, value) SELECT 'books', 0, count(*) FROM books WHERE true
+        ON CONFLICT DO NOTHING""",
+    """INSERT INTO counters (name, shard, value) SELECT 'members', 0, count(*) FROM members WHERE true
+        ON CONFLICT DO NOTHING""",
+    """INSERT INTO counters (name, shard, value) SELECT 'transactions', 0, count(*) FROM "transaction" WHERE true
+        ON CONFLICT DO NOTHING""",
+    """INSERT INTO counters (name, shard, value) SELECT 'ongoing_issues', 0, count(*) FROM "transaction"
+        WHERE return_date IS NULL ON CONFLICT DO NOTHING""",
+]
+
+# The other shards of every counter start empty
+POSTGRESQL_SHARD_SEED_DDL = [
+    f"""INSERT INTO counters (name, shard, value)
+        SELECT name, shard, 0
+        FROM unnest(ARRAY{list(COUNTERS)}) AS name, generate_series(1, {COUNTER_SHARDS - 1}) AS shard
+        ON CONFLICT DO NOTHING""",
+]
+
+# Install the triggers and seed the counters once every table exists
+for statement in SQLITE_COUNTER_DDL:
+    event.listen(db.metadata, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRESQL_COUNTER_DDL:
+    event.listen(db.metadata, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+for statement in COUNTER_SEED_DDL:
+    event.listen(db.metadata, 'after_create', DDL(statement))
+for statement in POSTGRESQL_SHARD_SEED_DDL:
+    event.listen(db.metadata, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+
+def count_rows():
+    """
+    Count the dashboard figures from the tables themselves
+    """
+    return {
+        'books': db.session.scalar(select(func.count()).select_from(Book)),
+        'members': db.session.scalar(select(func.count()).select_from(Member)),
+        'transactions': db.session.scalar(select(func.count()).select_from(Transaction)),
+        'ongoing_issues': db.session.scalar(
+            select(func.count()).select_from(Transaction).where(Transaction.return_date.is_(None))),
+    }
+
+
+def get_counters():
+    """
+    Return the dashboard counters as a dict. Counters that have never been reconciled are counted live
+    """
+    counters = dict(db.session.execute(
+        select(Counter.name, func.sum(Counter.value)).where(Counter.name.in_(COUNTERS)).group_by(Counter.name)
+    ).all())
+    if len(counters) < len(COUNTERS):
+        counters = {**count_rows(), **counters}
+    return counters
+
+
+def reconcile_counters():
+    """
+    Install the counter triggers if needed and recompute every counter from scratch
+    """
+    dialect = db.session.get_bind().dialect.name
+    statements = {'sqlite': SQLITE_COUNTER_DDL, 'postgresql': POSTGRESQL_COUNTER_DDL}.get(dialect, [])
+    for statement in statements:
+        db.session.execute(text(statement))
+
+    if dialect == 'postgresql':
+        # Hold off writers so the recount and the triggers agree
+        db.session.execute(text('LOCK TABLE books, members, "transaction" IN SHARE MODE'))
+    counts = count_rows()
+    db.session.execute(Counter.__table__.delete().where(Counter.name.in_(COUNTERS)))
+    shards = COUNTER_SHARDS if dialect == 'postgresql' else 1
+    db.session.execute(Counter.__table__.insert(), [
+        {'name': name, 'shard': shard, 'value': value if shard == 0 else 0}
+        for name, value in counts.items() for shard in range(shards)])
+    db.session.commit()
+    return counts
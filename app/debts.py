@@ -0,0 +1,199 @@
+"""
+A module that keeps the debt ledger and the cached debt balance of every member.
+
+Every change to a member's debt appends a row to debt_ledger: a charge when a returned loan is
+charged its fee, a payment for what was paid towards it, and an adjustment when a librarian
+corrects the balance. members.outstanding_debt caches the sum of a member's rows. It is only ever
+changed by an increment run in SQL, in the same transaction that appends the rows, so concurrent
+returns add up instead of overwriting each other. The Rs. 500 limit is checked by the increment
+statement itself, so no return can slip past it between a read and a write.
+
+Payments settle the oldest charges first, so a member's debt is made of their newest charges, up
+to their balance. The debtors report and the aging buckets are computed that way in SQL.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import Float, bindparam, case, distinct, func, insert, or_, select, update
+from app.fees import MAX_OUTSTANDING_DEBT
+from app.models import DebtEntry, Member, db
+
+CHARGE = 'charge'
+PAYMENT = 'payment'
+ADJUSTMENT = 'adjustment'
+
+# Lower bounds (in days since the charge) of the buckets of the debt aging report
+AGING_BUCKETS = (0, 30, 60, 90)
+
+# Balances further apart than this from their ledger are corrected by reconcile_balances
+BALANCE_TOLERANCE = 0.005
+
+
+def increment_statement():
+    """
+    Return the UPDATE that adds :change to the debt of member :key, unless that would raise the debt
+    above MAX_OUTSTANDING_DEBT. Run it with executemany; a member left unchanged counts 0 rows
+    """
+    debt = func.coalesce(Member.outstanding_debt, 0)
+    change = bindparam('change', type_=Float)
+    return (update(Member.__table__)
+            .where(Member.id == bindparam('key'), or_(change <= 0, debt + change <= MAX_OUTSTANDING_DEBT))
+            .values(outstanding_debt=debt + change))
+
+
+def return_entries(member_id, transaction_id, total_fee, amount_paid, created_at):
+    """
+    Return the ledger rows of a returned loan: its fee, and what was paid towards it
+    """
+    entries = [{'member_id': member_id, 'transaction_id': transaction_id, 'kind': CHARGE, 'amount': total_fee,
+                'created_at': created_at}]
+    if amount_paid:
+        entries.append({'member_id': member_id, 'transaction_id': transaction_id, 'kind': PAYMENT,
+                        'amount': -amount_paid, 'created_at': created_at})
+    return entries
+
+
+def post_returns(returns, now=None):
+    """
+    Charge the fees of returned loans, given as (member_id, transaction_id, total_fee, amount_paid),
+    and record their payments. Returns False without appending anything if a member's debt would
+    go over the limit; the caller must then roll back, as other balances may have changed
+    """
+    now = now or datetime.now()
+    changes = defaultdict(float)
+    entries = []
+    for member_id, transaction_id, total_fee, amount_paid in returns:
+        if member_id is None:
+            continue
+        changes[member_id] += total_fee - amount_paid
+        entries += return_entries(member_id, transaction_id, total_fee, amount_paid, now)
+
+    changes = {member_id: change for member_id, change in changes.items() if change}
+    if changes:
+        changed = db.session.execute(
+            increment_statement(), [{'key': member_id, 'change': change} for member_id, change in changes.items()]
+        ).rowcount
+        if changed != len(changes):
+            return False
+    if entries:
+        db.session.execute(insert(DebtEntry.__table__), entries)
+    return True
+
+
+def set_balance(member_id, current, balance, now=None):
+    """
+    Record an adjustment that brings a member's debt from current to balance. Returns False without
+    changing anything if the debt is no longer current, for example after a concurrent return
+    """
+    current = current or 0
+    if balance == current:
+        return True
+    changed = db.session.execute(
+        update(Member.__table__)
+        .where(Member.id == member_id, func.coalesce(Member.outstanding_debt, 0) == current)
+        .values(outstanding_debt=balance)
+    ).rowcount
+    if not changed:
+        return False
+    db.session.execute(insert(DebtEntry.__table__), {
+        'member_id': member_id, 'transaction_id': None, 'kind': ADJUSTMENT, 'amount': balance - current,
+        'created_at': now or datetime.now()})
+    return True
+
+
+def unpaid_charges(member_ids=None):
+    """
+    Return a subquery of the charges (and upward adjustments) of current debtors that are not yet
+    paid off: member_id, created_at and the unpaid part of the charge
+    """
+    balance = func.coalesce(Member.outstanding_debt, 0)
+    # The charges made after this one, plus this one, newest first
+    newest_first = func.sum(DebtEntry.amount).over(partition_by=DebtEntry.member_id,
+                                                   order_by=(DebtEntry.created_at.desc(), DebtEntry.id.desc()))
+    charges = (select(DebtEntry.member_id, DebtEntry.created_at, DebtEntry.amount, balance.label('balance'),
+                      newest_first.label('newest_first'))
+               .join(Member, Member.id == DebtEntry.member_id)
+               .where(DebtEntry.amount > 0))
+    if member_ids is None:
+        # Start from the debtors index, so members who owe nothing cost nothing
+        member_ids = select(Member.id).where(Member.outstanding_debt > 0)
+    charges = charges.where(DebtEntry.member_id.in_(member_ids), Member.outstanding_debt > 0)
+    charges = charges.subquery('charges')
+
+    # What the balance leaves for this charge once the newer charges are accounted for
+    left = charges.c.balance - (charges.c.newest_first - charges.c.amount)
+    unpaid = case((left >= charges.c.amount, charges.c.amount), else_=left)
+    return (select(charges.c.member_id, charges.c.created_at, unpaid.label('unpaid'))
+            .where(left > 0)
+            .subquery('unpaid_charges'))
+
+
+def owed_since(member_ids):
+    """
+    Return the date of the oldest unpaid charge of each of the members that owe something
+    """
+    if not member_ids:
+        return {}
+    unpaid = unpaid_charges(member_ids)
+    return dict(db.session.execute(
+        select(unpaid.c.member_id, func.min(unpaid.c.created_at)).group_by(unpaid.c.member_id)).all())
+
+
+def debtors_query():
+    """
+    Return a query of the members that owe something, to be paginated on (outstanding_debt, id)
+    """
+    return Member.query.filter(Member.outstanding_debt > 0)
+
+
+def top_debtors(limit=20):
+    """
+    Return (member id, fullname, debt, owed since) for the members that owe the most, largest debt first
+    """
+    rows = db.session.execute(
+        select(Member.id, Member.fullname, Member.outstanding_debt)
+        .where(Member.outstanding_debt > 0)
+        .order_by(Member.outstanding_debt.desc(), Member.id.desc())
+        .limit(limit)
+    ).all()
+    since = owed_since([row.id for row in rows])
+    return [(row.id, row.fullname, row.outstanding_debt, since.get(row.id)) for row in rows]
+
+
+def aging_buckets(now=None):
+    """
+    Return (label, members, amount) for each bucket of the age of the unpaid charges, oldest last
+    """
+    now = now or datetime.now()
+    unpaid = unpaid_charges()
+    bucket = case(*[(unpaid.c.created_at > now - timedelta(days=upper), index)
+                    for index, upper in enumerate(AGING_BUCKETS[1:])], else_=len(AGING_BUCKETS) - 1)
+    aged = select(unpaid.c.member_id, bucket.label('bucket'), unpaid.c.unpaid).subquery('aged')
+    totals = {row.bucket: row for row in db.session.execute(
+        select(aged.c.bucket, func.count(distinct(aged.c.member_id)).label('members'),
+               func.sum(aged.c.unpaid).label('amount'))
+        .group_by(aged.c.bucket))}
+
+    buckets = []
+    for index, lower in enumerate(AGING_BUCKETS):
+        upper = AGING_BUCKETS[index + 1] if index + 1 < len(AGING_BUCKETS) else None
+        label = f'{lower}-{upper - 1} days' if upper else f'{lower}+ days'
+        row = totals.get(index)
+        buckets.append((label, row.members if row else 0, float(row.amount) if row else 0.0))
+    return buckets
+
+
+def reconcile_balances():
+    """
+    Recompute the cached balances from the ledger where they disagree and commit. Returns the
+    number of members corrected
+    """
+    ledger_total = (select(func.coalesce(func.sum(DebtEntry.amount), 0))
+                    .where(DebtEntry.member_id == Member.id)
+                    .scalar_subquery())
+    corrected = db.session.execute(
+        update(Member.__table__)
+        .where(func.abs(func.coalesce(Member.outstanding_debt, 0) - ledger_total) > BALANCE_TOLERANCE)
+        .values(outstanding_debt=ledger_total)
+    ).rowcount
+    db.session.commit()
+    return corrected
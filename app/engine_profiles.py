@@ -0,0 +1,91 @@
+"""
+A module that tunes the database engines with a named profile chosen by DATABASE_PROFILE.
+
+A profile holds the settings for each database dialect. SQLite settings are PRAGMAs run on every
+new connection. PostgreSQL settings are engine options (pool sizing, pre-ping, recycle) plus
+server options (statement timeout) passed when connecting. The 'default' profile leaves the
+SQLAlchemy defaults untouched.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+PROFILES = {
+    'default': {
+        'sqlite': {'pragmas': {}},
+        'postgresql': {'engine_options': {}, 'options': {}},
+    },
+    'production': {
+        'sqlite': {
+            'pragmas': {
+                # Readers no longer block the writer, and commits only fsync at checkpoints
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'mmap_size': 256 * 1024 * 1024,
+                # Negative sizes are in KiB
+                'cache_size': -64 * 1024,
+                'temp_store': 'MEMORY',
+                # Wait up to this many milliseconds for a lock before failing with "database is locked"
+                'busy_timeout': 5000,
+            },
+        },
+        'postgresql': {
+            'engine_options': {
+                'pool_size': 10,
+                'max_overflow': 20,
+                'pool_timeout': 30,
+                'pool_pre_ping': True,
+                'pool_recycle': 1800,
+            },
+            'options': {
+                'statement_timeout': '30s',
+                'idle_in_transaction_session_timeout': '60s',
+            },
+        },
+    },
+}
+
+
+def get_profile(name, url):
+    """
+    Return the settings of profile name for the dialect of the database url ({} for other dialects)
+    """
+    if name not in PROFILES:
+        raise ValueError(f"Unknown DATABASE_PROFILE {name!r}, choose from: {', '.join(PROFILES)}")
+    return PROFILES[name].get(make_url(url).get_backend_name(), {})
+
+
+def engine_options(name, url, options=None):
+    """
+    Merge the engine options of profile name into options (SQLALCHEMY_ENGINE_OPTIONS), keeping any
+    option that is already set
+    """
+    options = dict(options or {})
+    if url is None:
+        return options
+    profile = get_profile(name, url)
+    for key, value in profile.get('engine_options', {}).items():
+        options.setdefault(key, value)
+
+    server_options = ' '.join(f'-c {key}={value}' for key, value in profile.get('options', {}).items())
+    if server_options:
+        connect_args = dict(options.get('connect_args', {}))
+        connect_args['options'] = f"{connect_args.get('options', '')} {server_options}".strip()
+        options['connect_args'] = connect_args
+    return options
+
+
+def install_pragmas(engine, name):
+    """
+    Run the SQLite PRAGMAs of profile name on every new connection of engine
+    """
+    pragmas = get_profile(name, engine.url).get('pragmas', {})
+    if not pragmas:
+        return
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for key, value in pragmas.items():
+            cursor.execute(f'PRAGMA {key}={value}')
+        cursor.close()
+
+    event.listen(engine, 'connect', set_pragmas)
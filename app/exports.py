@@ -0,0 +1,167 @@
+"""
+A module that streams books, members and transactions out as CSV or JSONL.
+
+Rows are read in primary key order with a server-side cursor (stream_results with yield_per), one
+batch at a time, and each batch is encoded and handed on as a chunk of bytes before the next one
+is fetched, so an export of any size holds only one batch in memory and the first bytes leave
+before the query has finished. Gzip compression is applied chunk by chunk, flushing after each
+one so the receiver never waits for a full compression window.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date
+from sqlalchemy import func, select
+from app.models import Book, Member, Transaction, db
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+# Query string parameters of the export route that are not filters
+EXPORT_PARAMS = ('fields', 'compress')
+
+
+def _status(value):
+    if value == 'open':
+        return Transaction.return_date.is_(None)
+    if value == 'closed':
+        return Transaction.return_date.isnot(None)
+    raise ValueError("status must be 'open' or 'closed'")
+
+
+def _flag(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f'Expected true or false, got {value!r}')
+
+
+# The filters each export takes, by name, as functions from the text value to a condition
+EXPORT_FILTERS = {
+    'books': {
+        'author': lambda value: Book.author == value,
+        'publisher': lambda value: Book.publisher == value,
+        'available': lambda value: (func.coalesce(Book.Quantity, 0) >= 1) if _flag(value)
+        else (func.coalesce(Book.Quantity, 0) < 1),
+    },
+    'members': {
+        'has_debt': lambda value: (Member.outstanding_debt > 0) if _flag(value)
+        else (func.coalesce(Member.outstanding_debt, 0) <= 0),
+    },
+    'transactions': {
+        'member_id': lambda value: Transaction.member_id == int(value),
+        'book_id': lambda value: Transaction.book_id == int(value),
+        'status': _status,
+        'borrowed_from': lambda value: Transaction.borrowed_date >= date.fromisoformat(value),
+        'borrowed_to': lambda value: Transaction.borrowed_date <= date.fromisoformat(value),
+    },
+}
+
+
+def export_resource(name):
+    """
+    Return the API resource (table, key and fields) exported under name
+    """
+    from app.routes.api import BOOKS, MEMBERS, TRANSACTIONS
+
+    resources = {'books': BOOKS, 'members': MEMBERS, 'transactions': TRANSACTIONS}
+    if name not in resources:
+        raise ValueError(f"Unknown export {name!r}, choose from: {', '.join(resources)}")
+    return resources[name]
+
+
+def export_fields(resource, fields):
+    """
+    Return the field names of a comma separated list, every field when it is empty
+    """
+    if not fields:
+        return list(resource.fields)
+    selected = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in selected if field not in resource.fields]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Choose from: {', '.join(resource.fields)}")
+    return selected
+
+
+def export_filters(name, values):
+    """
+    Return the conditions of the filters in values (a mapping of filter name to text). Unknown
+    names raise ValueError
+    """
+    filters = EXPORT_FILTERS[name]
+    conditions = []
+    for key, value in values.items():
+        if key not in filters:
+            raise ValueError(f"Unknown filter {key!r}, choose from: {', '.join(filters)}")
+        try:
+            conditions.append(filters[key](value))
+        except ValueError as exception:
+            raise ValueError(f'Invalid {key} filter {value!r}: {exception}') from None
+    return conditions
+
+
+def _batches(resource, selected, conditions, batch_size):
+    statement = (select(*resource.columns(selected))
+                 .where(*conditions)
+                 .order_by(resource.key)
+                 .execution_options(stream_results=True, yield_per=batch_size))
+    return db.session.connection().execute(statement).partitions()
+
+
+def _csv_chunks(names, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    yield buffer.getvalue().encode()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+
+
+def _jsonl_chunks(names, batches):
+    for rows in batches:
+        lines = []
+        for row in rows:
+            item = {name: value.isoformat() if hasattr(value, 'isoformat') else value
+                    for name, value in zip(names, row)}
+            lines.append(json.dumps(item))
+        lines.append('')
+        yield '\n'.join(lines).encode()
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compress a stream of byte chunks into a gzip stream, flushing after every chunk
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(resource, selected, conditions, file_format='csv', compress=False, batch_size=1000):
+    """
+    Yield the export of the rows of resource matching conditions as chunks of bytes, one per batch
+    of rows. The query only runs once the first chunk is asked for
+    """
+    names = [resource.key.key] + [name for name in selected if name != resource.key.key]
+    encode = _csv_chunks if file_format == 'csv' else _jsonl_chunks
+
+    def chunks():
+        yield from encode(names, _batches(resource, selected, conditions, batch_size))
+
+    return gzip_chunks(chunks()) if compress else chunks()
+
+
+def export_filename(name, file_format, compress):
+    """
+    Return the file name an export is downloaded as
+    """
+    return f'{name}.{file_format}' + ('.gz' if compress else '')
@@ -0,0 +1,95 @@
+"""
+A module that fetches books from the Frappe library API, several result pages at a time.
+
+requests is imported on the first fetch, so workers that never import books do not load it.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class FrappeResults:
+    """
+    A class that holds the books fetched from Frappe and the result pages that could not be fetched
+    """
+
+    def __init__(self, books, failed_pages):
+        self.books = books
+        self.failed_pages = failed_pages
+
+
+def get_session(pool_size):
+    """
+    Return the requests session shared by all fetches, so connections to Frappe are kept alive and reused
+    """
+    global _session
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+    return _session
+
+
+def fetch_page(session, url, params, page, timeout):
+    """
+    Fetch a single result page from the Frappe API
+    """
+    response = session.get(url, params={**params, 'page': page}, timeout=timeout)
+    response.raise_for_status()
+    books = response.json()["message"]
+    if not isinstance(books, list):
+        raise ValueError(f'Expected a list of books on page {page}')
+    return books
+
+
+def fetch_books(search_query, url, pages=5, timeout=5):
+    """
+    Fetch the first pages of Frappe results for search_query concurrently.
+
+    Each page has its own timeout. Pages that fail or time out are reported in failed_pages and the
+    books of the other pages are still returned, in page order and without duplicate ISBNs.
+    """
+    import requests
+
+    params = {
+        'title': search_query,  # Search by title
+        'authors': search_query,  # Search by authors
+        'isbn': 1,
+        'publisher': 1,
+    }
+    session = get_session(pages)
+    executor = ThreadPoolExecutor(max_workers=pages)
+    futures = {page: executor.submit(fetch_page, session, url, params, page, timeout)
+               for page in range(1, pages + 1)}
+    # Bound the total wait in case a server trickles bytes and never hits the read timeout
+    wait(futures.values(), timeout=timeout * 2)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    books = []
+    seen_isbns = set()
+    failed_pages = []
+    for page, future in futures.items():
+        if not future.done():
+            failed_pages.append(page)
+            continue
+        try:
+            page_books = future.result()
+        except (requests.RequestException, ValueError, KeyError, TypeError):
+            failed_pages.append(page)
+            continue
+        for book in page_books:
+            if not isinstance(book, dict):
+                continue
+            if book.get("isbn") not in seen_isbns:
+                seen_isbns.add(book.get("isbn"))
+                books.append(book)
+
+    return FrappeResults(books, failed_pages)
@@ -0,0 +1,148 @@
+"""
+A module that hashes and verifies member passwords in a process pool.
+
+PBKDF2 is deliberately slow, so running it on the request threads lets a burst of logins hold every
+worker. The hasher runs it in a bounded process pool instead: at most PASSWORD_HASH_QUEUE calls are
+pending at once and callers beyond that wait up to PASSWORD_HASH_TIMEOUT before being turned away.
+"""
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+
+
+class HashingBusyError(Exception):
+    """
+    Raised when the hashing queue is full or a hash does not finish in time
+    """
+
+
+def method_prefix(method):
+    """
+    Return the method and cost as werkzeug writes them at the start of a hash, with the defaults
+    left out of method spelled out ('scrypt' is stored as 'scrypt:32768:8:1')
+    """
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return 'scrypt:32768:8:1'
+    if name == 'pbkdf2' and len(args) < 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+class PasswordHasher:
+    """
+    A class that hashes passwords with the configured method and cost in a process pool
+    """
+
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256:600000'
+        self.salt_length = 16
+        self.workers = 2
+        self.queue_size = 32
+        self.timeout = 10.0
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._failed = 0
+        self._total_seconds = 0.0
+        self._max_seconds = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Read the hashing configuration of the app
+        """
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.salt_length = app.config.get('PASSWORD_SALT_LENGTH', self.salt_length)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', self.workers)
+        self.queue_size = app.config.get('PASSWORD_HASH_QUEUE', self.queue_size)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', self.timeout)
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+
+    def _get_executor(self):
+        # Created on first use so every forked web worker gets its own pool
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _run(self, function, *args):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._rejected += 1
+            raise HashingBusyError('Too many password checks are waiting, please try again.')
+
+        with self._lock:
+            self._in_flight += 1
+        # Errors raised by the hash function itself count as failed, not rejected
+        outcome = 'failed'
+        try:
+            if not self.workers:
+                # Hash on the calling thread, for development and tests
+                result = function(*args)
+            else:
+                future = self._get_executor().submit(function, *args)
+                try:
+                    result = future.result(timeout=max(self.timeout - (time.perf_counter() - started), 0))
+                except FutureTimeoutError:
+                    future.cancel()
+                    outcome = 'rejected'
+                    raise HashingBusyError('Password check timed out, please try again.') from None
+            outcome = 'completed'
+            return result
+        finally:
+            self._slots.release()
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._in_flight -= 1
+                if outcome == 'completed':
+                    self._completed += 1
+                    self._total_seconds += elapsed
+                    self._max_seconds = max(self._max_seconds, elapsed)
+                elif outcome == 'rejected':
+                    self._rejected += 1
+                else:
+                    self._failed += 1
+
+    def hash(self, password):
+        """
+        Return a salted hash of password using the configured method and cost
+        """
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, password_hash, password):
+        """
+        Check password against a stored hash, whatever method and cost the hash was made with
+        """
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """
+        Return True if a stored hash was made with a different method or cost than the configured one
+        """
+        return bool(password_hash) and password_hash.split('$', 1)[0] != method_prefix(self.method)
+
+    def stats(self):
+        """
+        Return the queue depth and latency figures of the hasher
+        """
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'queue_size': self.queue_size,
+                'workers': self.workers,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'failed': self._failed,
+                'average_latency_ms': (self._total_seconds / self._completed * 1000) if self._completed else 0.0,
+                'max_latency_ms': self._max_seconds * 1000,
+            }
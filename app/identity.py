@@ -0,0 +1,169 @@
+"""
+A module that caches the member identities flask-login loads on every authenticated request.
+
+Identities are small MemberIdentity objects kept in a bounded LRU with a time to live. Changes to
+a member's username, full name or password (and deleting the member) are noticed when the session
+flushes and the cached identity is dropped once the transaction commits. With USER_CACHE_SHARED
+enabled every such change also bumps a version counter in the database, which the other workers
+check every USER_CACHE_VERSION_CHECK seconds and clear their caches on.
+"""
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+from sqlalchemy import event, inspect, select
+
+VERSION_COUNTER = 'member_identity_version'
+IDENTITY_FIELDS = ('username', 'fullname', 'hash_password')
+
+
+class MemberIdentity(UserMixin):
+    """
+    A class that holds the few member fields an authenticated request needs
+    """
+
+    def __init__(self, id, username, fullname):
+        self.id = id
+        self.username = username
+        self.fullname = fullname
+
+    def __repr__(self):
+        """
+        Returns a string representation of a member identity
+        """
+        return f'<MemberIdentity(id={self.id}, username={self.username})>'
+
+
+class IdentityCache:
+    """
+    A class that caches member identities with LRU eviction, a time to live and write-through invalidation
+    """
+
+    def __init__(self, app=None, session=None):
+        self.size = 10000
+        self.ttl = 300.0
+        self.shared = False
+        self.version_check = 5.0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._next_version_check = 0.0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        if app is not None:
+            self.init_app(app, session)
+
+    def init_app(self, app, session):
+        """
+        Read the cache configuration of the app and watch session for member changes
+        """
+        self.size = app.config.get('USER_CACHE_SIZE', self.size)
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+        self.shared = app.config.get('USER_CACHE_SHARED', self.shared)
+        self.version_check = app.config.get('USER_CACHE_VERSION_CHECK', self.version_check)
+        self.clear()
+
+        if not event.contains(session, 'after_flush', self._collect_changes):
+            event.listen(session, 'after_flush', self._collect_changes)
+            event.listen(session, 'after_commit', self._apply_changes)
+            event.listen(session, 'after_soft_rollback', self._discard_changes)
+
+    def get(self, member_id, loader):
+        """
+        Return the cached identity of member_id, calling loader(member_id) on a miss
+        """
+        now = time.monotonic()
+        if self.shared and now >= self._next_version_check:
+            self._check_version(now)
+
+        with self._lock:
+            entry = self._entries.get(member_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(member_id)
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+
+        identity = loader(member_id)
+        if identity is not None:
+            with self._lock:
+                self._entries[member_id] = (identity, now + self.ttl)
+                self._entries.move_to_end(member_id)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return identity
+
+    def invalidate(self, member_ids):
+        """
+        Drop the cached identities of member_ids
+        """
+        with self._lock:
+            for member_id in member_ids:
+                if self._entries.pop(member_id, None) is not None:
+                    self._invalidations += 1
+
+    def clear(self):
+        """
+        Drop every cached identity
+        """
+        with self._lock:
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Return the size, hit ratio, eviction and invalidation figures of the cache
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+            }
+
+    def _check_version(self, now):
+        from app.models import Counter, db
+
+        self._next_version_check = now + self.version_check
+        version = db.session.scalar(select(Counter.value).where(Counter.name == VERSION_COUNTER))
+        if version != self._version:
+            # Another worker changed a member, we do not know which one
+            if self._version is not None:
+                self.clear()
+            self._version = version
+
+    def _collect_changes(self, session, flush_context):
+        from app.models import Counter, Member
+
+        changed = {member.id for member in session.deleted if isinstance(member, Member)}
+        changed |= {
+            member.id for member in session.dirty
+            if isinstance(member, Member)
+            and any(inspect(member).attrs[name].history.has_changes() for name in IDENTITY_FIELDS)
+        }
+        if not changed:
+            return
+        session.info.setdefault('changed_member_ids', set()).update(changed)
+
+        if self.shared:
+            # Bump the shared version in the same transaction as the change
+            counters = Counter.__table__
+            connection = session.connection()
+            bumped = connection.execute(
+                counters.update().where(counters.c.name == VERSION_COUNTER).values(value=counters.c.value + 1))
+            if not bumped.rowcount:
+                connection.execute(counters.insert().values(name=VERSION_COUNTER, value=1))
+
+    def _apply_changes(self, session):
+        self.invalidate(session.info.pop('changed_member_ids', ()))
+
+    def _discard_changes(self, session, previous_transaction):
+        session.info.pop('changed_member_ids', None)
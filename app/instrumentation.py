@@ -0,0 +1,262 @@
+"""
+A module that times requests and SQL statements and exports them in the Prometheus text format.
+
+Every request is counted by endpoint, method and status. A sampled share of them
+(METRICS_SAMPLE_RATE) is also timed into a latency histogram, together with the number and total
+time of the SQL statements it ran, taken from the engine's before/after_cursor_execute events.
+Statements slower than SLOW_QUERY_MS are logged and kept, normalized so that statements differing
+only in their values are counted together. Unsampled requests cost a counter increment.
+
+The figures are kept per process, so with several web workers each one reports its own.
+"""
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from flask import request, request_finished, request_started
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the request latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the statements per request buckets
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+# Longest normalized statement kept in the slow query log
+MAX_STATEMENT_LENGTH = 1000
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_statement(statement):
+    """
+    Return statement with its literals replaced by ? and placeholder lists collapsed, so that
+    statements differing only in their values normalize alike
+    """
+    statement = _STRING_LITERAL.sub('?', statement)
+    statement = _NUMBER_LITERAL.sub('?', statement)
+    statement = _PLACEHOLDER_LIST.sub('(...)', statement)
+    statement = _WHITESPACE.sub(' ', statement).strip()
+    return statement[:MAX_STATEMENT_LENGTH]
+
+
+class Histogram:
+    """
+    A class that counts observations into cumulative buckets, as a Prometheus histogram
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+
+    def samples(self):
+        """
+        Yield (le, cumulative count) for every bucket and +Inf
+        """
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield bound, cumulative
+
+
+class RequestMetrics:
+    """
+    A class that gathers the SQL figures of one sampled request
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+class Instrumentation:
+    """
+    A class that records request latency and SQL figures and renders them for /metrics
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.sample_rate = 1.0
+        self.slow_query_seconds = 0.1
+        self.slow_query_log_size = 100
+        self._collectors = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def _reset(self):
+        self._requests = defaultdict(int)
+        self._latency = {}
+        self._statements = {}
+        self._sql_statements = defaultdict(int)
+        self._sql_seconds = defaultdict(float)
+        self._slow_queries = OrderedDict()
+        self._slow_query_count = 0
+
+    def init_app(self, app, engines=()):
+        """
+        Read the instrumentation configuration of the app and hook its requests and engines
+        """
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+        self.sample_rate = app.config.get('METRICS_SAMPLE_RATE', self.sample_rate)
+        self.slow_query_seconds = app.config.get('SLOW_QUERY_MS', self.slow_query_seconds * 1000) / 1000
+        self.slow_query_log_size = app.config.get('SLOW_QUERY_LOG_SIZE', self.slow_query_log_size)
+        with self._lock:
+            self._reset()
+        if not self.enabled:
+            return
+
+        request_started.connect(self._request_started, app)
+        request_finished.connect(self._request_finished, app)
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def add_collector(self, prefix, stats, metrics):
+        """
+        Export the figures of a stats() function: metrics maps each key to its (type, help text)
+        """
+        self._collectors.append((prefix, stats, metrics))
+
+    def _request_started(self, sender, **extra):
+        sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        self._local.current = RequestMetrics(self._endpoint()) if sampled else None
+
+    def _request_finished(self, sender, response, **extra):
+        current = getattr(self._local, 'current', None)
+        self._local.current = None
+        endpoint = current.endpoint if current is not None else self._endpoint()
+        with self._lock:
+            self._requests[(endpoint, request.method, response.status_code)] += 1
+            if current is None:
+                return
+            latency = self._latency.get(endpoint)
+            if latency is None:
+                latency = self._latency[endpoint] = Histogram(LATENCY_BUCKETS)
+                self._statements[endpoint] = Histogram(STATEMENT_BUCKETS)
+            latency.observe(time.perf_counter() - current.started)
+            self._statements[endpoint].observe(current.statements)
+            self._sql_statements[endpoint] += current.statements
+            self._sql_seconds[endpoint] += current.sql_seconds
+
+    @staticmethod
+    def _endpoint():
+        # Unmatched urls are counted together, so scanners cannot add a label per url
+        return request.url_rule.endpoint if request.url_rule is not None else 'unmatched'
+
+    def _before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        if context is not None and getattr(self._local, 'current', None) is not None:
+            context.metrics_started = time.perf_counter()
+
+    def _after_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        current = getattr(self._local, 'current', None)
+        started = getattr(context, 'metrics_started', None)
+        if current is None or started is None:
+            return
+        elapsed = time.perf_counter() - started
+        current.statements += 1
+        current.sql_seconds += elapsed
+        if elapsed >= self.slow_query_seconds:
+            self._record_slow_query(current.endpoint, statement, elapsed)
+
+    def _record_slow_query(self, endpoint, statement, elapsed):
+        normalized = normalize_statement(statement)
+        logger.warning('Slow query (%.1f ms) in %s: %s', elapsed * 1000, endpoint, normalized)
+        with self._lock:
+            self._slow_query_count += 1
+            entry = self._slow_queries.pop(normalized, None)
+            if entry is None:
+                entry = {'statement': normalized, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'endpoints': []}
+            entry['count'] += 1
+            entry['total_ms'] += elapsed * 1000
+            entry['max_ms'] = max(entry['max_ms'], elapsed * 1000)
+            if endpoint not in entry['endpoints']:
+                entry['endpoints'].append(endpoint)
+            self._slow_queries[normalized] = entry
+            while len(self._slow_queries) > self.slow_query_log_size:
+                self._slow_queries.popitem(last=False)
+
+    def slow_queries(self):
+        """
+        Return the slow query log, slowest total time first
+        """
+        with self._lock:
+            entries = [dict(entry, endpoints=list(entry['endpoints'])) for entry in self._slow_queries.values()]
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text exposition format
+        """
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            family('lms_http_requests_total', 'counter', 'Requests answered, by endpoint, method and status.')
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'lms_http_requests_total{{endpoint="{endpoint}",method="{method}",'
+                             f'status="{status}"}} {count}')
+
+            family('lms_http_request_duration_seconds', 'histogram', 'Latency of the sampled requests.')
+            for endpoint, histogram in sorted(self._latency.items()):
+                _histogram_lines(lines, 'lms_http_request_duration_seconds', endpoint, histogram)
+
+            family('lms_sql_statements_per_request', 'histogram', 'SQL statements run by the sampled requests.')
+            for endpoint, histogram in sorted(self._statements.items()):
+                _histogram_lines(lines, 'lms_sql_statements_per_request', endpoint, histogram)
+
+            family('lms_sql_statements_total', 'counter', 'SQL statements run by the sampled requests.')
+            for endpoint, count in sorted(self._sql_statements.items()):
+                lines.append(f'lms_sql_statements_total{{endpoint="{endpoint}"}} {count}')
+
+            family('lms_sql_duration_seconds_total', 'counter', 'Time spent in SQL by the sampled requests.')
+            for endpoint, seconds in sorted(self._sql_seconds.items()):
+                lines.append(f'lms_sql_duration_seconds_total{{endpoint="{endpoint}"}} {seconds:.6f}')
+
+            family('lms_sql_slow_queries_total', 'counter', 'Statements slower than SLOW_QUERY_MS.')
+            lines.append(f'lms_sql_slow_queries_total {self._slow_query_count}')
+
+        family('lms_metrics_sample_rate', 'gauge', 'Share of the requests that are timed.')
+        lines.append(f'lms_metrics_sample_rate {self.sample_rate}')
+
+        for prefix, stats, metrics in self._collectors:
+            figures = stats()
+            for key, (kind, help_text) in metrics.items():
+                value = figures.get(key)
+                if value is None:
+                    continue
+                name = f'lms_{prefix}_{key}' + ('_total' if kind == 'counter' else '')
+                family(name, kind, help_text)
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(lines, name, endpoint, histogram):
+    for bound, count in histogram.samples():
+        lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+    lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {histogram.total:.6f}')
+    lines.append(f'{name}_count{{endpoint="{endpoint}"}} {sum(histogram.counts)}')
@@ -1,19 +1,26 @@
 from flask import current_app as app
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin, LoginManager
-from sqlalchemy import Integer, String, Boolean, Float, Date, ForeignKey,UniqueConstraint
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import Integer, String, Boolean, Float, Date, DateTime, ForeignKey,UniqueConstraint, select
 from flask import current_app as app
-from app import db, login_manager
+from app import db, login_manager, password_hasher, identity_cache
+from app.identity import MemberIdentity
 
 
 class Member(UserMixin, db.Model):
     __tablename__ = 'members'
+    __table_args__ = (
+        # Backs the keyset sort options of the members listing
+        db.Index('ix_members_fullname_id', 'fullname', 'id'),
+        # Backs the debtors report, largest debt first
+        db.Index('ix_members_outstanding_debt_id', 'outstanding_debt', 'id'),
+    )
 
     id = db.Column(Integer, unique=True, primary_key=True)
     username = db.Column(String(20), unique=True, nullable=False)
     fullname = db.Column(String(20), nullable=False)
     email = db.Column(String(20), unique=True, nullable=False)
+    # Cached balance of the member's debt_ledger rows, only ever changed by app.debts
     outstanding_debt = db.Column(db.Float)
     hash_password = db.Column(String(150))
 
@@ -23,7 +30,7 @@ class Member(UserMixin, db.Model):
         """
         Create a hashed password and set it for the member.
         """
-        hashed_password = generate_password_hash(password)
+        hashed_password = password_hasher.hash(password)
         self.hash_password = hashed_password
 
 
@@ -32,7 +39,13 @@ class Member(UserMixin, db.Model):
         Verify if a given plain-text password matches the hashed password stored for the member.
 
         """
-        return check_password_hash(self.hash_password, password)
+        return password_hasher.verify(self.hash_password, password)
+
+    def password_needs_rehash(self):
+        """
+        Check if the stored hash was made with an outdated hashing method or cost.
+        """
+        return password_hasher.needs_rehash(self.hash_password)
 
     def __repr__(self):
         """
@@ -40,13 +53,41 @@ class Member(UserMixin, db.Model):
         """
         return f'<Member(username={self.username}), email={self.email}>'
 
-# Query  database for user id 
+class MemberSearchToken(db.Model):
+    __tablename__ = 'member_search_tokens'
+
+    # kind is one of 'username', 'email', 'word' or 'trigram'
+    kind = db.Column(String(10), primary_key=True)
+    token = db.Column(String(255), primary_key=True)
+    member_id = db.Column(Integer, ForeignKey('members.id', ondelete='CASCADE'), primary_key=True, index=True)
+
+    def __repr__(self):
+        """
+        Returns a string representation of a member search token
+        """
+        return f'<MemberSearchToken(kind={self.kind}, token={self.token}, member_id={self.member_id})>'
+
+# Query  database for user id, through the identity cache
 @login_manager.user_loader
 def load_user(id):
-    return Member.query.get(int(id))
+    return identity_cache.get(int(id), load_identity)
+
+def load_identity(member_id):
+    """
+    Load the lightweight identity of a member, or None if the member no longer exists
+    """
+    row = db.session.execute(
+        select(Member.id, Member.username, Member.fullname).where(Member.id == member_id)
+    ).first()
+    return MemberIdentity(*row) if row else None
 
 class Book(db.Model):
     __tablename__ = 'books'
+    __table_args__ = (
+        # Back the keyset sort options of the catalog listing
+        db.Index('ix_books_title_id', 'title', 'id'),
+        db.Index('ix_books_author_id', 'author', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, unique=True)
     title = db.Column(db.String(20), nullable=False)
@@ -79,6 +120,18 @@ class Transaction(db.Model):
     member = db.relationship('Member', backref='transactions')
     book = db.relationship('Book', backref='transactions')
 
+    __table_args__ = (
+        # A member can only have one open loan at a time
+        db.Index('uq_transaction_open_loan', member_id, unique=True,
+                 sqlite_where=return_date.is_(None), postgresql_where=return_date.is_(None)),
+        # Ledger filters, each ending in the key the ledger is paginated on
+        db.Index('ix_transaction_member_id_transaction_id', member_id, transaction_id),
+        db.Index('ix_transaction_book_id_transaction_id', book_id, transaction_id),
+        db.Index('ix_transaction_borrowed_date_transaction_id', borrowed_date, transaction_id),
+        db.Index('ix_transaction_open', transaction_id,
+                 sqlite_where=return_date.is_(None), postgresql_where=return_date.is_(None)),
+    )
+
     def __repr__(self):
         return f'''<Transaction(book_id={self.book_id}), 
                       member_id={self.member_id}, 
@@ -87,3 +140,143 @@ class Transaction(db.Model):
                       total_fee={self.total_fee}
                       amount_paid={self.amount_paid}>'''
 
+
+class Counter(db.Model):
+    __tablename__ = 'counters'
+
+    # A counter may be split over several shards, its value is the sum of its rows
+    name = db.Column(String(50), primary_key=True)
+    shard = db.Column(Integer, primary_key=True, default=0, server_default='0', autoincrement=False)
+    value = db.Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        """
+        Returns a string representation of a counter shard
+        """
+        return f'<Counter(name={self.name}, shard={self.shard}, value={self.value})>'
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+
+    # Bumped once by every committed transaction that changed the named table
+    name = db.Column(String(50), primary_key=True)
+    version = db.Column(Integer, nullable=False, default=1)
+    modified_at = db.Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        """
+        Returns a string representation of a table version
+        """
+        return f'<TableVersion(name={self.name}, version={self.version}, modified_at={self.modified_at})>'
+
+
+class FeeAccrual(db.Model):
+    __tablename__ = 'fee_accruals'
+    __table_args__ = (
+        # The overdue report lists the longest overdue loans first
+        db.Index('ix_fee_accruals_days_overdue_transaction_id', 'days_overdue', 'transaction_id'),
+    )
+
+    # A snapshot of the fee each open loan has accrued, replaced by every accrual run
+    transaction_id = db.Column(Integer, ForeignKey('transaction.transaction_id', ondelete='CASCADE'),
+                               primary_key=True)
+    member_id = db.Column(Integer, ForeignKey('members.id', ondelete='SET NULL'), nullable=True)
+    book_id = db.Column(Integer, ForeignKey('books.id', ondelete='SET NULL'), nullable=True)
+    borrowed_date = db.Column(Date, nullable=False)
+    days_rented = db.Column(Integer, nullable=False)
+    days_overdue = db.Column(Integer, nullable=False)
+    accrued_fee = db.Column(Float, nullable=False)
+    as_of = db.Column(Date, nullable=False)
+
+    member = db.relationship('Member', viewonly=True)
+    book = db.relationship('Book', viewonly=True)
+
+    def __repr__(self):
+        """
+        Returns a string representation of a fee accrual
+        """
+        return f'<FeeAccrual(transaction_id={self.transaction_id}, days_overdue={self.days_overdue}, accrued_fee={self.accrued_fee})>'
+
+
+class DebtEntry(db.Model):
+    __tablename__ = 'debt_ledger'
+    __table_args__ = (
+        # A member's entries in the order they were made, for the aging of their debt
+        db.Index('ix_debt_ledger_member_id_created_at_id', 'member_id', 'created_at', 'id'),
+    )
+
+    # Append only: kind is 'charge', 'payment' or 'adjustment', and amount is what the entry adds
+    # to the member's debt (negative for payments)
+    id = db.Column(Integer, primary_key=True)
+    member_id = db.Column(Integer, ForeignKey('members.id', ondelete='CASCADE'), nullable=False)
+    transaction_id = db.Column(Integer, ForeignKey('transaction.transaction_id', ondelete='SET NULL'),
+                               nullable=True)
+    kind = db.Column(String(20), nullable=False)
+    amount = db.Column(Float, nullable=False)
+    created_at = db.Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        """
+        Returns a string representation of a debt ledger entry
+        """
+        return f'<DebtEntry(member_id={self.member_id}, kind={self.kind}, amount={self.amount})>'
+
+
+class DailyCirculation(db.Model):
+    __tablename__ = 'daily_circulation'
+
+    # Loans issued on the day, loans returned on the day, and the fees charged and paid at those returns
+    day = db.Column(Date, primary_key=True)
+    issues = db.Column(Integer, nullable=False, default=0)
+    returns = db.Column(Integer, nullable=False, default=0)
+    fees_charged = db.Column(Float, nullable=False, default=0)
+    revenue = db.Column(Float, nullable=False, default=0)
+
+    def __repr__(self):
+        """
+        Returns a string representation of a day's circulation
+        """
+        return f'<DailyCirculation(day={self.day}, issues={self.issues}, returns={self.returns})>'
+
+
+class DailyBookCirculation(db.Model):
+    __tablename__ = 'daily_book_circulation'
+    __table_args__ = (
+        db.Index('ix_daily_book_circulation_book_id_day', 'book_id', 'day'),
+    )
+
+    # The same figures per book; rows are kept when the book is deleted
+    day = db.Column(Date, primary_key=True)
+    book_id = db.Column(Integer, primary_key=True)
+    issues = db.Column(Integer, nullable=False, default=0)
+    returns = db.Column(Integer, nullable=False, default=0)
+    fees_charged = db.Column(Float, nullable=False, default=0)
+    revenue = db.Column(Float, nullable=False, default=0)
+
+    def __repr__(self):
+        """
+        Returns a string representation of a book's circulation on a day
+        """
+        return f'<DailyBookCirculation(day={self.day}, book_id={self.book_id}, issues={self.issues})>'
+
+
+class DailyMemberCirculation(db.Model):
+    __tablename__ = 'daily_member_circulation'
+    __table_args__ = (
+        db.Index('ix_daily_member_circulation_member_id_day', 'member_id', 'day'),
+    )
+
+    # The same figures per member; rows are kept when the member is deleted
+    day = db.Column(Date, primary_key=True)
+    member_id = db.Column(Integer, primary_key=True)
+    issues = db.Column(Integer, nullable=False, default=0)
+    returns = db.Column(Integer, nullable=False, default=0)
+    fees_charged = db.Column(Float, nullable=False, default=0)
+    revenue = db.Column(Float, nullable=False, default=0)
+
+    def __repr__(self):
+        """
+        Returns a string representation of a member's circulation on a day
+        """
+        return f'<DailyMemberCirculation(day={self.day}, member_id={self.member_id}, issues={self.issues})>'
@@ -0,0 +1,149 @@
+"""
+A module that caches the rendered listing fragments of the catalog and members pages.
+
+A fragment is stored under its page name and normalized arguments (sort, cursor, page size, search
+terms) together with the versions of the tables it was rendered from. Every write to those tables,
+whether from book.py, members.py, transactions.py, the batch endpoint or a command, bumps the
+table's version in table_versions when it commits. The next request then finds the stored
+versions out of date and renders the fragment again, in every worker.
+
+Fragments are kept in an in-process LRU bounded by entry count and bytes. With PAGE_CACHE_DIR set
+they are kept in a cachelib filesystem cache shared by the workers instead.
+"""
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode
+from markupsafe import Markup
+from sqlalchemy import select
+
+
+class PageCache:
+    """
+    A class that caches rendered fragments keyed by page and arguments, invalidated by table versions
+    """
+
+    def __init__(self, app=None):
+        self.size = 1000
+        self.max_bytes = 32 * 1024 * 1024
+        self.ttl = 3600
+        self.directory = None
+        self._backend = None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Read the cache configuration of the app and open the filesystem backend if one is configured
+        """
+        self.size = app.config.get('PAGE_CACHE_SIZE', self.size)
+        self.max_bytes = app.config.get('PAGE_CACHE_MAX_BYTES', self.max_bytes)
+        self.ttl = app.config.get('PAGE_CACHE_TTL', self.ttl)
+        self.directory = app.config.get('PAGE_CACHE_DIR', self.directory)
+        self._backend = None
+        if self.directory:
+            from cachelib import FileSystemCache
+
+            self._backend = FileSystemCache(self.directory, threshold=self.size, default_timeout=self.ttl)
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def fragment(self, name, arguments, tables, render):
+        """
+        Return the fragment of page name for arguments, calling render() to build it when it is not
+        cached or one of tables has changed since it was cached
+        """
+        versions = self._table_versions(tables) if self.enabled else None
+        if versions is None:
+            return Markup(render())
+
+        key = name + '?' + urlencode(sorted(arguments.items()))
+        entry = self._get(key)
+        if entry is not None and entry[0] == versions:
+            with self._lock:
+                self._hits += 1
+            return Markup(entry[1])
+
+        with self._lock:
+            self._misses += 1
+            if entry is not None:
+                self._invalidations += 1
+        html = str(render())
+        self._set(key, (versions, html))
+        return Markup(html)
+
+    def clear(self):
+        """
+        Drop every cached fragment
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._backend is not None:
+            self._backend.clear()
+
+    def stats(self):
+        """
+        Return the size, hit ratio, eviction and invalidation figures of the cache
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'backend': 'filesystem' if self._backend is not None else 'memory',
+                'entries': len(self._entries) if self._backend is None else None,
+                'bytes': self._bytes if self._backend is None else None,
+                'size': self.size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+            }
+
+    def _table_versions(self, tables):
+        from app.models import TableVersion, db
+
+        versions = dict(db.session.execute(
+            select(TableVersion.name, TableVersion.version).where(TableVersion.name.in_(tables))).all())
+        if len(versions) < len(tables):
+            # Versions not installed yet, so changes could not be noticed
+            return None
+        return tuple(versions[table] for table in tables)
+
+    def _get(self, key):
+        if self._backend is not None:
+            return self._backend.get(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _set(self, key, entry):
+        if self._backend is not None:
+            self._backend.set(key, entry)
+            return
+        size = len(entry[1].encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = entry + (size,)
+            self._bytes += size
+            while len(self._entries) > self.size or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[2]
+                self._evictions += 1
@@ -0,0 +1,134 @@
+"""
+A module that provides cursor (keyset) pagination for listing pages
+"""
+import base64
+import json
+from sqlalchemy import tuple_
+
+
+class KeysetPage:
+    """
+    A class that holds one page of rows together with the cursors for the neighbouring pages
+    """
+
+    def __init__(self, items, next_cursor, prev_cursor, per_page):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(values):
+    """
+    Encode the sort key of a row into an opaque url-safe cursor
+    """
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor created by encode_cursor. Returns None for a missing or malformed cursor
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def get_per_page(args, default, maximum):
+    """
+    Read the page size from the request arguments and clamp it to the configured bounds
+    """
+    per_page = args.get('per_page', default, type=int)
+    return max(1, min(per_page or default, maximum))
+
+
+def keyset_paginate(query, columns, after=None, before=None, per_page=50, descending=False):
+    """
+    Return a KeysetPage of the query ordered by columns, ascending unless descending is set.
+
+    columns must end with a unique column (normally the primary key) so the sort key is total.
+    Only rows after (or before) the given cursor are read, so the cost of a page does not
+    grow with its position in the table.
+    """
+    key = tuple_(*columns) if len(columns) > 1 else columns[0]
+    backwards = before is not None and after is None
+    cursor = decode_cursor(before if backwards else after)
+    if cursor is not None and len(cursor) != len(columns):
+        cursor = None
+    if cursor is None:
+        backwards = False
+
+    # Reading backwards through an ascending listing is reading forwards through a descending one
+    reverse_scan = backwards != descending
+    if cursor is not None:
+        value = tuple_(*cursor) if len(columns) > 1 else cursor[0]
+        query = query.filter(key < value if reverse_scan else key > value)
+
+    if reverse_scan:
+        query = query.order_by(*[column.desc() for column in columns])
+    else:
+        query = query.order_by(*columns)
+
+    # Fetch one extra row to find out whether there is a further page
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def row_key(row):
+        return [getattr(row, column.key) for column in columns]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backwards:
+            # We arrived from the following page, so it always exists
+            next_cursor = encode_cursor(row_key(rows[-1]))
+            if has_more:
+                prev_cursor = encode_cursor(row_key(rows[0]))
+        else:
+            if has_more:
+                next_cursor = encode_cursor(row_key(rows[-1]))
+            if cursor is not None:
+                prev_cursor = encode_cursor(row_key(rows[0]))
+
+    return KeysetPage(rows, next_cursor, prev_cursor, per_page)
+
+
+class OffsetPage:
+    """
+    A class that holds one numbered page of rows, used where rows are ordered by a computed rank
+    """
+
+    def __init__(self, items, page, per_page, has_next):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+
+def offset_paginate(query, page=1, per_page=50):
+    """
+    Return an OffsetPage of an already ordered query without running a COUNT over the matches
+    """
+    page = max(1, page or 1)
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return OffsetPage(rows[:per_page], page, per_page, len(rows) > per_page)
@@ -0,0 +1,129 @@
+"""
+A module that checks the query plans of the queries run by the busiest routes.
+
+Each hot query is run (read only) through the same code the route uses, the SQL it sends is
+captured and EXPLAIN QUERY PLAN is asked for every statement. A plan step that scans a whole table
+means an index is missing, usually because the migrations have not been applied.
+"""
+from contextlib import contextmanager
+from datetime import date
+from sqlalchemy import event
+from werkzeug.datastructures import MultiDict
+from app.models import Book, FeeAccrual, Member, Transaction, db
+from app.pagination import encode_cursor, keyset_paginate, offset_paginate
+
+
+class PlanCheck:
+    """
+    A class that holds the plan of one statement run by a hot query
+    """
+
+    def __init__(self, name, statement, plan):
+        self.name = name
+        self.statement = statement
+        self.plan = plan
+
+    @property
+    def full_scans(self):
+        """
+        The plan steps that read a whole table rather than an index or the full-text index. Scans
+        of subqueries, which only read the rows the subquery produced, are not counted
+        """
+        return [step for step in self.plan
+                if step.startswith('SCAN ') and ' USING ' not in step and 'VIRTUAL TABLE' not in step
+                and step.split()[1] in db.metadata.tables]
+
+
+@contextmanager
+def captured_statements():
+    """
+    Collect the (statement, parameters) pairs sent to the database inside the block
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+
+def hot_queries():
+    """
+    Return (name, function) pairs that run the queries of the busiest routes
+    """
+    from app.analytics import daily_totals, top_books, top_members
+    from app.counters import get_counters
+    from app.debts import aging_buckets, debtors_query, top_debtors
+    from app.models import load_identity
+    from app.routes.book import BOOK_SORTS
+    from app.routes.members import MEMBER_SORTS
+    from app.routes.transactions import TransactionFilterForm, ledger_query
+    from app.search import search_books_query, search_members_query
+
+    def ledger(**args):
+        form = TransactionFilterForm(MultiDict(args), meta={'csrf': False})
+        form.validate()
+        query, _ = ledger_query(form)
+        return lambda: keyset_paginate(query, (Transaction.transaction_id,), after=encode_cursor([1000]),
+                                       per_page=50, descending=True)
+
+    return [
+        ('home counters', get_counters),
+        ('load_user', lambda: load_identity(1)),
+        ('login by username', lambda: Member.query.filter_by(username='librarian').first()),
+        ('register email check', lambda: Member.query.filter_by(email='librarian@example.com').first()),
+        ('add_book by ISBN', lambda: Book.query.filter(Book.isbn == '9780000000000').first()),
+        ('all_books by title', lambda: keyset_paginate(Book.query, BOOK_SORTS['title'],
+                                                       after=encode_cursor(['m', 1]), per_page=50)),
+        ('all_books by author', lambda: keyset_paginate(Book.query, BOOK_SORTS['author'],
+                                                        after=encode_cursor(['m', 1]), per_page=50)),
+        ('all_members by fullname', lambda: keyset_paginate(Member.query, MEMBER_SORTS['fullname'],
+                                                            after=encode_cursor(['m', 1]), per_page=50)),
+        ('search_books', lambda: offset_paginate(search_books_query('harry potter'), 1, 50)),
+        ('lookup_books available', lambda: search_books_query('harr').filter(Book.Quantity >= 1).limit(10).all()),
+        ('search_members exact', lambda: search_members_query('librarian@example.com').limit(50).all()),
+        ('search_members prefix', lambda: search_members_query('jo sm').limit(50).all()),
+        ('search_members trigram', lambda: search_members_query('ohnso').limit(50).all()),
+        ('overdue report', lambda: keyset_paginate(FeeAccrual.query.filter(FeeAccrual.days_overdue > 0),
+                                                   (FeeAccrual.days_overdue, FeeAccrual.transaction_id),
+                                                   after=encode_cursor([30, 1000]), per_page=50, descending=True)),
+        ('top debtors', lambda: top_debtors(50)),
+        ('debtors report', lambda: keyset_paginate(debtors_query(), (Member.outstanding_debt, Member.id),
+                                                   after=encode_cursor([100.0, 1000]), per_page=50,
+                                                   descending=True)),
+        ('debt aging', aging_buckets),
+        ('analytics daily', lambda: daily_totals(date(2024, 1, 1), date(2024, 1, 31))),
+        ('analytics top books', lambda: top_books(date(2024, 1, 1), date(2024, 1, 31))),
+        ('analytics top members', lambda: top_members(date(2024, 1, 1), date(2024, 1, 31), by='revenue')),
+        ('ledger open loans', ledger(status='open')),
+        ('ledger by member', ledger(member='1')),
+        ('ledger by book', ledger(book='1')),
+        ('ledger by borrowed date', ledger(borrowed_from=date(2024, 1, 1).isoformat(),
+                                           borrowed_to=date(2024, 1, 31).isoformat())),
+    ]
+
+
+def check_query_plans():
+    """
+    Run every hot query and return a PlanCheck for each SELECT statement it sent.
+    Only SQLite plans are understood; other databases raise RuntimeError
+    """
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError('Query plan checks are only implemented for SQLite')
+
+    checks = []
+    for name, run in hot_queries():
+        with captured_statements() as statements:
+            run()
+        db.session.rollback()
+        for statement, parameters in statements:
+            rows = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+            checks.append(PlanCheck(name, statement, [row[-1] for row in rows]))
+        db.session.rollback()
+    return checks
@@ -0,0 +1,94 @@
+"""
+A module that sends the reads of read-only views to a replica database.
+
+With DATABASE_REPLICA_URI set, the replica is added as the 'replica' bind. Views decorated with
+replica_reads run their SELECT statements on it, while every write, flush and non-SELECT statement
+stays on the primary. A browser that has just sent a POST (or any other write request) reads from
+the primary for REPLICA_STICKY_SECONDS, so it always sees its own changes even while the replica
+lags behind.
+"""
+import sqlite3
+import time
+from functools import wraps
+from flask import request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+
+REPLICA_BIND = 'replica'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class RoutingSession(Session):
+    """
+    A class that creates sessions sending SELECTs to the replica when the view asked for it
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('use_replica') and not self._flushing \
+                and getattr(clause, 'is_select', False):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def replica_binds(app):
+    """
+    Return SQLALCHEMY_BINDS with the replica added, tuned with the engine profile, when
+    DATABASE_REPLICA_URI is configured
+    """
+    from app.engine_profiles import engine_options
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    uri = app.config.get('DATABASE_REPLICA_URI')
+    if uri and REPLICA_BIND not in binds:
+        binds[REPLICA_BIND] = {'url': uri, **engine_options(app.config['DATABASE_PROFILE'], uri)}
+    return binds
+
+
+def init_replicas(app):
+    """
+    Remember the write requests of each browser so its next reads stay on the primary
+    """
+    @app.after_request
+    def stick_to_primary(response):
+        if request.method in WRITE_METHODS and REPLICA_BIND in app.config.get('SQLALCHEMY_BINDS', {}):
+            session['primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+        return response
+
+
+def replica_reads(view):
+    """
+    Decorate a read-only view so its GET requests read from the replica, unless the browser wrote recently
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        from app import db
+
+        if request.method in ('GET', 'HEAD') and session.get('primary_until', 0) < time.time():
+            db.session.info['use_replica'] = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            db.session.info.pop('use_replica', None)
+    return wrapper
+
+
+def sync_sqlite_replica(primary_uri, replica_uri):
+    """
+    Copy a SQLite primary database onto a SQLite replica with the online backup API, for trying
+    out replica reads locally. Returns the number of pages copied
+    """
+    primary_path = make_url(primary_uri).database
+    replica_path = make_url(replica_uri).database
+    if make_url(primary_uri).get_backend_name() != 'sqlite' or make_url(replica_uri).get_backend_name() != 'sqlite':
+        raise ValueError('Only SQLite databases can be synced this way')
+
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path)
+    try:
+        source.backup(target)
+        return target.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
@@ -0,0 +1,347 @@
+"""
+A module that serves the catalog, members and transactions as a versioned JSON API.
+
+Every listing is cursor paginated on the primary key and takes ?fields= to return only some
+fields. Responses carry an ETag and Last-Modified built from the table's change counter, and a
+request whose If-None-Match (or If-Modified-Since) still matches is answered with 304 before any
+row is read. The analytics endpoints answer from the daily circulation rollups for a ?from=&to= range.
+The export endpoints stream a whole table, filtered, as CSV or JSONL.
+"""
+import hashlib
+from datetime import date
+from functools import wraps
+from flask import Blueprint, current_app as app, jsonify, request, stream_with_context
+from flask_login import login_required
+from app.analytics import MEASURES, daily_totals, default_range, range_totals, top_books, top_members
+from app.exports import EXPORT_FORMATS, EXPORT_PARAMS, MIMETYPES, export_fields, export_filename, export_filters, \
+    export_resource, stream_export
+from app.models import Book, Member, Transaction
+from app.pagination import get_per_page, keyset_paginate
+from app.replicas import replica_reads
+from app.versions import get_table_version
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+class Resource:
+    """
+    A class that describes one table of the API: its key and the fields clients may select
+    """
+
+    def __init__(self, table, key, fields):
+        self.table = table
+        self.key = key
+        self.fields = fields
+
+    def columns(self, selected):
+        """
+        The columns to read for the selected field names, always starting with the key
+        """
+        names = [self.key.key] + [name for name in selected if name != self.key.key]
+        return [self.fields[name].label(name) for name in names]
+
+
+BOOKS = Resource('books', Book.id, {
+    'id': Book.id, 'title': Book.title, 'author': Book.author, 'isbn': Book.isbn,
+    'publisher': Book.publisher, 'quantity': Book.Quantity,
+})
+MEMBERS = Resource('members', Member.id, {
+    'id': Member.id, 'username': Member.username, 'fullname': Member.fullname, 'email': Member.email,
+    'outstanding_debt': Member.outstanding_debt,
+})
+TRANSACTIONS = Resource('transaction', Transaction.transaction_id, {
+    'transaction_id': Transaction.transaction_id, 'member_id': Transaction.member_id,
+    'book_id': Transaction.book_id, 'borrowed_date': Transaction.borrowed_date,
+    'return_date': Transaction.return_date, 'total_fee': Transaction.total_fee,
+    'amount_paid': Transaction.amount_paid,
+})
+
+
+class ApiError(Exception):
+    """
+    Raised to answer an API request with a JSON error and status code
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@bp.errorhandler(ApiError)
+def api_error(exception):
+    return jsonify({'error': exception.message}), exception.status
+
+
+def selected_fields(resource):
+    """
+    Read ?fields=a,b from the request, all fields by default
+    """
+    fields = request.args.get('fields')
+    if not fields:
+        return list(resource.fields)
+    selected = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in selected if name not in resource.fields]
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(unknown)}. Choose from: {', '.join(resource.fields)}")
+    return selected
+
+
+def serialize(row, selected):
+    """
+    Turn a row into a dict of the selected fields, dates as ISO 8601
+    """
+    item = {}
+    for name in selected:
+        value = getattr(row, name)
+        item[name] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return item
+
+
+def conditional(resource):
+    """
+    Decorate a view so it answers 304 when the client's copy is still current, and tags its
+    responses with the ETag and Last-Modified of the resource's table
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version = get_table_version(resource.table)
+            if version is None:
+                # Versions not installed yet, serve without validators
+                return view(*args, **kwargs)
+
+            # The representation depends on the table version and on the url (fields, cursor, filters)
+            etag = hashlib.sha1(f'{version.version}:{request.full_path}'.encode()).hexdigest()[:20]
+            modified_at = version.modified_at.replace(microsecond=0)
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = request.if_modified_since is not None and \
+                    modified_at <= request.if_modified_since.replace(tzinfo=None)
+
+            if not_modified:
+                response = app.response_class(status=304)
+            else:
+                response = view(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = modified_at
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def list_resource(resource, query):
+    """
+    Return a JSON page of a query over resource with the cursors of the neighbouring pages
+    """
+    selected = selected_fields(resource)
+    per_page = get_per_page(request.args, app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+    page = keyset_paginate(query.with_entities(*resource.columns(selected)), (resource.key,),
+                           after=request.args.get('after'), before=request.args.get('before'), per_page=per_page)
+    return jsonify({
+        'data': [serialize(row, selected) for row in page.items],
+        'next': page.next_cursor,
+        'prev': page.prev_cursor,
+    })
+
+
+def get_resource(resource, query, key):
+    """
+    Return the JSON object of one row of resource, or a 404 error
+    """
+    selected = selected_fields(resource)
+    row = query.with_entities(*resource.columns(selected)).filter(resource.key == key).first()
+    if row is None:
+        raise ApiError('Not found', 404)
+    return jsonify({'data': serialize(row, selected)})
+
+
+@bp.route('/books')
+@replica_reads
+@conditional(BOOKS)
+def list_books():
+    """
+    A route that lists the catalog
+    """
+    return list_resource(BOOKS, Book.query)
+
+
+@bp.route('/books/<int:book_id>')
+@replica_reads
+@conditional(BOOKS)
+def get_book(book_id):
+    """
+    A route that returns one book
+    """
+    return get_resource(BOOKS, Book.query, book_id)
+
+
+@bp.route('/members')
+@login_required
+@replica_reads
+@conditional(MEMBERS)
+def list_members():
+    """
+    A route that lists the members
+    """
+    return list_resource(MEMBERS, Member.query)
+
+
+@bp.route('/members/<int:member_id>')
+@login_required
+@replica_reads
+@conditional(MEMBERS)
+def get_member(member_id):
+    """
+    A route that returns one member
+    """
+    return get_resource(MEMBERS, Member.query, member_id)
+
+
+@bp.route('/transactions')
+@login_required
+@replica_reads
+@conditional(TRANSACTIONS)
+def list_transactions():
+    """
+    A route that lists the transactions, filtered by ?member_id=, ?book_id= and ?status=open|closed
+    """
+    query = Transaction.query
+    member_id = request.args.get('member_id', type=int)
+    book_id = request.args.get('book_id', type=int)
+    status = request.args.get('status')
+    if member_id is not None:
+        query = query.filter(Transaction.member_id == member_id)
+    if book_id is not None:
+        query = query.filter(Transaction.book_id == book_id)
+    if status == 'open':
+        query = query.filter(Transaction.return_date.is_(None))
+    elif status == 'closed':
+        query = query.filter(Transaction.return_date.isnot(None))
+    elif status:
+        raise ApiError("status must be 'open' or 'closed'")
+    return list_resource(TRANSACTIONS, query)
+
+
+@bp.route('/transactions/<int:transaction_id>')
+@login_required
+@replica_reads
+@conditional(TRANSACTIONS)
+def get_transaction(transaction_id):
+    """
+    A route that returns one transaction
+    """
+    return get_resource(TRANSACTIONS, Transaction.query, transaction_id)
+
+
+def analytics_range():
+    """
+    Read ?from= and ?to= (ISO dates) from the request, the current month by default
+    """
+    start, end = default_range()
+    try:
+        start = date.fromisoformat(request.args['from']) if request.args.get('from') else start
+        end = date.fromisoformat(request.args['to']) if request.args.get('to') else end
+    except ValueError:
+        raise ApiError('from and to must be dates like 2024-01-31') from None
+    if start > end:
+        raise ApiError('from must not be after to')
+    return start, end
+
+
+def ranking():
+    """
+    Read ?by= and ?limit= for the top books and members, the most loans and 10 by default
+    """
+    by = request.args.get('by', 'issues')
+    if by not in MEASURES:
+        raise ApiError(f"by must be one of: {', '.join(MEASURES)}")
+    limit = request.args.get('limit', 10, type=int)
+    return by, max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+
+
+@bp.route('/analytics/daily')
+@login_required
+@replica_reads
+def analytics_daily():
+    """
+    A route that returns the circulation of every day of a range and its totals
+    """
+    start, end = analytics_range()
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'totals': range_totals(start, end),
+        'data': [serialize(day, ('day',) + MEASURES) for day in daily_totals(start, end)],
+    })
+
+
+@bp.route('/analytics/books')
+@login_required
+@replica_reads
+def analytics_books():
+    """
+    A route that returns the books with the most loans (or ?by= another figure) in a range
+    """
+    start, end = analytics_range()
+    by, limit = ranking()
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'by': by,
+        'data': [serialize(row, ('id', 'title') + MEASURES) for row in top_books(start, end, limit, by)],
+    })
+
+
+@bp.route('/analytics/members')
+@login_required
+@replica_reads
+def analytics_members():
+    """
+    A route that returns the busiest members (or those with the most of ?by=) in a range
+    """
+    start, end = analytics_range()
+    by, limit = ranking()
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'by': by,
+        'data': [serialize(row, ('id', 'fullname') + MEASURES) for row in top_members(start, end, limit, by)],
+    })
+
+
+@bp.route('/export/<name>.<file_format>')
+@login_required
+def export(name, file_format):
+    """
+    A route that streams every row of books, members or transactions as CSV or JSONL, with ?fields=,
+    the filters of the export and ?compress=gzip
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ApiError(f"Unknown format {file_format!r}, choose from: {', '.join(EXPORT_FORMATS)}", 404)
+    compress = request.args.get('compress')
+    if compress not in (None, '', 'gzip'):
+        raise ApiError("compress must be 'gzip'")
+    try:
+        resource = export_resource(name)
+    except ValueError as exception:
+        raise ApiError(str(exception), 404) from None
+    try:
+        selected = export_fields(resource, request.args.get('fields'))
+        conditions = export_filters(name, {key: value for key, value in request.args.items()
+                                           if key not in EXPORT_PARAMS})
+    except ValueError as exception:
+        raise ApiError(str(exception)) from None
+
+    chunks = stream_export(resource, selected, conditions, file_format, compress=bool(compress),
+                           batch_size=app.config['EXPORT_BATCH_SIZE'])
+    filename = export_filename(name, file_format, bool(compress))
+    return app.response_class(
+        stream_with_context(chunks),
+        mimetype='application/gzip' if compress else MIMETYPES[file_format],
+        headers={'Content-Disposition': f'attachment; filename={filename}'})
@@ -2,17 +2,16 @@
 A module that contains the registration, login, and home page
 """
 
-from flask import Flask, current_app as app, render_template, request, Blueprint, flash, redirect, url_for
+from flask import current_app as app, render_template, request, Blueprint, flash, redirect, url_for, jsonify, abort
 from flask_login import logout_user, login_user, login_required
-from flask_bootstrap import Bootstrap
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField
 from wtforms.validators import InputRequired, Length, Email, EqualTo, ValidationError
-from app.models import Member, Book, Transaction, db
-
-# Configure Bootstrap
-app = Flask(__name__)
-Bootstrap(app)
+from app import password_hasher, identity_cache, page_cache, instrumentation
+from app.replicas import replica_reads
+from app.models import Member, db
+from app.counters import get_counters
+from app.hashing import HashingBusyError
 
 # Create the auth blueprint
 bp = Blueprint('auth', __name__)
@@ -67,7 +66,17 @@ def login():
         # Retrieve the user by username from the database
         user = Member.query.filter_by(username=form.username.data).first()
 
-        if user and user.verify_password(form.password.data):  
+        try:
+            verified = user is not None and user.verify_password(form.password.data)
+            if verified and user.password_needs_rehash():
+                # Upgrade hashes made with an older method or cost while the password is at hand
+                user.create_password(form.password.data)
+                db.session.commit()
+        except HashingBusyError as exception:
+            flash(str(exception), 'danger')
+            return render_template('auth/login.html', form=form), 503
+
+        if verified:
             login_user(user)  # Log in the user
             flash('Login successful', 'success')
             return redirect(url_for('auth.home')) 
@@ -79,15 +88,17 @@ def login():
 # Home route
 @bp.route('/home')
 @login_required
+@replica_reads
 def home():
     """
     Homepage
     """
-    # Query for total books, members, and transactions
-    total_books = Book.query.count()
-    total_members = Member.query.count()
-    total_transactions = Transaction.query.count()
-    ongoing_issues = Transaction.query.filter(Transaction.return_date==None).count()
+    # Read the total books, members, and transactions from the maintained counters
+    counters = get_counters()
+    total_books = counters['books']
+    total_members = counters['members']
+    total_transactions = counters['transactions']
+    ongoing_issues = counters['ongoing_issues']
 
 
     return render_template('auth/home.html',  ongoing_issues=ongoing_issues, total_books=total_books,  total_members=total_members,  total_transactions= total_transactions )
@@ -101,7 +112,11 @@ def register():
     form = RegistrationForm()
     if form.validate_on_submit():
         new_member = Member(username=form.username.data, fullname=form.fullname.data, email=form.email.data)
-        new_member.create_password(form.password.data)
+        try:
+            new_member.create_password(form.password.data)
+        except HashingBusyError as exception:
+            flash(str(exception), 'danger')
+            return render_template('auth/register.html', form=form), 503
         db.session.add(new_member)
         db.session.commit()
         flash('Registration successful!', 'success')
@@ -121,3 +136,44 @@ def logout():
     logout_user() 
     flash('Logged out successfully', 'success')
     return redirect(url_for('auth.login'))
+
+@bp.route('/hashing-stats')
+@login_required
+def hashing_stats():
+    """
+    Queue depth and latency figures of the password hasher
+    """
+    return jsonify(password_hasher.stats())
+
+@bp.route('/identity-cache-stats')
+@login_required
+def identity_cache_stats():
+    """
+    Hit ratio and size figures of the member identity cache
+    """
+    return jsonify(identity_cache.stats())
+
+@bp.route('/page-cache-stats')
+@login_required
+def page_cache_stats():
+    """
+    Hit ratio, eviction and invalidation figures of the rendered listing cache
+    """
+    return jsonify(page_cache.stats())
+
+@bp.route('/slow-queries')
+@login_required
+def slow_queries():
+    """
+    Normalized statements slower than SLOW_QUERY_MS, slowest total time first
+    """
+    return jsonify(instrumentation.slow_queries())
+
+@bp.route('/metrics')
+def metrics():
+    """
+    Request, SQL, hashing and cache figures in the Prometheus text format, for scraping
+    """
+    if not instrumentation.enabled:
+        abort(404)
+    return app.response_class(instrumentation.render(), mimetype='text/plain; version=0.0.4')
@@ -2,18 +2,33 @@
 A module that Imports book using the Frappe API, adds book to the library database, allows Librarian
 to search for books, updates book details, deletes book details, and view all books
 """
-from flask import Flask, Blueprint, flash, redirect, url_for, render_template, request
+import io
+import json
+from flask import Blueprint, flash, redirect, url_for, render_template, request, current_app, jsonify
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, IntegerField, SubmitField
 from wtforms.validators import InputRequired, Length, NumberRange
+from werkzeug.datastructures import MultiDict
+from sqlalchemy.exc import SQLAlchemyError
 from app.models import Book, db
-import requests
-
-app = Flask(__name__)
+from app.catalog import upsert_books, ingest_books, read_book_rows
+from app.frappe import fetch_books
+from app.pagination import keyset_paginate, offset_paginate, get_per_page
+from app.search import normalize, search_books_query
+from app import page_cache
+from app.replicas import replica_reads
 
 # Create the books blueprint
 bp = Blueprint('book', __name__)
 
+# Sort options of the catalog listing, each backed by an index ending in the primary key
+BOOK_SORTS = {
+    'id': (Book.id,),
+    'title': (Book.title, Book.id),
+    'author': (Book.author, Book.id),
+}
+
 class ImportBooksForm(FlaskForm):
     """
     A class that creates a form object to import books
@@ -21,6 +36,13 @@ class ImportBooksForm(FlaskForm):
     search = StringField('Search by Title or Author', validators=[InputRequired(), Length(max=255)])
     submit = SubmitField('Search Frappe Library')
 
+class ImportSelectedBooksForm(FlaskForm):
+    """
+    A class that creates a form object to import the selected Frappe results at once
+    """
+    quantity = IntegerField('Copies of each book', default=1, validators=[InputRequired(), NumberRange(min=1, max=30)])
+    submit = SubmitField('Import All Selected')
+
 class AddBookForm(FlaskForm):
     """
     A class that creates a form object to add books
@@ -32,6 +54,13 @@ class AddBookForm(FlaskForm):
     quantity = IntegerField('Quantity', validators=[InputRequired(), NumberRange(min=1, max=30)])
     submit = SubmitField('Add Book')
 
+class IngestBooksForm(FlaskForm):
+    """
+    A class that creates a form object to bulk load books from a file
+    """
+    file = FileField('CSV or JSONL file', validators=[FileRequired(), FileAllowed(['csv', 'jsonl'], 'CSV or JSONL files only')])
+    submit = SubmitField('Load Books')
+
 class SearchBooksForm(FlaskForm):
     """
     A class that creates a form object to search for books
@@ -51,6 +80,29 @@ class DeleteBooksForm(FlaskForm):
     quantity= IntegerField('Quantity', validators=[InputRequired(), NumberRange(min=1, max=30)])
     submit = SubmitField('Delete')
 
+def book_row_validator():
+    """
+    Return a function that validates a book given as a dict of title, author, isbn, publisher and
+    quantity with the AddBookForm rules. It returns the book ready for upsert_books (or None) and
+    the form errors. One form is reused for every row, which is much cheaper for bulk loads
+    """
+    form = AddBookForm(formdata=None, meta={'csrf': False})
+
+    def validate(row):
+        form.process(MultiDict({key: str(value) for key, value in row.items() if value is not None}))
+        if not form.validate():
+            return None, form.errors
+        book = {
+            'title': form.title.data,
+            'author': form.author.data,
+            'isbn': form.isbn.data,
+            'publisher': form.publisher.data,
+            'Quantity': form.quantity.data,
+        }
+        return book, {}
+
+    return validate
+
 class UpdateBookForm(FlaskForm):
     """
     Class that creates a form object to update book details
@@ -68,38 +120,79 @@ def import_books():
     A route that imports books using the Frappe API
     """
     form = ImportBooksForm()
+    import_form = ImportSelectedBooksForm()
 
     if request.method == 'POST' and form.validate_on_submit():
         search_query = form.search.data
 
-        # Define the API URL
-        frappe_api_url = "https://frappe.io/api/method/frappe-library"
+        # Fetch several result pages from the API at once
+        results = fetch_books(search_query, current_app.config['FRAPPE_API_URL'],
+                              pages=current_app.config['FRAPPE_PAGES'], timeout=current_app.config['FRAPPE_TIMEOUT'])
+        if results.failed_pages:
+            pages = ', '.join(str(page) for page in results.failed_pages)
+            flash(f"Could not fetch result page(s) {pages} from Frappe, showing partial results.", "warning")
 
-        # Prepare parameters for the API request
-        params = {
-            'title': search_query,  # Search by title
-            'authors': search_query,  # Search by authors
-            'isbn': 1,  
-            'publisher': 1,  
-        }
+        # Filter the API results to include only books with matching titles or authors
+        matching_books = [book for book in results.books if
+                            search_query.lower() in (book.get("title") or "").lower() or
+                            search_query.lower() in (book.get("authors") or "").lower()]
+        if not matching_books:
+            flash("No matching books found.", "warning")
+        return render_template('book/import_books.html', search_results=matching_books, form=form,
+                               import_form=import_form)
+    return render_template('book/import_books.html', form=form, import_form=import_form)
+
+@bp.route('/import-books/selected', methods=['POST'])
+def import_selected_books():
+    """
+    A route that adds every selected Frappe result to the library in a single transaction
+    """
+    import_form = ImportSelectedBooksForm()
+    if not import_form.validate_on_submit():
+        flash("Please enter between 1 and 30 copies to import.", "warning")
+        return redirect(url_for('book.import_books'))
+
+    validate_book_row = book_row_validator()
+    books = []
+    skipped = 0
+    for selected in request.form.getlist('selected'):
         try:
-            # Fetch data from the API
-            response = requests.get(frappe_api_url, params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()["message"]
-
-                # Filter the API results to include only books with matching titles or authors
-                matching_books = [book for book in data if
-                                    search_query.lower() in book["title"].lower() or
-                                    search_query.lower() in book["authors"].lower()]
-                if not matching_books:
-                    flash("No matching books found.", "warning")
-                return render_template('book/import_books.html', search_results=matching_books, form=form)
-            else:
-                print("Request failed with timeout:", response.status_code)
-        except requests.Timeout:
-            print("The request timed out")
-    return render_template('book/import_books.html', form=form)
+            result = json.loads(selected)
+        except ValueError:
+            skipped += 1
+            continue
+        if not isinstance(result, dict):
+            skipped += 1
+            continue
+        book, errors = validate_book_row({
+            'title': result.get('title'),
+            'author': result.get('authors'),
+            'isbn': result.get('isbn'),
+            'publisher': result.get('publisher'),
+            'quantity': import_form.quantity.data,
+        })
+        if errors:
+            skipped += 1
+        else:
+            books.append(book)
+
+    if not books:
+        flash("No valid books were selected.", "warning")
+        return redirect(url_for('book.import_books'))
+
+    try:
+        # Insert new ISBNs and increment the quantity of existing ones in one statement
+        imported = upsert_books(books)
+        db.session.commit()
+    except SQLAlchemyError as exception:
+        db.session.rollback()
+        flash(f"An error occurred while importing the books: {str(exception)}", "error")
+        return redirect(url_for('book.import_books'))
+
+    if skipped:
+        flash(f"Skipped {skipped} invalid book(s).", "warning")
+    flash(f'Successfully imported {imported} book(s) to the library!', 'success')
+    return redirect(url_for('book.all_books'))
 
 # A route for adding books to library
 @bp.route('/add-book', methods=['POST', 'GET'])
@@ -141,6 +234,26 @@ def add_book():
 
     return render_template('book/add_book.html', form=form)
 
+# A route for bulk loading books from a file
+@bp.route('/ingest-books', methods=['GET', 'POST'])
+def ingest_books_file():
+    """
+    A route that loads a CSV or JSONL file of books into the library in batches
+    """
+    form = IngestBooksForm()
+    report = None
+
+    if form.validate_on_submit():
+        upload = form.file.data
+        file_format = 'csv' if upload.filename.lower().endswith('.csv') else 'jsonl'
+        # Stream the upload instead of reading it into memory
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        report = ingest_books(read_book_rows(stream, file_format), book_row_validator(),
+                              batch_size=current_app.config['INGEST_BATCH_SIZE'])
+        flash(f'Loaded {report.loaded} of {report.rows} row(s).', 'success' if not report.errors else 'warning')
+
+    return render_template('book/ingest_books.html', form=form, report=report)
+
 # Route for deleting books
 @bp.route('/delete-book', methods=['GET', 'POST'])
 def delete_book():
@@ -206,29 +319,84 @@ def update_book(book_id):
     return render_template('book/update_book.html', form=form, book_to_update=book_to_update, book_id=book_id)
 
 @bp.route('/search-books', methods=['POST', 'GET'])
+@replica_reads
 def search_books():
     """
-    A route that allows the librarian to search for any book using title or author
+    A route that allows the librarian to search for any book using title, author, ISBN or publisher
     """
     form = SearchBooksForm()
 
-    book_list = []
     if request.method == 'POST':
-        search_query = form.search.data
-        # Query the database by author or title
-        book_list = Book.query.filter(Book.title.like(f'%{search_query}%') | Book.author.like(f'%{search_query}%')).all()
+        # Redirect to a GET url so that result pages can be linked to
+        return redirect(url_for('book.search_books', q=form.search.data))
 
-        if not book_list:
+    search_query = request.args.get('q', '')
+    form.search.data = search_query
+
+    listing = None
+    query = search_books_query(search_query)
+    if query is not None:
+        per_page = get_per_page(request.args, current_app.config['PAGE_SIZE'], current_app.config['MAX_PAGE_SIZE'])
+        page_number = max(1, request.args.get('page', 1, type=int) or 1)
+
+        def render_results():
+            # Query the full-text index, best matches first
+            page = offset_paginate(query, page_number, per_page)
+            if not page.items:
+                return ''
+            return render_template('book/search_books_list.html', book_list=page.items, page=page,
+                                   search_query=search_query)
+
+        listing = page_cache.fragment('book.search_books',
+                                      {'q': ' '.join(normalize(search_query).split()), 'page': page_number,
+                                       'per_page': per_page},
+                                      ('books',), render_results)
+        if not listing:
             flash("No matching book copies found in the library")
             return render_template("book/search_books.html", form=form)
 
-    return render_template("book/search_books.html", form=form, book_list=book_list)
+    return render_template("book/search_books.html", form=form, listing=listing)
 
 @bp.route('/all-books', methods=['GET'])
+@replica_reads
 def all_books():
     """
-    A route that displays all books in the library
+    A route that displays the books in the library one page at a time
+    """
+    sort = request.args.get('sort', 'id')
+    if sort not in BOOK_SORTS:
+        sort = 'id'
+    per_page = get_per_page(request.args, current_app.config['PAGE_SIZE'], current_app.config['MAX_PAGE_SIZE'])
+
+    after = request.args.get('after')
+    before = request.args.get('before')
+
+    def render_books():
+        # Query the database for the page after (or before) the cursor
+        page = keyset_paginate(Book.query, BOOK_SORTS[sort], after=after, before=before, per_page=per_page)
+        return render_template('book/all_books_list.html', library_books=page.items, page=page, sort=sort,
+                               sort_options=BOOK_SORTS.keys())
+
+    listing = page_cache.fragment('book.all_books',
+                                  {'sort': sort, 'after': after or '', 'before': before or '', 'per_page': per_page},
+                                  ('books',), render_books)
+    return render_template('book/all_books.html', listing=listing)
+
+@bp.route('/books/lookup', methods=['GET'])
+@replica_reads
+def lookup_books():
+    """
+    A route that returns books matching a title, author or ISBN prefix as JSON, for typeahead pickers.
+    Pass available=1 to only suggest books with copies left to issue
     """
-    # Query the database for all books
-    library_books = Book.query.all()
-    return render_template('book/all_books.html', library_books=library_books)
+    limit = get_per_page(request.args, current_app.config['LOOKUP_LIMIT'], current_app.config['LOOKUP_LIMIT'])
+    query = search_books_query(request.args.get('q', ''))
+    if query is None:
+        return jsonify([])
+    if request.args.get('available', type=int):
+        query = query.filter(Book.Quantity >= 1)
+
+    return jsonify([
+        {'id': book.id, 'label': f'{book.title} by {book.author}', 'available': book.Quantity}
+        for book in query.limit(limit)
+    ])
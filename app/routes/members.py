@@ -2,17 +2,30 @@
 A module that allows the librarian to search for members, update member details, view members, 
 delete members and view all members
 """
-from flask import Blueprint, flash, redirect, url_for, render_template, request, abort
+from flask import Blueprint, flash, redirect, url_for, render_template, request, abort, current_app, jsonify
 from flask_wtf import FlaskForm
-from wtforms import StringField, IntegerField, SubmitField
+from wtforms import StringField, FloatField, SubmitField
+from wtforms.widgets import HiddenInput
 from wtforms.validators import InputRequired, Length, Email
 from sqlalchemy.exc import SQLAlchemyError
-from werkzeug.security import generate_password_hash
 from app.models import Member, db
+from app.debts import set_balance
+from app.hashing import HashingBusyError
+from app.pagination import keyset_paginate, offset_paginate, get_per_page
+from app.search import search_members_query
+from app import page_cache
+from app.replicas import replica_reads
 
 # Create blueprint
 bp = Blueprint('member', __name__)
 
+# Sort options of the members listing, each backed by an index ending in the primary key
+MEMBER_SORTS = {
+    'id': (Member.id,),
+    'username': (Member.username, Member.id),
+    'fullname': (Member.fullname, Member.id),
+}
+
 class SearchMembersForm(FlaskForm):
     """
     Class that creates a form object to view member details
@@ -28,7 +41,9 @@ class UpdateMembersForm(FlaskForm):
     username = StringField('Username', validators=[InputRequired(), Length(max=255)])
     fullname = StringField('Fullname', validators=[InputRequired(), Length(max=255)])
     email = StringField('Email', validators=[InputRequired(), Email()])
-    outstanding_debt = IntegerField('outstanding debt', validators=[InputRequired()])
+    outstanding_debt = FloatField('outstanding debt', validators=[InputRequired()])
+    # The debt shown when the form was loaded, the balance an edit is made against
+    displayed_debt = FloatField(widget=HiddenInput(), validators=[InputRequired()])
     submit = SubmitField('Update')
 
 class DeleteMembersForm(FlaskForm):
@@ -38,7 +53,7 @@ class DeleteMembersForm(FlaskForm):
     username = StringField('Username', validators=[InputRequired(), Length(max=255)])
     fullname = StringField('Fullname', validators=[InputRequired(), Length(max=255)])
     email = StringField('Email', validators=[InputRequired(), Email()])
-    outstanding_debt = IntegerField('outstanding debt', validators=[InputRequired()])
+    outstanding_debt = FloatField('outstanding debt', validators=[InputRequired()])
     submit = SubmitField('Delete')
 
 class AddMembersForm(FlaskForm):
@@ -53,6 +68,7 @@ class AddMembersForm(FlaskForm):
 
 # Route to search member details
 @bp.route('/search-members', methods=['POST', 'GET'])
+@replica_reads
 def search_members():
 
     """
@@ -60,27 +76,33 @@ def search_members():
     """
     form = SearchMembersForm()
 
-    members_list = []
     if request.method == 'POST':
-        search_query = form.search.data
-
-        if search_query:
-            # Attempt to query by ID
-            if search_query.isdigit():
-                member_id = int(search_query)
-                members_list = Member.query.filter(Member.id == member_id).all()
-            else:
-                # If it's not a valid integer, query by name, email, or username
-                members_list = Member.query.filter(
-                    (Member.fullname.like(f'%{search_query}%')) |
-                    (Member.username.like(f'%{search_query}%')) |
-                    (Member.email.like(f'%{search_query}%'))
-                ).all()
-
-            if not members_list:
-                flash('Member not found!')
-                return redirect(url_for('member.search_members'))
-    return render_template('member/search_members.html', form=form, members_list=members_list)
+        # Redirect to a GET url so that result pages can be linked to
+        return redirect(url_for('member.search_members', q=form.search.data))
+
+    search_query = request.args.get('q', '').strip()
+    form.search.data = search_query
+
+    members_list = []
+    page = None
+    if search_query:
+        # Attempt to query by ID
+        if search_query.isdigit():
+            query = Member.query.filter(Member.id == int(search_query))
+        else:
+            # If it's not a valid integer, query the search index by name, email, or username
+            query = search_members_query(search_query)
+
+        if query is not None:
+            per_page = get_per_page(request.args, current_app.config['PAGE_SIZE'], current_app.config['MAX_PAGE_SIZE'])
+            page = offset_paginate(query, request.args.get('page', 1, type=int), per_page)
+            members_list = page.items
+
+        if not members_list:
+            flash('Member not found!')
+            return redirect(url_for('member.search_members'))
+    return render_template('member/search_members.html', form=form, members_list=members_list, page=page,
+                           search_query=search_query)
 
 # Route to edit member details
 @bp.route('/update-members/<int:id>', methods=['POST', 'GET'])
@@ -88,12 +110,9 @@ def update_members(id):
     """
     A route to update member details
     """
-    print(f"Received ID: {id}")  # Add this line to check the received ID
     member_to_update = Member.query.get(id)
     form = UpdateMembersForm()
 
-    print(f"Member: {member_to_update.id}")
-
     if member_to_update:
         if request.method == 'GET':
             # Prefill the form with member details
@@ -101,29 +120,29 @@ def update_members(id):
             form.fullname.data = member_to_update.fullname
             form.email.data = member_to_update.email
             form.outstanding_debt.data = member_to_update.outstanding_debt
-            print(f"debt: {member_to_update.email}")
+            form.displayed_debt.data = member_to_update.outstanding_debt or 0
 
         if form.validate_on_submit() and request.method == "POST":
             # Update member details based on form data
             member_to_update.username = form.username.data 
             member_to_update.fullname = form.fullname.data
             member_to_update.email = form.email.data
-            member_to_update.outstanding_debt = form.outstanding_debt.data  
-            print(f"debt: {member_to_update.email}")
-            if form.errors:
-                print("Form errors:", form.errors)
+            # A changed debt is recorded in the debt ledger as an adjustment, made against the debt
+            # the librarian saw so that a charge made since the form was loaded is not overwritten
+            if not set_balance(member_to_update.id, form.displayed_debt.data, form.outstanding_debt.data):
+                db.session.rollback()
+                flash(f"{member_to_update.fullname}'s debt changed meanwhile, please review it again", "error")
+                return redirect(url_for('member.update_members', id=id))
             try:
                 db.session.commit()
-                print("Database commit successful") 
                 flash(f"{member_to_update.fullname}'s details updated successfully", "success")
                 return redirect(url_for('member.search_members'))
             except Exception as e:
                 db.session.rollback()
                 flash(f"An error occurred while updating member details: {str(e)}", "error")
-        else:
-            print("form not validated")
 
         return render_template('member/update_members.html', form=form, member_to_update=member_to_update, id=id)
+    abort(404)
 
 
 # Route to delete members
@@ -163,16 +182,20 @@ def add_member():
         email = request.form.get('email')
         # Generate a temporary password
         temporary_password = 'temporary_password'
-        hashed_password = generate_password_hash(temporary_password)
 
         # Check if Username already exists
         existing_member = Member.query.filter_by(username=username).first()
         if existing_member:
             flash("This username is taken")
-        else:
-            # Create a new member
-            new_member = Member(username=username, fullname=fullname, email=email,
-                                hash_password=hashed_password)
+            return render_template('member/add_members.html', form=form)
+
+        # Create a new member
+        new_member = Member(username=username, fullname=fullname, email=email)
+        try:
+            new_member.create_password(temporary_password)
+        except HashingBusyError as exception:
+            flash(str(exception), "error")
+            return render_template('member/add_members.html', form=form), 503
         
 
         try:
@@ -188,9 +211,46 @@ def add_member():
     return render_template('member/add_members.html', form=form)
 
 @bp.route('/all-members')
+@replica_reads
 def all_members():
     """ 
-    A route for viewing all members in the database
+    A route for viewing the members in the database one page at a time
     """
-    all_members = Member.query.all()
-    return render_template('member/all_members.html', all_members=all_members)
+    sort = request.args.get('sort', 'id')
+    if sort not in MEMBER_SORTS:
+        sort = 'id'
+    per_page = get_per_page(request.args, current_app.config['PAGE_SIZE'], current_app.config['MAX_PAGE_SIZE'])
+
+    after = request.args.get('after')
+    before = request.args.get('before')
+
+    def render_members():
+        page = keyset_paginate(Member.query, MEMBER_SORTS[sort], after=after, before=before, per_page=per_page)
+        return render_template('member/all_members_list.html', all_members=page.items, page=page, sort=sort,
+                               sort_options=MEMBER_SORTS.keys())
+
+    listing = page_cache.fragment('member.all_members',
+                                  {'sort': sort, 'after': after or '', 'before': before or '', 'per_page': per_page},
+                                  ('members',), render_members)
+    return render_template('member/all_members.html', listing=listing)
+
+@bp.route('/members/lookup')
+@replica_reads
+def lookup_members():
+    """
+    A route that returns members matching a name, username or email prefix (or an ID) as JSON,
+    for typeahead pickers
+    """
+    limit = get_per_page(request.args, current_app.config['LOOKUP_LIMIT'], current_app.config['LOOKUP_LIMIT'])
+    search_query = request.args.get('q', '').strip()
+    if search_query.isdigit():
+        query = Member.query.filter(Member.id == int(search_query))
+    else:
+        query = search_members_query(search_query)
+    if query is None:
+        return jsonify([])
+
+    return jsonify([
+        {'id': member.id, 'label': f'{member.fullname} ({member.username})'}
+        for member in query.limit(limit)
+    ])
@@ -3,12 +3,21 @@ A module allows the librarian to issues ooks, return books, and view transaction
 
 """
 from datetime import date
-from flask import current_app as app, render_template, request, Blueprint, flash, redirect, url_for
-from app.models import Transaction, Member, Book, db
+from flask import current_app as app, render_template, request, Blueprint, flash, redirect, url_for, jsonify
+from flask_login import login_required
+from app.models import Transaction, Member, Book, FeeAccrual, db
+from app.fees import MAX_OUTSTANDING_DEBT, accrue_fees, loan_fee
+from app.analytics import MEASURES, daily_totals, default_range, range_totals, record_circulation, top_books, top_members
+from app.circulation import CirculationConflict, run_batch
+from app.debts import aging_buckets, debtors_query, owed_since, post_returns
+from app.pagination import keyset_paginate, get_per_page
+from app.replicas import replica_reads
 from flask_wtf import FlaskForm
-from wtforms import SelectField, SubmitField, IntegerField, FloatField
-from wtforms.validators import InputRequired
-from sqlalchemy.exc import SQLAlchemyError
+from wtforms import SubmitField, IntegerField, FloatField, SelectField, DateField
+from wtforms.validators import InputRequired, Optional, ValidationError
+from sqlalchemy import delete, func, update
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.orm import contains_eager
 
 # Create the transactions blueprint
 
@@ -19,10 +28,26 @@ class IssueBookForm(FlaskForm):
     """
     A class that creates a form object for issuing books
     """
-    member = SelectField('Select Member', validators=[InputRequired()], coerce=int)
-    book = SelectField('Select Book', validators=[InputRequired()], coerce=int)
+    member = IntegerField('Select Member', validators=[InputRequired()])
+    book = IntegerField('Select Book', validators=[InputRequired()])
     submit = SubmitField('Issue Book')
 
+    def validate_member(self, member):
+        """
+        Custom validator that checks the member exists with a single primary key lookup
+        """
+        self.selected_member = db.session.get(Member, member.data)
+        if self.selected_member is None:
+            raise ValidationError('Please select a member from the suggestions.')
+
+    def validate_book(self, book):
+        """
+        Custom validator that checks the book exists with a single primary key lookup
+        """
+        self.selected_book = db.session.get(Book, book.data)
+        if self.selected_book is None:
+            raise ValidationError('Please select a book from the suggestions.')
+
 class ReturnBookForm(FlaskForm):
     """
     A class that creates a form object for returning books
@@ -33,6 +58,33 @@ class ReturnBookForm(FlaskForm):
     Amount_paid = FloatField('Amount paid', validators=[InputRequired()])
     submit = SubmitField('Return Book')
 
+class AccrueFeesForm(FlaskForm):
+    """
+    A class that creates a form object to recompute the fee accrual snapshot
+    """
+    submit = SubmitField('Recompute')
+
+class TransactionFilterForm(FlaskForm):
+    """
+    A class that creates a form object to filter the transactions ledger
+    """
+    status = SelectField('Status', choices=[('', 'All'), ('open', 'Open'), ('closed', 'Returned')], validators=[Optional()])
+    member = IntegerField('Member ID', validators=[Optional()])
+    book = IntegerField('Book ID', validators=[Optional()])
+    borrowed_from = DateField('Borrowed from', validators=[Optional()])
+    borrowed_to = DateField('Borrowed to', validators=[Optional()])
+    submit = SubmitField('Filter')
+
+class AnalyticsFilterForm(FlaskForm):
+    """
+    A class that creates a form object to choose the range of the circulation analytics
+    """
+    start = DateField('From', validators=[Optional()])
+    end = DateField('To', validators=[Optional()])
+    by = SelectField('Rank by', choices=[('issues', 'Loans'), ('returns', 'Returns'), ('revenue', 'Revenue'),
+                                         ('fees_charged', 'Fees charged')], validators=[Optional()])
+    submit = SubmitField('Show')
+
 
 # Issue Book
 @bp.route('/issue-book', methods=['GET', 'POST'])
@@ -42,49 +94,57 @@ def issue_book():
     """
     form = IssueBookForm()
 
-    # Fill the form dropdowns with all members and books from the database
-    form.member.choices = [(member.id, member.fullname) for member in Member.query.all()]
-    form.book.choices = [(book.id, book.title) for book in Book.query.all()]
-
     if request.method == 'POST' and form.validate_on_submit():
         member_id = form.member.data
         book_id = form.book.data
-                    
-        # Check if the user has already borrowed a book
-        existing_transaction = Transaction.query.filter_by(member_id=member_id, return_date=None).first()
-        if existing_transaction:
-            flash(f"{Member.query.get(member_id).fullname} has already borrowed a book", "error")
+        selected_member = form.selected_member
+        selected_book = form.selected_book
+        member_name = selected_member.fullname
+        book_title = selected_book.title
+
+        transaction = Transaction(
+            member_id=member_id,
+            book_id=book_id,
+            borrowed_date=date.today()
+            )
+
+        try:
+            # The partial unique index on open loans rejects a second loan for the member
+            db.session.add(transaction)
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            flash(f"{member_name} has already borrowed a book", "error")
             return redirect(url_for('transactions.issue_book'))
-        
-        # Check if the book is available for issue
-        selected_book = Book.query.get(book_id)
-        if selected_book and selected_book.Quantity >= 1:
-            # Fetch the per_day_fee from the Transaction table
-            transaction = Transaction.query.filter_by(book_id=book_id, return_date=None).first()
-            
-            # Create a new transaction record with per_day_fee from the selected book
-            transaction = Transaction(
-                member_id=member_id,
-                book_id=book_id,
-                borrowed_date=date.today()
-                )
-
-            try:
-                # Decrease the total available copies of the selected book by 1
-                selected_book.Quantity -= 1
+        except SQLAlchemyError as exception:
+            db.session.rollback()
+            flash(f"An error occurred while issuing the book: {str(exception)}", "error")
+            return render_template('transaction/issue_book.html', form=form)
+
+        try:
+            # Decrease the available copies by 1 only if a copy is left, in a single statement
+            taken = db.session.execute(
+                update(Book)
+                .where(Book.id == book_id, Book.Quantity >= 1)
+                .values(Quantity=Book.Quantity - 1)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not taken:
+                db.session.rollback()
+                flash(f"Book '{book_title}' is not available for issue", "error")
+                return render_template('transaction/issue_book.html', form=form)
+            # Count the loan in the daily analytics rollups
+            record_circulation(issues=[(transaction.borrowed_date, book_id, member_id)])
 
-                # Commit the changes to the database
-                db.session.add(transaction)
-                db.session.commit()
+            # Commit the changes to the database
+            db.session.commit()
 
-                flash(f'Book: "{selected_book.title}" issued to {Member.query.get(member_id).fullname}', "success")
-                return redirect(url_for('transactions.issue_book'))
+            flash(f'Book: "{book_title}" issued to {member_name}', "success")
+            return redirect(url_for('transactions.issue_book'))
 
-            except SQLAlchemyError as exception:
-                db.session.rollback()
-                flash(f"An error occurred while issuing the book: {str(exception)}", "error")
-        else:
-            flash(f"Book '{selected_book.title}' is not available for issue", "error")
+        except SQLAlchemyError as exception:
+            db.session.rollback()
+            flash(f"An error occurred while issuing the book: {str(exception)}", "error")
 
     return render_template('transaction/issue_book.html', form=form)
 
@@ -96,22 +156,14 @@ def return_book(transaction_id):
     """
     # Fetch the transaction by ID
     transaction = Transaction.query.get(transaction_id)
-    member = Member.query.get(transaction.member_id)
 
     if transaction:
         # Calculate the total fee based on days rented and the per-day fee
         return_date = date.today()
         borrowed_date = transaction.borrowed_date
 
-        # Calculate the number of days rented
-        days_rented = (return_date - borrowed_date).days
-
-        # Calculate the total rent based on the number of days rented and the per-day fee
-        total_fee = days_rented * 50
-
-        if days_rented < 1:
-            # Automatically charge 50 if the book is returned in less than a day
-            total_fee = 50.0
+        # Calculate the number of days rented and the rent for them with the shared fee policy
+        days_rented, total_fee = loan_fee(borrowed_date, return_date)
 
         # Initialize the form with prefilled data
         form = ReturnBookForm(
@@ -128,28 +180,38 @@ def return_book(transaction_id):
                 flash(f'Please enter a lower amount. The fee due is {total_fee}')
                 return redirect(url_for('transactions.return_book', transaction_id= transaction_id))
 
-            # Check if outstanding_debt is None, and if so, initialize it to 0
-            if member.outstanding_debt is None:
-                member.outstanding_debt = 0
-            # Calculate the debt for this transaction based on the amount paid
-
-            transaction_debt = total_fee - amount_paid
-            # Check if outstanding_debt + transaction_debt exceeds 500
-            if member.outstanding_debt + transaction_debt > 500:
-                flash("Outstanding debt cannot exceed Rs. 500", "error")
-                return redirect(url_for('transactions.issue_book', transaction_id=transaction_id))
-
-            # Update the transaction table with returned_date, total_fee, and amount_paid
-            transaction.return_date = return_date
-            transaction.total_fee = total_fee
-            transaction.amount_paid = amount_paid
+            # Update the transaction table with returned_date, total_fee, and amount_paid, only if the
+            # loan is still open so that a repeated submit cannot return the book twice
+            returned = db.session.execute(
+                update(Transaction)
+                .where(Transaction.transaction_id == transaction_id, Transaction.return_date.is_(None))
+                .values(return_date=return_date, total_fee=total_fee, amount_paid=amount_paid)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not returned:
+                db.session.rollback()
+                flash("This book has already been returned.", "error")
+                return redirect(url_for('transactions.view_transactions'))
 
-            # Update member's outstanding debt
-            member.outstanding_debt += transaction_debt  # Subtract the transaction_debt from the outstanding debt
+            # The loan is closed, so it no longer belongs in the fee accrual snapshot
+            db.session.execute(delete(FeeAccrual).where(FeeAccrual.transaction_id == transaction_id))
 
-            # Increase the available quantity of the returned book
-            book = Book.query.get(transaction.book_id)
-            book.Quantity += 1
+            # Charge the fee and record the payment; the member's debt only grows if it stays within the limit
+            if not post_returns([(transaction.member_id, transaction_id, total_fee, amount_paid)]):
+                db.session.rollback()
+                flash(f"Outstanding debt cannot exceed Rs. {MAX_OUTSTANDING_DEBT}", "error")
+                return redirect(url_for('transactions.issue_book', transaction_id=transaction_id))
+            # Count the return and its fee in the daily analytics rollups
+            record_circulation(returns=[(return_date, transaction.book_id, transaction.member_id, total_fee,
+                                         amount_paid)])
+
+            # Increase the available quantity of the returned book in a single statement
+            db.session.execute(
+                update(Book)
+                .where(Book.id == transaction.book_id)
+                .values(Quantity=Book.Quantity + 1)
+                .execution_options(synchronize_session=False)
+            )
 
             # Commit the changes to the database
             try:
@@ -174,13 +236,148 @@ def return_book(transaction_id):
         transaction=transaction
     )
 
+def ledger_query(form):
+    """
+    Build the ledger query for the valid filters of a TransactionFilterForm. Returns the query
+    and the applied filters as url arguments
+    """
+    # Load the member and book names in the same statement as the transactions
+    query = (Transaction.query
+             .outerjoin(Transaction.member)
+             .outerjoin(Transaction.book)
+             .options(contains_eager(Transaction.member).load_only(Member.fullname),
+                      contains_eager(Transaction.book).load_only(Book.title)))
+
+    filters = {}
+    if form.status.data == 'open' and not form.status.errors:
+        query = query.filter(Transaction.return_date.is_(None))
+        filters['status'] = 'open'
+    elif form.status.data == 'closed' and not form.status.errors:
+        query = query.filter(Transaction.return_date.isnot(None))
+        filters['status'] = 'closed'
+    if form.member.data is not None and not form.member.errors:
+        query = query.filter(Transaction.member_id == form.member.data)
+        filters['member'] = form.member.data
+    if form.book.data is not None and not form.book.errors:
+        query = query.filter(Transaction.book_id == form.book.data)
+        filters['book'] = form.book.data
+    if form.borrowed_from.data is not None and not form.borrowed_from.errors:
+        query = query.filter(Transaction.borrowed_date >= form.borrowed_from.data)
+        filters['borrowed_from'] = form.borrowed_from.data.isoformat()
+    if form.borrowed_to.data is not None and not form.borrowed_to.errors:
+        query = query.filter(Transaction.borrowed_date <= form.borrowed_to.data)
+        filters['borrowed_to'] = form.borrowed_to.data.isoformat()
+    return query, filters
+
 # Route to view transactions
-@app.route('/transactions', methods=['GET'])
+@bp.route('/transactions', methods=['GET'])
+@replica_reads
 def view_transactions():
     """
-    A route for viewing transactions 
+    A route for viewing the transactions ledger, newest first, with filters
     """
-    # Retrieve all transactions from the database
-    transactions = Transaction.query.all()
+    form = TransactionFilterForm(request.args, meta={'csrf': False})
+    form.validate()
+    query, filters = ledger_query(form)
+
+    per_page = get_per_page(request.args, app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+    page = keyset_paginate(query, (Transaction.transaction_id,), after=request.args.get('after'),
+                           before=request.args.get('before'), per_page=per_page, descending=True)
+
+    return render_template('transaction/view_transactions.html', transactions=page.items, page=page, form=form,
+                           filters=filters)
 
-    return render_template('transaction/view_transactions.html', transactions=transactions)
+
+@bp.route('/overdue', methods=['GET', 'POST'])
+@replica_reads
+def overdue_report():
+    """
+    A route for the overdue loans of the latest fee accrual snapshot, longest overdue first
+    """
+    form = AccrueFeesForm()
+    if request.method == 'POST' and form.validate_on_submit():
+        run = accrue_fees(batch_size=app.config['FEE_ACCRUAL_BATCH_SIZE'])
+        flash(f'Accrued fees for {run.loans} open loan(s), {run.overdue} overdue', 'success')
+        return redirect(url_for('transactions.overdue_report'))
+
+    overdue = FeeAccrual.days_overdue > 0
+    summary = db.session.execute(
+        db.select(func.count(), func.coalesce(func.sum(FeeAccrual.accrued_fee), 0), func.max(FeeAccrual.as_of))
+        .where(overdue)
+    ).one()
+
+    query = (FeeAccrual.query
+             .filter(overdue)
+             .outerjoin(FeeAccrual.member)
+             .outerjoin(FeeAccrual.book)
+             .options(contains_eager(FeeAccrual.member).load_only(Member.fullname),
+                      contains_eager(FeeAccrual.book).load_only(Book.title)))
+    per_page = get_per_page(request.args, app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+    page = keyset_paginate(query, (FeeAccrual.days_overdue, FeeAccrual.transaction_id),
+                           after=request.args.get('after'), before=request.args.get('before'),
+                           per_page=per_page, descending=True)
+
+    return render_template('transaction/overdue_report.html', accruals=page.items, page=page, form=form,
+                           overdue_loans=summary[0], overdue_fees=summary[1], as_of=summary[2])
+
+
+@bp.route('/debts')
+@replica_reads
+def debt_report():
+    """
+    A route for the members that owe the most, largest debt first, and the age of what is owed
+    """
+    per_page = get_per_page(request.args, app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+    page = keyset_paginate(debtors_query(), (Member.outstanding_debt, Member.id),
+                           after=request.args.get('after'), before=request.args.get('before'),
+                           per_page=per_page, descending=True)
+    since = owed_since([member.id for member in page.items])
+    return render_template('transaction/debt_report.html', debtors=page.items, page=page, since=since,
+                           buckets=aging_buckets())
+
+
+@bp.route('/analytics')
+@replica_reads
+def analytics_report():
+    """
+    A route for the circulation of a date range: daily figures, most borrowed books and busiest
+    members, read from the daily rollups only
+    """
+    form = AnalyticsFilterForm(request.args, meta={'csrf': False})
+    form.validate()
+    start, end = default_range()
+    start = form.start.data or start
+    end = form.end.data or end
+    # An unknown ?by= falls back to the loans, as the figure is looked up on the rollups
+    by = form.by.data if form.by.data in MEASURES and not form.by.errors else 'issues'
+
+    return render_template('transaction/analytics.html', form=form, start=start, end=end, by=by,
+                           totals=range_totals(start, end), days=daily_totals(start, end),
+                           books=top_books(start, end, by=by), members=top_members(start, end, by=by))
+
+
+@bp.route('/circulation/batch', methods=['POST'])
+@login_required
+def circulation_batch():
+    """
+    A route that issues and returns a batch of books in one transaction, for the scanning desk.
+    Takes {"operations": [...]} and answers with a result per operation
+    """
+    payload = request.get_json(silent=True)
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'Expected a JSON object with a non-empty "operations" list'}), 400
+    limit = app.config['CIRCULATION_BATCH_LIMIT']
+    if len(operations) > limit:
+        return jsonify({'error': f'A batch may hold at most {limit} operations'}), 413
+
+    try:
+        results = run_batch(operations)
+    except CirculationConflict as exception:
+        return jsonify({'error': f'{exception}, please resubmit the batch'}), 409
+
+    return jsonify({
+        'applied': sum(result.ok for result in results),
+        'failed': sum(not result.ok for result in results),
+        'results': [result.to_dict() for result in results],
+    })
@@ -0,0 +1,256 @@
+"""
+A module that maintains the search indexes of the books and members tables and runs searches on them.
+
+Books: SQLite uses an external content FTS5 table kept in sync by triggers, PostgreSQL uses a GIN
+index over a weighted tsvector expression. Both are maintained by the database itself, so every
+write to the books table (including add_book, update_book and delete_book) keeps the index current.
+
+Members: normalized tokens of the username, email and full name (plus trigrams of every word) are
+stored in the member_search_tokens table, which is updated by mapper events whenever a member is
+inserted, updated or deleted through the session.
+"""
+import re
+import unicodedata
+from sqlalchemy import DDL, event, text, table, column, select, func, inspect
+from app.models import Book, Member, MemberSearchToken, db
+
+# Weighted document of a book. The GIN index is built on exactly this expression so the planner uses it
+BOOK_TSVECTOR = (
+    "setweight(to_tsvector('simple', coalesce(books.title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(books.author, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(books.isbn, '')), 'C') || "
+    "setweight(to_tsvector('simple', coalesce(books.publisher, '')), 'D')"
+)
+
+SQLITE_BOOK_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, author, isbn, publisher,
+        content='books', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author, isbn, publisher)
+        VALUES (new.id, new.title, new.author, new.isbn, new.publisher);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, isbn, publisher)
+        VALUES ('delete', old.id, old.title, old.author, old.isbn, old.publisher);
+    END""",
+    # Quantity changes are the most frequent write and do not touch the index
+    """CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, isbn, publisher ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, isbn, publisher)
+        VALUES ('delete', old.id, old.title, old.author, old.isbn, old.publisher);
+        INSERT INTO books_fts(rowid, title, author, isbn, publisher)
+        VALUES (new.id, new.title, new.author, new.isbn, new.publisher);
+    END""",
+]
+
+POSTGRESQL_BOOK_SEARCH_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_books_search ON books USING GIN (({BOOK_TSVECTOR}))",
+]
+
+books_fts = table('books_fts', column('rowid'))
+
+for statement in SQLITE_BOOK_SEARCH_DDL:
+    event.listen(Book.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRESQL_BOOK_SEARCH_DDL:
+    event.listen(Book.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+
+def normalize(value):
+    """
+    Normalize a string for indexing and lookups: unicode compatibility form, case folded and stripped
+    """
+    return unicodedata.normalize('NFKC', value or '').casefold().strip()
+
+
+def search_terms(search_query):
+    """
+    Split a search string into normalized word tokens that are safe to embed in a match expression
+    """
+    return re.findall(r'\w+', normalize(search_query))
+
+
+def rebuild_book_search():
+    """
+    Create the search index if it is missing and repopulate it from the books table
+    """
+    dialect = db.engine.dialect.name
+    with db.engine.begin() as connection:
+        if dialect == 'sqlite':
+            for statement in SQLITE_BOOK_SEARCH_DDL:
+                connection.execute(text(statement))
+            connection.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+        elif dialect == 'postgresql':
+            # The expression index is rebuilt from the table on REINDEX
+            for statement in POSTGRESQL_BOOK_SEARCH_DDL:
+                connection.execute(text(statement))
+            connection.execute(text("REINDEX INDEX ix_books_search"))
+    return dialect
+
+
+def search_books_query(search_query):
+    """
+    Return a query of books matching every term of search_query as a prefix in the title, author,
+    ISBN or publisher, ordered best match first. Returns None when there is nothing to search for
+    """
+    terms = search_terms(search_query)
+    if not terms:
+        return None
+
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return (Book.query
+                .join(books_fts, books_fts.c.rowid == Book.id)
+                .filter(text('books_fts MATCH :match'))
+                # Title hits outrank author hits, which outrank ISBN and publisher hits
+                .order_by(text('bm25(books_fts, 10.0, 5.0, 2.0, 1.0)'), Book.id)
+                .params(match=match))
+
+    if dialect == 'postgresql':
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        return (Book.query
+                .filter(text(f"({BOOK_TSVECTOR}) @@ to_tsquery('simple', :tsquery)"))
+                .order_by(text(f"ts_rank(({BOOK_TSVECTOR}), to_tsquery('simple', :tsquery)) DESC"), Book.id)
+                .params(tsquery=tsquery))
+
+    # Other databases have no index support here, fall back to matching every term with LIKE
+    query = Book.query
+    for term in terms:
+        pattern = f'%{term}%'
+        query = query.filter(Book.title.ilike(pattern) | Book.author.ilike(pattern) |
+                             Book.isbn.ilike(pattern) | Book.publisher.ilike(pattern))
+    return query.order_by(Book.id)
+
+
+def trigrams(word):
+    """
+    Return the set of three character substrings of a word
+    """
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def member_tokens(member):
+    """
+    Return the (kind, token) pairs indexed for a member
+    """
+    username = normalize(member.username)
+    email = normalize(member.email)
+    words = set(search_terms(member.fullname)) | set(search_terms(username)) | set(search_terms(email))
+
+    tokens = {('username', username[:255]), ('email', email[:255])}
+    tokens |= {('word', word[:255]) for word in words}
+    tokens |= {('trigram', gram) for word in words for gram in trigrams(word)}
+    return tokens
+
+
+def _insert_member_tokens(connection, members):
+    rows = [{'kind': kind, 'token': token, 'member_id': member.id}
+            for member in members for kind, token in member_tokens(member)]
+    if rows:
+        connection.execute(MemberSearchToken.__table__.insert(), rows)
+
+
+def _delete_member_tokens(connection, member_id):
+    connection.execute(MemberSearchToken.__table__.delete().where(MemberSearchToken.member_id == member_id))
+
+
+@event.listens_for(Member, 'after_insert')
+def index_new_member(mapper, connection, member):
+    """
+    Index a member created by auth.register or member.add_member
+    """
+    _insert_member_tokens(connection, [member])
+
+
+@event.listens_for(Member, 'after_update')
+def reindex_member(mapper, connection, member):
+    """
+    Reindex a member when update_members changes one of the searchable fields
+    """
+    state = inspect(member)
+    if not any(state.attrs[name].history.has_changes() for name in ('username', 'fullname', 'email')):
+        return
+    _delete_member_tokens(connection, member.id)
+    _insert_member_tokens(connection, [member])
+
+
+@event.listens_for(Member, 'after_delete')
+def unindex_member(mapper, connection, member):
+    """
+    Drop the tokens of a member removed by delete_members
+    """
+    _delete_member_tokens(connection, member.id)
+
+
+def rebuild_member_search(batch_size=1000):
+    """
+    Repopulate the member_search_tokens table from the members table
+    """
+    with db.engine.begin() as connection:
+        connection.execute(MemberSearchToken.__table__.delete())
+        members = connection.execution_options(yield_per=batch_size).execute(
+            select(Member.id, Member.username, Member.fullname, Member.email))
+        for batch in members.partitions():
+            _insert_member_tokens(connection, batch)
+
+
+def _prefix_upper_bound(prefix):
+    # The smallest string greater than every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _word_prefix_ids(term):
+    # Member ids with a word starting with term, read as a range scan of the token primary key
+    return (select(MemberSearchToken.member_id)
+            .where(MemberSearchToken.kind == 'word',
+                   MemberSearchToken.token >= term,
+                   MemberSearchToken.token < _prefix_upper_bound(term)))
+
+
+def _trigram_ids(term):
+    # Member ids with a word containing every trigram of term
+    grams = trigrams(term)
+    return (select(MemberSearchToken.member_id)
+            .where(MemberSearchToken.kind == 'trigram', MemberSearchToken.token.in_(grams))
+            .group_by(MemberSearchToken.member_id)
+            .having(func.count(MemberSearchToken.token.distinct()) == len(grams)))
+
+
+def search_members_query(search_query):
+    """
+    Return a query of members matching search_query, or None when there is nothing to search for.
+
+    An exact (case-insensitive) username or email is a single index lookup. Otherwise every term
+    must be the prefix of a word of the member's name, username or email; if no member matches
+    that way, terms of three or more characters are looked up anywhere in a word through trigrams.
+    """
+    terms = search_terms(search_query)
+    if not terms:
+        return None
+
+    normalized = normalize(search_query)
+    exact_ids = db.session.scalars(
+        select(MemberSearchToken.member_id)
+        .where(MemberSearchToken.kind.in_(('username', 'email')), MemberSearchToken.token == normalized)
+    ).all()
+    if exact_ids:
+        return Member.query.filter(Member.id.in_(exact_ids)).order_by(Member.id)
+
+    query = Member.query
+    for term in terms:
+        query = query.filter(Member.id.in_(_word_prefix_ids(term)))
+    if query.limit(1).first() is not None or not any(len(term) >= 3 for term in terms):
+        return query.order_by(Member.id)
+
+    query = Member.query
+    for term in terms:
+        if len(term) < 3:
+            query = query.filter(Member.id.in_(_word_prefix_ids(term)))
+            continue
+        # Trigrams can match out of order, so confirm the substring on the few candidate rows
+        pattern = f'%{term}%'
+        query = query.filter(Member.id.in_(_trigram_ids(term)),
+                             Member.fullname.ilike(pattern) | Member.username.ilike(pattern) |
+                             Member.email.ilike(pattern))
+    return query.order_by(Member.id)
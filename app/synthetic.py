@@ -0,0 +1,244 @@
+"""
+A module that bulk loads a synthetic library of realistic size and shape.
+
+The same seed always gives the same library. Book popularity and member activity are skewed
+(a few books and members account for most loans), the loans are spread over several years in
+transaction_id order, most of them are returned with a fee (some only partly paid, with their
+charge and payment in the debt ledger) and the most recent ones are still open, some of them overdue. Rows are generated with NumPy and written in
+batches straight to the driver (COPY on PostgreSQL), so millions of transactions load in minutes.
+"""
+import csv
+import io
+import time
+from datetime import date
+import numpy as np
+from sqlalchemy import bindparam, func, select, update
+from app.debts import ADJUSTMENT, CHARGE, PAYMENT
+from app.fees import MAX_OUTSTANDING_DEBT, MINIMUM_FEE, accrued_fees
+from app.models import Book, DebtEntry, Member, Transaction, db
+
+FIRST_NAMES = ('Asha', 'Ben', 'Chen', 'Dara', 'Elif', 'Femi', 'Gita', 'Hugo', 'Ines', 'Jonas', 'Kiran', 'Lena',
+               'Mateo', 'Nia', 'Omar', 'Priya', 'Quinn', 'Ravi', 'Sara', 'Tomas', 'Uma', 'Vera', 'Wei', 'Yusuf')
+LAST_NAMES = ('Adeyemi', 'Bose', 'Costa', 'Dubois', 'Evans', 'Fischer', 'Garcia', 'Haddad', 'Ito', 'Jensen',
+              'Khan', 'Larsen', 'Mensah', 'Novak', 'Okafor', 'Patel', 'Rossi', 'Sato', 'Tanaka', 'Weber')
+TITLE_WORDS = ('Silent', 'River', 'Garden', 'Winter', 'Empire', 'Glass', 'Shadow', 'Letters', 'Harbor', 'Storm',
+               'Orchard', 'Signal', 'Atlas', 'Memory', 'Lantern', 'Circuit', 'Desert', 'Crown', 'Echo', 'Tide')
+PUBLISHERS = ('Penguin', 'HarperCollins', 'Macmillan', 'Hachette', 'Simon & Schuster', 'Scholastic', 'Bloomsbury',
+              'Pan Macmillan', 'Orient BlackSwan', 'Rupa Publications')
+
+# Zipf exponents of book popularity and member activity
+BOOK_SKEW = 1.1
+MEMBER_SKEW = 0.8
+
+# Days of loan history, and the mean loan length of returned books
+HISTORY_DAYS = 3 * 365
+MEAN_LOAN_DAYS = 12
+
+# Share of returned loans that were only partly paid
+PARTLY_PAID_FRACTION = 0.05
+
+# Open loans were borrowed within this many days, so some of them are overdue
+OPEN_LOAN_DAYS = 60
+
+
+class SyntheticLibrary:
+    """
+    A class that holds the figures of a synthetic library load
+    """
+
+    def __init__(self, seed, books, members, transactions, open_loans):
+        self.seed = seed
+        self.books = books
+        self.members = members
+        self.transactions = transactions
+        self.open_loans = open_loans
+        self.elapsed = 0.0
+
+    def as_dict(self):
+        return {'seed': self.seed, 'books': self.books, 'members': self.members,
+                'transactions': self.transactions, 'open_loans': self.open_loans}
+
+
+def skewed_weights(rng, count, skew):
+    """
+    Return the Zipf probabilities of count items, shuffled so the popular ones are spread over the ids
+    """
+    weights = 1.0 / np.arange(1, count + 1) ** skew
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def bulk_insert(connection, table, columns, rows):
+    """
+    Insert rows (tuples in columns order) into table in one round trip of the driver
+    """
+    if not rows:
+        return
+    if connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        names = ', '.join(f'"{column}"' for column in columns)
+        cursor.copy_expert(f'COPY "{table.name}" ({names}) FROM STDIN WITH (FORMAT csv)', buffer)
+        return
+    insert = table.insert()
+    compiled = insert.compile(dialect=connection.dialect, column_keys=columns)
+    if connection.dialect.positional and compiled.positiontup == list(columns):
+        # Hand the tuples straight to the driver, skipping the per-row parameter processing
+        connection.exec_driver_sql(str(compiled), rows)
+    else:
+        connection.execute(insert, [dict(zip(columns, row)) for row in rows])
+
+
+def _books(rng, start, stop):
+    ids = np.arange(start, stop)
+    words = rng.integers(0, len(TITLE_WORDS), size=(2, len(ids))).tolist()
+    authors = rng.integers(0, len(FIRST_NAMES) * len(LAST_NAMES), size=len(ids)).tolist()
+    publishers = rng.integers(0, len(PUBLISHERS), size=len(ids)).tolist()
+    quantities = rng.integers(1, 6, size=len(ids)).tolist()
+    return [
+        (book_id, f'The {TITLE_WORDS[first]} {TITLE_WORDS[second]}',
+         f'{FIRST_NAMES[author % len(FIRST_NAMES)]} {LAST_NAMES[author // len(FIRST_NAMES)]}',
+         f'978{book_id:010d}', PUBLISHERS[publisher], quantity)
+        for book_id, first, second, author, publisher, quantity
+        in zip(ids.tolist(), *words, authors, publishers, quantities)
+    ]
+
+
+def _members(rng, start, stop):
+    ids = np.arange(start, stop)
+    names = rng.integers(0, len(FIRST_NAMES) * len(LAST_NAMES), size=len(ids)).tolist()
+    return [
+        (member_id, f'{FIRST_NAMES[name % len(FIRST_NAMES)].lower()}{member_id}',
+         f'{FIRST_NAMES[name % len(FIRST_NAMES)]} {LAST_NAMES[name // len(FIRST_NAMES)]}',
+         f'm{member_id}@example.org', 0.0)
+        for member_id, name in zip(ids.tolist(), names)
+    ]
+
+
+def _closed_loans(rng, start, stop, transactions, today, book_weights, member_weights):
+    ids = np.arange(start, stop)
+    # Older transaction ids were borrowed longer ago, give or take a week
+    age = (HISTORY_DAYS * (1 - ids / transactions)).astype(np.int64) + rng.integers(0, 7, size=len(ids))
+    days_rented = np.minimum(rng.geometric(1 / MEAN_LOAN_DAYS, size=len(ids)) - 1, age)
+    borrowed = today - age
+    returned = borrowed + days_rented
+    fees = accrued_fees(days_rented).astype(np.float64)
+    paid = fees.copy()
+    partly = rng.random(len(ids)) < PARTLY_PAID_FRACTION
+    paid[partly] = np.maximum(fees[partly] - MINIMUM_FEE * rng.integers(1, 4, size=int(partly.sum())), 0)
+    book_ids = rng.choice(len(book_weights), size=len(ids), p=book_weights) + 1
+    member_ids = rng.choice(len(member_weights), size=len(ids), p=member_weights) + 1
+    rows = list(zip(ids.tolist(), book_ids.tolist(), member_ids.tolist(),
+                    np.datetime_as_string(borrowed, unit='D').tolist(),
+                    np.datetime_as_string(returned, unit='D').tolist(), fees.tolist(), paid.tolist()))
+
+    # Only the partly paid loans leave a debt, so only their charges and payments go to the debt ledger
+    ledger = []
+    for transaction_id, member_id, fee, amount, returned_on in zip(
+            ids[partly].tolist(), member_ids[partly].tolist(), fees[partly].tolist(), paid[partly].tolist(),
+            np.datetime_as_string(returned[partly], unit='D').tolist()):
+        ledger.append((member_id, transaction_id, CHARGE, fee, f'{returned_on} 12:00:00'))
+        if amount:
+            ledger.append((member_id, transaction_id, PAYMENT, -amount, f'{returned_on} 12:00:00'))
+    return rows, ledger, member_ids, fees - paid
+
+
+def _open_loans(rng, start, members, today, book_weights):
+    count = len(members)
+    ids = np.arange(start, start + count)
+    borrowed = today - rng.integers(0, OPEN_LOAN_DAYS, size=count)
+    book_ids = rng.choice(len(book_weights), size=count, p=book_weights) + 1
+    return list(zip(ids.tolist(), book_ids.tolist(), members.tolist(),
+                    np.datetime_as_string(borrowed, unit='D').tolist(),
+                    [None] * count, [None] * count, [None] * count))
+
+
+def generate_library(books, members, transactions, seed=0, open_fraction=0.05, batch_size=100000, today=None):
+    """
+    Load books, members and transactions synthetic rows into the empty library tables and commit.
+    A member has at most one open loan, so at most members loans are left open. Returns the
+    SyntheticLibrary. The search indexes and counters are rebuilt by the caller.
+    """
+    started = time.perf_counter()
+    for model in (Book, Member, Transaction, DebtEntry):
+        if db.session.execute(select(func.count()).select_from(model)).scalar():
+            raise ValueError(f'The {model.__tablename__} table is not empty')
+
+    rng = np.random.default_rng(seed)
+    today = np.datetime64(today or date.today(), 'D')
+    open_loans = min(int(transactions * open_fraction), members)
+    closed_loans = transactions - open_loans
+    book_weights = skewed_weights(rng, books, BOOK_SKEW)
+    member_weights = skewed_weights(rng, members, MEMBER_SKEW)
+    connection = db.session.connection()
+
+    for start in range(1, books + 1, batch_size):
+        bulk_insert(connection, Book.__table__, ('id', 'title', 'author', 'isbn', 'publisher', 'Quantity'),
+                    _books(rng, start, min(start + batch_size, books + 1)))
+
+    for start in range(1, members + 1, batch_size):
+        bulk_insert(connection, Member.__table__, ('id', 'username', 'fullname', 'email', 'outstanding_debt'),
+                    _members(rng, start, min(start + batch_size, members + 1)))
+
+    columns = ('transaction_id', 'book_id', 'member_id', 'borrowed_date', 'return_date', 'total_fee', 'amount_paid')
+    ledger_columns = ('member_id', 'transaction_id', 'kind', 'amount', 'created_at')
+    debts = np.zeros(members + 1)
+    for start in range(1, closed_loans + 1, batch_size):
+        rows, ledger, member_ids, unpaid = _closed_loans(rng, start, min(start + batch_size, closed_loans + 1),
+                                                         transactions, today, book_weights, member_weights)
+        debts += np.bincount(member_ids, weights=unpaid, minlength=members + 1)
+        bulk_insert(connection, Transaction.__table__, columns, rows)
+        bulk_insert(connection, DebtEntry.__table__, ledger_columns, ledger)
+    open_members = rng.choice(members, size=open_loans, replace=False) + 1
+    for offset in range(0, open_loans, batch_size):
+        bulk_insert(connection, Transaction.__table__, columns,
+                    _open_loans(rng, closed_loans + 1 + offset, open_members[offset:offset + batch_size], today,
+                                book_weights))
+
+    # Members owe the unpaid part of their fees, up to the debt limit; the excess is written off
+    debtors = np.flatnonzero(debts)
+    excess = debts[debtors] - MAX_OUTSTANDING_DEBT
+    written_off = excess > 0
+    bulk_insert(connection, DebtEntry.__table__, ledger_columns,
+                [(member_id, None, ADJUSTMENT, -amount, f'{today} 12:00:00')
+                 for member_id, amount in zip(debtors[written_off].tolist(), excess[written_off].tolist())])
+    debts = np.minimum(debts[debtors], MAX_OUTSTANDING_DEBT)
+    for offset in range(0, len(debtors), batch_size):
+        connection.execute(
+            update(Member.__table__).where(Member.id == bindparam('key')).values(outstanding_debt=bindparam('debt')),
+            [{'key': key, 'debt': debt} for key, debt in zip(debtors[offset:offset + batch_size].tolist(),
+                                                            debts[offset:offset + batch_size].tolist())])
+
+    if connection.dialect.name == 'postgresql':
+        # COPY bypasses the sequences, so move them past the loaded ids
+        for table, key in ((Book.__table__, 'id'), (Member.__table__, 'id'), (Transaction.__table__, 'transaction_id')):
+            connection.exec_driver_sql(
+                f"""SELECT setval(pg_get_serial_sequence('"{table.name}"', '{key}'),
+                    (SELECT COALESCE(MAX("{key}"), 1) FROM "{table.name}"))""")
+    db.session.commit()
+
+    library = SyntheticLibrary(seed, books, members, transactions, open_loans)
+    library.elapsed = time.perf_counter() - started
+    return library
+
+
+def finish_library():
+    """
+    Rebuild what the bulk load bypassed: the search indexes, the home page counters, the fee
+    accrual snapshot and the analytics rollups, then refresh the planner statistics
+    """
+    from app.analytics import backfill_rollups
+    from app.counters import reconcile_counters
+    from app.fees import accrue_fees
+    from app.search import rebuild_book_search, rebuild_member_search
+
+    rebuild_book_search()
+    rebuild_member_search()
+    reconcile_counters()
+    accrue_fees()
+    backfill_rollups()
+    connection = db.session.connection()
+    connection.exec_driver_sql('ANALYZE')
+    db.session.commit()
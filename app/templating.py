@@ -0,0 +1,37 @@
+"""
+A module that configures how Jinja caches the compiled templates.
+
+Compiled templates are kept in a bounded LRU cache (TEMPLATE_CACHE_SIZE). With TEMPLATE_BYTECODE_DIR
+set, their bytecode is also written to that directory, so a worker starting up loads the compiled
+templates from it instead of parsing every template again. With TEMPLATE_PRECOMPILE set every template
+is compiled when the app is created, before the first request. Templates are only checked for
+changes on disk when TEMPLATES_AUTO_RELOAD is on, which it is under DEBUG unless set.
+"""
+import os
+import time
+from jinja2 import FileSystemBytecodeCache
+
+
+def jinja_options(app):
+    """
+    Return the Jinja environment options of app with its template cache size and bytecode cache
+    """
+    options = dict(app.jinja_options)
+    options['cache_size'] = app.config['TEMPLATE_CACHE_SIZE']
+    directory = app.config.get('TEMPLATE_BYTECODE_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        options['bytecode_cache'] = FileSystemBytecodeCache(directory)
+    return options
+
+
+def precompile_templates(app):
+    """
+    Compile every template of app into the template cache (and the bytecode cache, if configured).
+    Returns the number of templates and the seconds it took
+    """
+    started = time.perf_counter()
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names), time.perf_counter() - started
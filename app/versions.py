@@ -0,0 +1,85 @@
+"""
+A module that keeps a change counter and last modified time for each API table.
+
+Every INSERT, UPDATE or DELETE statement on the books, members and transaction tables is noted on
+its connection, whether it came from a flush or a Core statement. When the session commits, each
+table written in the transaction has its row in table_versions bumped once, in the same
+transaction, so concurrent writers hold the version row only for the end of their commit rather
+than from their first changed row. The JSON API builds its ETag and Last-Modified headers from
+these rows, so a client asking whether anything changed costs one lookup of a single row however
+large the table is.
+"""
+import re
+from sqlalchemy import DDL, event, func, select, update
+from app.models import TableVersion, db
+
+VERSIONED_TABLES = ('books', 'members', 'transaction')
+
+# The table written by an INSERT, UPDATE or DELETE statement
+WRITE_STATEMENT = re.compile(r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|UPDATE|DELETE\s+FROM)\s+"?(\w+)"?', re.IGNORECASE)
+
+# Start every table at version 1, leaving tables that already have a version alone
+VERSION_SEED_DDL = [
+    f"""INSERT INTO table_versions (name, version, modified_at) VALUES ('{table}', 1, CURRENT_TIMESTAMP)
+        ON CONFLICT DO NOTHING"""
+    for table in VERSIONED_TABLES
+]
+
+# Seed the versions once every table exists
+for statement in VERSION_SEED_DDL:
+    event.listen(db.metadata, 'after_create', DDL(statement))
+
+
+def watch_table_versions(engine, session):
+    """
+    Note the versioned tables written on the connections of engine and bump their versions when
+    session commits
+    """
+    if not event.contains(engine, 'before_cursor_execute', _note_write):
+        event.listen(engine, 'before_cursor_execute', _note_write)
+        event.listen(engine, 'commit', _forget_writes)
+        event.listen(engine, 'rollback', _forget_writes)
+    if not event.contains(session, 'before_commit', _bump_versions):
+        event.listen(session, 'after_begin', _remember_connection)
+        event.listen(session, 'before_commit', _bump_versions)
+        event.listen(session, 'after_transaction_end', _forget_connections)
+
+
+def _note_write(connection, cursor, statement, parameters, context, executemany):
+    match = WRITE_STATEMENT.match(statement)
+    if match and match.group(1) in VERSIONED_TABLES:
+        connection.info.setdefault('changed_tables', set()).add(match.group(1))
+
+
+def _forget_writes(connection):
+    connection.info.pop('changed_tables', None)
+
+
+def _remember_connection(session, transaction, connection):
+    session.info.setdefault('versioned_connections', set()).add(connection)
+
+
+def _forget_connections(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('versioned_connections', None)
+
+
+def _bump_versions(session):
+    # Flush first so the writes still pending in the session are noted too
+    session.flush()
+    versions = TableVersion.__table__
+    for connection in session.info.get('versioned_connections', ()):
+        tables = connection.info.pop('changed_tables', None)
+        if tables:
+            connection.execute(
+                update(versions).where(versions.c.name.in_(sorted(tables)))
+                .values(version=versions.c.version + 1, modified_at=func.now()))
+
+
+def get_table_version(name):
+    """
+    Return the (version, modified_at) of a table, or None if it was never seeded
+    """
+    return db.session.execute(
+        select(TableVersion.version, TableVersion.modified_at).where(TableVersion.name == name)
+    ).first()
@@ -11,4 +11,81 @@ class Config:
     SECRET_KEY = os.environ.get("SECRET_KEY")
     DEBUG = os.environ.get("DEBUG") == "TRUE"
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URI")
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Engine profile from app/engine_profiles.py: 'default' keeps the SQLAlchemy defaults,
+    # 'production' turns on WAL and tuned PRAGMAs for SQLite, or pool tuning and timeouts for PostgreSQL
+    DATABASE_PROFILE = os.environ.get("DATABASE_PROFILE", "default")
+
+    # Read replica used by the read-only views, and how long a browser keeps reading from the
+    # primary after sending a write so it sees its own changes
+    DATABASE_REPLICA_URI = os.environ.get("DATABASE_REPLICA_URI")
+    REPLICA_STICKY_SECONDS = float(os.environ.get("REPLICA_STICKY_SECONDS", 5))
+
+    # Page size of the paginated listings
+    PAGE_SIZE = int(os.environ.get("PAGE_SIZE", 50))
+    MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 200))
+
+    # Frappe library API used by import_books
+    FRAPPE_API_URL = os.environ.get("FRAPPE_API_URL", "https://frappe.io/api/method/frappe-library")
+    FRAPPE_PAGES = int(os.environ.get("FRAPPE_PAGES", 5))
+    FRAPPE_TIMEOUT = float(os.environ.get("FRAPPE_TIMEOUT", 5))
+
+    # Rows committed per batch by the bulk book loader
+    INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 1000))
+
+    # Maximum number of suggestions returned by the member and book lookups
+    LOOKUP_LIMIT = int(os.environ.get("LOOKUP_LIMIT", 10))
+
+    # Password hashing: method and cost of new hashes, size of the hashing process pool, the most
+    # hashes that may be pending at once and how long a request waits for one (0 workers hashes inline)
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    PASSWORD_SALT_LENGTH = int(os.environ.get("PASSWORD_SALT_LENGTH", 16))
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE", 32))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get("PASSWORD_HASH_TIMEOUT", 10))
+
+    # Cache of logged in member identities. With USER_CACHE_SHARED set, changes made by one worker
+    # clear the caches of the others within USER_CACHE_VERSION_CHECK seconds
+    USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+    USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 300))
+    USER_CACHE_SHARED = os.environ.get("USER_CACHE_SHARED") == "TRUE"
+    USER_CACHE_VERSION_CHECK = float(os.environ.get("USER_CACHE_VERSION_CHECK", 5))
+
+    # Open loans read and snapshot rows written per batch by the fee accrual run
+    FEE_ACCRUAL_BATCH_SIZE = int(os.environ.get("FEE_ACCRUAL_BATCH_SIZE", 100000))
+
+    # Transaction ids summarized per committed chunk by the analytics rollup backfill
+    ANALYTICS_BACKFILL_CHUNK_SIZE = int(os.environ.get("ANALYTICS_BACKFILL_CHUNK_SIZE", 100000))
+
+    # Rows fetched from the server-side cursor and encoded per chunk by the CSV/JSONL exports
+    EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000))
+
+    # Most operations accepted by one batch circulation request
+    CIRCULATION_BATCH_LIMIT = int(os.environ.get("CIRCULATION_BATCH_LIMIT", 500))
+
+    # Cache of rendered listing fragments: the most entries and bytes kept in process (0 entries
+    # disables it), and a directory to share them between workers through the filesystem instead
+    PAGE_CACHE_SIZE = int(os.environ.get("PAGE_CACHE_SIZE", 1000))
+    PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+    PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", 3600))
+    PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR")
+
+    # Request and SQL instrumentation exported at /metrics: on or off, the share of requests timed
+    # (1.0 times every request), and how slow a statement must be to enter the slow query log
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "TRUE") == "TRUE"
+    METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", 1.0))
+    SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 100))
+    SLOW_QUERY_LOG_SIZE = int(os.environ.get("SLOW_QUERY_LOG_SIZE", 100))
+
+    # Compiled templates kept in memory (0 recompiles every render; keep it above the number of
+    # templates), a directory of compiled template bytecode shared by the workers, and whether to
+    # compile every template at startup. Templates are reloaded when changed on disk only with
+    # TEMPLATES_AUTO_RELOAD, for development; unset, it follows DEBUG
+    TEMPLATE_CACHE_SIZE = int(os.environ.get("TEMPLATE_CACHE_SIZE", 400))
+    TEMPLATE_BYTECODE_DIR = os.environ.get("TEMPLATE_BYTECODE_DIR")
+    TEMPLATE_PRECOMPILE = os.environ.get("TEMPLATE_PRECOMPILE") == "TRUE"
+    TEMPLATES_AUTO_RELOAD = {"TRUE": True, "FALSE": False}.get(os.environ.get("TEMPLATES_AUTO_RELOAD"))
+
+    # Most milliseconds importing and creating the app may take, checked by flask benchmark startup
+    STARTUP_BUDGET_MS = float(os.environ.get("STARTUP_BUDGET_MS", 1500))
@@ -0,0 +1,60 @@
+"""Initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('books',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=20), nullable=False),
+    sa.Column('author', sa.String(length=20), nullable=False),
+    sa.Column('isbn', sa.String(length=20), nullable=False),
+    sa.Column('publisher', sa.String(length=150), nullable=False),
+    sa.Column('Quantity', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('id'),
+    sa.UniqueConstraint('isbn')
+    )
+    op.create_table('members',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=20), nullable=False),
+    sa.Column('fullname', sa.String(length=20), nullable=False),
+    sa.Column('email', sa.String(length=20), nullable=False),
+    sa.Column('outstanding_debt', sa.Float(), nullable=True),
+    sa.Column('hash_password', sa.String(length=150), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('id'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_table('transaction',
+    sa.Column('transaction_id', sa.Integer(), nullable=False),
+    sa.Column('book_id', sa.Integer(), nullable=True),
+    sa.Column('member_id', sa.Integer(), nullable=True),
+    sa.Column('borrowed_date', sa.Date(), nullable=True),
+    sa.Column('return_date', sa.Date(), nullable=True),
+    sa.Column('total_fee', sa.Float(), nullable=True),
+    sa.Column('amount_paid', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['book_id'], ['books.id'], ),
+    sa.ForeignKeyConstraint(['member_id'], ['members.id'], ),
+    sa.PrimaryKeyConstraint('transaction_id')
+    )
+
+
+def downgrade():
+    op.drop_table('transaction')
+    op.drop_table('members')
+    op.drop_table('books')
@@ -0,0 +1,143 @@
+"""Search indexes and dashboard counters
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.search import POSTGRESQL_BOOK_SEARCH_DDL, SQLITE_BOOK_SEARCH_DDL
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# The counter triggers as this revision installs them, with a single row per counter; revision
+# 0008 shards the rows
+SQLITE_COUNTER_DDL = [
+    """CREATE TRIGGER IF NOT EXISTS counters_books_insert AFTER INSERT ON books BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'books';
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS counters_books_delete AFTER DELETE ON books BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'books';
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS counters_members_insert AFTER INSERT ON members BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'members';
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS counters_members_delete AFTER DELETE ON members BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'members';
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS counters_transaction_insert AFTER INSERT ON "transaction" BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'transactions';
+        UPDATE counters SET value = value + 1 WHERE name = 'ongoing_issues' AND new.return_date IS NULL;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS counters_transaction_delete AFTER DELETE ON "transaction" BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'transactions';
+        UPDATE counters SET value = value - 1 WHERE name = 'ongoing_issues' AND old.return_date IS NULL;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS counters_transaction_return AFTER UPDATE OF return_date ON "transaction" BEGIN
+        UPDATE counters
+        SET value = value + (new.return_date IS NULL) - (old.return_date IS NULL)
+        WHERE name = 'ongoing_issues';
+    END""",
+]
+
+POSTGRESQL_COUNTER_DDL = [
+    """CREATE OR REPLACE FUNCTION counters_count_rows() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE counters SET value = value + 1 WHERE name = TG_ARGV[0];
+        ELSE
+            UPDATE counters SET value = value - 1 WHERE name = TG_ARGV[0];
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    """CREATE OR REPLACE FUNCTION counters_count_transactions() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE counters SET value = value + 1 WHERE name = 'transactions';
+            UPDATE counters SET value = value + 1 WHERE name = 'ongoing_issues' AND NEW.return_date IS NULL;
+        ELSIF TG_OP = 'DELETE' THEN
+            UPDATE counters SET value = value - 1 WHERE name = 'transactions';
+            UPDATE counters SET value = value - 1 WHERE name = 'ongoing_issues' AND OLD.return_date IS NULL;
+        ELSIF (NEW.return_date IS NULL) <> (OLD.return_date IS NULL) THEN
+            UPDATE counters
+            SET value = value + CASE WHEN NEW.return_date IS NULL THEN 1 ELSE -1 END
+            WHERE name = 'ongoing_issues';
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    'DROP TRIGGER IF EXISTS counters_books ON books',
+    """CREATE TRIGGER counters_books AFTER INSERT OR DELETE ON books
+        FOR EACH ROW EXECUTE FUNCTION counters_count_rows('books')""",
+    'DROP TRIGGER IF EXISTS counters_members ON members',
+    """CREATE TRIGGER counters_members AFTER INSERT OR DELETE ON members
+        FOR EACH ROW EXECUTE FUNCTION counters_count_rows('members')""",
+    'DROP TRIGGER IF EXISTS counters_transaction ON "transaction"',
+    """CREATE TRIGGER counters_transaction AFTER INSERT OR DELETE OR UPDATE OF return_date ON "transaction"
+        FOR EACH ROW EXECUTE FUNCTION counters_count_transactions()""",
+]
+
+# Start every counter from the current row count, leaving counters that already exist alone
+COUNTER_SEED_DDL = [
+    """INSERT INTO counters (name, value) SELECT 'books', count(*) FROM books WHERE true ON CONFLICT DO NOTHING""",
+    """INSERT INTO counters (name, value) SELECT 'members', count(*) FROM members WHERE true ON CONFLICT DO NOTHING""",
+    """INSERT INTO counters (name, value) SELECT 'transactions', count(*) FROM "transaction" WHERE true
+        ON CONFLICT DO NOTHING""",
+    """INSERT INTO counters (name, value) SELECT 'ongoing_issues', count(*) FROM "transaction"
+        WHERE return_date IS NULL ON CONFLICT DO NOTHING""",
+]
+
+
+def upgrade():
+    op.create_table('member_search_tokens',
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('token', sa.String(length=255), nullable=False),
+    sa.Column('member_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['member_id'], ['members.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('kind', 'token', 'member_id')
+    )
+    op.create_index(op.f('ix_member_search_tokens_member_id'), 'member_search_tokens', ['member_id'], unique=False)
+    op.create_table('counters',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        statements = SQLITE_BOOK_SEARCH_DDL + SQLITE_COUNTER_DDL
+    elif dialect == 'postgresql':
+        statements = POSTGRESQL_BOOK_SEARCH_DDL + POSTGRESQL_COUNTER_DDL
+    else:
+        statements = []
+    for statement in statements + COUNTER_SEED_DDL:
+        op.execute(statement)
+    if dialect == 'sqlite':
+        op.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for trigger in ('books_fts_insert', 'books_fts_delete', 'books_fts_update',
+                        'counters_books_insert', 'counters_books_delete', 'counters_members_insert',
+                        'counters_members_delete', 'counters_transaction_insert',
+                        'counters_transaction_delete', 'counters_transaction_return'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute('DROP TABLE IF EXISTS books_fts')
+    elif dialect == 'postgresql':
+        op.execute('DROP TRIGGER IF EXISTS counters_books ON books')
+        op.execute('DROP TRIGGER IF EXISTS counters_members ON members')
+        op.execute('DROP TRIGGER IF EXISTS counters_transaction ON "transaction"')
+        op.execute('DROP FUNCTION IF EXISTS counters_count_rows()')
+        op.execute('DROP FUNCTION IF EXISTS counters_count_transactions()')
+        op.execute('DROP INDEX IF EXISTS ix_books_search')
+    op.drop_table('counters')
+    op.drop_index(op.f('ix_member_search_tokens_member_id'), table_name='member_search_tokens')
+    op.drop_table('member_search_tokens')
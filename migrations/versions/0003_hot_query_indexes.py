@@ -0,0 +1,50 @@
+"""Indexes for the hot listing, search, loan and ledger queries
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+OPEN_LOAN = sa.text('return_date IS NULL')
+
+
+def upgrade():
+    # Keyset sort options of the catalog and members listings
+    op.create_index('ix_books_title_id', 'books', ['title', 'id'], unique=False)
+    op.create_index('ix_books_author_id', 'books', ['author', 'id'], unique=False)
+    op.create_index('ix_members_fullname_id', 'members', ['fullname', 'id'], unique=False)
+
+    # One open loan per member. Close any duplicate open loans before upgrading
+    op.create_index('uq_transaction_open_loan', 'transaction', ['member_id'], unique=True,
+                    sqlite_where=OPEN_LOAN, postgresql_where=OPEN_LOAN)
+
+    # Ledger filters, each ending in the key the ledger is paginated on
+    op.create_index('ix_transaction_member_id_transaction_id', 'transaction', ['member_id', 'transaction_id'],
+                    unique=False)
+    op.create_index('ix_transaction_book_id_transaction_id', 'transaction', ['book_id', 'transaction_id'],
+                    unique=False)
+    op.create_index('ix_transaction_borrowed_date_transaction_id', 'transaction',
+                    ['borrowed_date', 'transaction_id'], unique=False)
+    op.create_index('ix_transaction_open', 'transaction', ['transaction_id'], unique=False,
+                    sqlite_where=OPEN_LOAN, postgresql_where=OPEN_LOAN)
+
+
+def downgrade():
+    op.drop_index('ix_transaction_open', table_name='transaction')
+    op.drop_index('ix_transaction_borrowed_date_transaction_id', table_name='transaction')
+    op.drop_index('ix_transaction_book_id_transaction_id', table_name='transaction')
+    op.drop_index('ix_transaction_member_id_transaction_id', table_name='transaction')
+    op.drop_index('uq_transaction_open_loan', table_name='transaction')
+    op.drop_index('ix_members_fullname_id', table_name='members')
+    op.drop_index('ix_books_author_id', table_name='books')
+    op.drop_index('ix_books_title_id', table_name='books')
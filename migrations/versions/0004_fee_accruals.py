@@ -0,0 +1,40 @@
+"""Fee accrual snapshot of the open loans
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 10:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('fee_accruals',
+    sa.Column('transaction_id', sa.Integer(), nullable=False),
+    sa.Column('member_id', sa.Integer(), nullable=True),
+    sa.Column('book_id', sa.Integer(), nullable=True),
+    sa.Column('borrowed_date', sa.Date(), nullable=False),
+    sa.Column('days_rented', sa.Integer(), nullable=False),
+    sa.Column('days_overdue', sa.Integer(), nullable=False),
+    sa.Column('accrued_fee', sa.Float(), nullable=False),
+    sa.Column('as_of', sa.Date(), nullable=False),
+    sa.ForeignKeyConstraint(['book_id'], ['books.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['member_id'], ['members.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['transaction_id'], ['transaction.transaction_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('transaction_id')
+    )
+    op.create_index('ix_fee_accruals_days_overdue_transaction_id', 'fee_accruals',
+                    ['days_overdue', 'transaction_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_fee_accruals_days_overdue_transaction_id', table_name='fee_accruals')
+    op.drop_table('fee_accruals')
@@ -0,0 +1,80 @@
+"""Per-table change counters for the JSON API
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 10:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.versions import VERSION_SEED_DDL, VERSIONED_TABLES
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+# The triggers as this revision installs them; revision 0009 drops them in favour of one bump per
+# committed transaction
+def _sqlite_triggers(table):
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS table_versions_{table}_{operation} AFTER {operation.upper()} ON "{table}"
+        BEGIN
+            UPDATE table_versions SET version = version + 1, modified_at = CURRENT_TIMESTAMP WHERE name = '{table}';
+        END"""
+        for operation in ('insert', 'update', 'delete')
+    ]
+
+
+SQLITE_VERSION_DDL = [statement for table in VERSIONED_TABLES for statement in _sqlite_triggers(table)]
+
+POSTGRESQL_VERSION_DDL = [
+    """CREATE OR REPLACE FUNCTION table_versions_bump() RETURNS trigger AS $$
+    BEGIN
+        UPDATE table_versions SET version = version + 1, modified_at = now() WHERE name = TG_TABLE_NAME;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+]
+for _table in VERSIONED_TABLES:
+    # Once per statement rather than per row, so bulk writes bump the version only once
+    POSTGRESQL_VERSION_DDL += [
+        f'DROP TRIGGER IF EXISTS table_versions_bump ON "{_table}"',
+        f"""CREATE TRIGGER table_versions_bump AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "{_table}"
+        FOR EACH STATEMENT EXECUTE FUNCTION table_versions_bump()""",
+    ]
+
+
+def upgrade():
+    op.create_table('table_versions',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('modified_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        statements = SQLITE_VERSION_DDL
+    elif dialect == 'postgresql':
+        statements = POSTGRESQL_VERSION_DDL
+    else:
+        statements = []
+    for statement in statements + VERSION_SEED_DDL:
+        op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table in VERSIONED_TABLES:
+        if dialect == 'sqlite':
+            for operation in ('insert', 'update', 'delete'):
+                op.execute(f'DROP TRIGGER IF EXISTS table_versions_{table}_{operation}')
+        elif dialect == 'postgresql':
+            op.execute(f'DROP TRIGGER IF EXISTS table_versions_bump ON "{table}"')
+    if dialect == 'postgresql':
+        op.execute('DROP FUNCTION IF EXISTS table_versions_bump()')
+    op.drop_table('table_versions')
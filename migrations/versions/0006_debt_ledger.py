@@ -0,0 +1,50 @@
+"""Debt ledger of charges, payments and adjustments
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 13:30:00.000000
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('debt_ledger',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('member_id', sa.Integer(), nullable=False),
+    sa.Column('transaction_id', sa.Integer(), nullable=True),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['member_id'], ['members.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['transaction_id'], ['transaction.transaction_id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_debt_ledger_member_id_created_at_id', 'debt_ledger',
+                    ['member_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_members_outstanding_debt_id', 'members', ['outstanding_debt', 'id'], unique=False)
+
+    # Open the ledger with the debts owed so far, so every balance equals the sum of its rows
+    members = sa.table('members', sa.column('id', sa.Integer), sa.column('outstanding_debt', sa.Float))
+    ledger = sa.table('debt_ledger', sa.column('member_id', sa.Integer), sa.column('kind', sa.String),
+                      sa.column('amount', sa.Float), sa.column('created_at', sa.DateTime))
+    op.execute(ledger.insert().from_select(
+        ['member_id', 'kind', 'amount', 'created_at'],
+        sa.select(members.c.id, sa.literal('adjustment', sa.String), members.c.outstanding_debt,
+                  sa.literal(datetime.now(), sa.DateTime))
+        .where(members.c.outstanding_debt.isnot(None), members.c.outstanding_debt != 0)))
+
+
+def downgrade():
+    op.drop_index('ix_members_outstanding_debt_id', table_name='members')
+    op.drop_index('ix_debt_ledger_member_id_created_at_id', table_name='debt_ledger')
+    op.drop_table('debt_ledger')
@@ -0,0 +1,57 @@
+"""Daily circulation rollups for the analytics reports
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 14:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def _measures():
+    return [
+        sa.Column('issues', sa.Integer(), nullable=False),
+        sa.Column('returns', sa.Integer(), nullable=False),
+        sa.Column('fees_charged', sa.Float(), nullable=False),
+        sa.Column('revenue', sa.Float(), nullable=False),
+    ]
+
+
+def upgrade():
+    op.create_table('daily_circulation',
+    sa.Column('day', sa.Date(), nullable=False),
+    *_measures(),
+    sa.PrimaryKeyConstraint('day')
+    )
+    op.create_table('daily_book_circulation',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    *_measures(),
+    sa.PrimaryKeyConstraint('day', 'book_id')
+    )
+    op.create_index('ix_daily_book_circulation_book_id_day', 'daily_book_circulation', ['book_id', 'day'],
+                    unique=False)
+    op.create_table('daily_member_circulation',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('member_id', sa.Integer(), nullable=False),
+    *_measures(),
+    sa.PrimaryKeyConstraint('day', 'member_id')
+    )
+    op.create_index('ix_daily_member_circulation_member_id_day', 'daily_member_circulation', ['member_id', 'day'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_daily_member_circulation_member_id_day', table_name='daily_member_circulation')
+    op.drop_table('daily_member_circulation')
+    op.drop_index('ix_daily_book_circulation_book_id_day', table_name='daily_book_circulation')
+    op.drop_table('daily_book_circulation')
+    op.drop_table('daily_circulation')
@@ -0,0 +1,87 @@
+"""Shard the dashboard counters so concurrent writers do not share a row
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 16:10:00.000000
+
+"""
+from alembic import context, op
+from alembic.script import ScriptDirectory
+import sqlalchemy as sa
+
+from app.counters import POSTGRESQL_COUNTER_DDL, POSTGRESQL_SHARD_SEED_DDL, SQLITE_COUNTER_DDL, \
+    SQLITE_COUNTER_TRIGGERS
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def _revision_0002():
+    # The single row triggers as revision 0002 installed them
+    return ScriptDirectory.from_config(context.config).get_revision('0002').module
+
+
+def _copy_counters(key, *columns):
+    # SQLite cannot change a primary key in place, so the rows are copied into a table with the new key
+    op.create_table('counters_copy',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    *columns,
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint(*key, name='counters_pkey')
+    )
+    op.execute('INSERT INTO counters_copy (name, value) SELECT name, value FROM counters')
+    op.drop_table('counters')
+    op.rename_table('counters_copy', 'counters')
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for trigger in SQLITE_COUNTER_TRIGGERS:
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    if dialect == 'sqlite':
+        _copy_counters(['name', 'shard'], sa.Column('shard', sa.Integer(), server_default='0', nullable=False))
+    else:
+        op.add_column('counters', sa.Column('shard', sa.Integer(), server_default='0', nullable=False))
+        op.drop_constraint('counters_pkey', 'counters', type_='primary')
+        op.create_primary_key('counters_pkey', 'counters', ['name', 'shard'])
+
+    if dialect == 'sqlite':
+        statements = SQLITE_COUNTER_DDL
+    elif dialect == 'postgresql':
+        statements = POSTGRESQL_COUNTER_DDL + POSTGRESQL_SHARD_SEED_DDL
+    else:
+        statements = []
+    for statement in statements:
+        op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    # Fold every counter back into shard 0
+    op.execute('UPDATE counters SET value = (SELECT sum(value) FROM counters AS shards '
+               'WHERE shards.name = counters.name) WHERE shard = 0')
+    op.execute('DELETE FROM counters WHERE shard <> 0')
+    if dialect == 'sqlite':
+        for trigger in SQLITE_COUNTER_TRIGGERS:
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    if dialect == 'sqlite':
+        _copy_counters(['name'])
+    else:
+        op.drop_constraint('counters_pkey', 'counters', type_='primary')
+        op.drop_column('counters', 'shard')
+        op.create_primary_key('counters_pkey', 'counters', ['name'])
+
+    previous = _revision_0002()
+    if dialect == 'sqlite':
+        statements = previous.SQLITE_COUNTER_DDL
+    elif dialect == 'postgresql':
+        statements = previous.POSTGRESQL_COUNTER_DDL
+    else:
+        statements = []
+    for statement in statements:
+        op.execute(statement)
@@ -0,0 +1,49 @@
+"""Bump the table versions once per transaction instead of from per row triggers
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 17:20:00.000000
+
+"""
+from alembic import context, op
+from alembic.script import ScriptDirectory
+
+from app.versions import VERSIONED_TABLES
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def _revision_0005():
+    # The triggers as revision 0005 installed them
+    return ScriptDirectory.from_config(context.config).get_revision('0005').module
+
+
+def upgrade():
+    # The app now bumps table_versions itself when a session commits
+    dialect = op.get_bind().dialect.name
+    for table in VERSIONED_TABLES:
+        if dialect == 'sqlite':
+            for operation in ('insert', 'update', 'delete'):
+                op.execute(f'DROP TRIGGER IF EXISTS table_versions_{table}_{operation}')
+        elif dialect == 'postgresql':
+            op.execute(f'DROP TRIGGER IF EXISTS table_versions_bump ON "{table}"')
+    if dialect == 'postgresql':
+        op.execute('DROP FUNCTION IF EXISTS table_versions_bump()')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    previous = _revision_0005()
+    if dialect == 'sqlite':
+        statements = previous.SQLITE_VERSION_DDL
+    elif dialect == 'postgresql':
+        statements = previous.POSTGRESQL_VERSION_DDL
+    else:
+        statements = []
+    for statement in statements:
+        op.execute(statement)
@@ -0,0 +1,22 @@
+"""
+Fixtures shared by the tests
+"""
+import pytest
+from app.benchmarks import benchmark_app
+
+
+@pytest.fixture
+def app():
+    """
+    An app with a fresh schema on a temporary SQLite database
+    """
+    with benchmark_app() as app:
+        yield app
+
+
+@pytest.fixture
+def client(app):
+    """
+    A test client of the app
+    """
+    return app.test_client()
@@ -0,0 +1,11 @@
+"""
+Tests of the circulation analytics
+"""
+import pytest
+
+
+@pytest.mark.parametrize('by', ['issues', 'revenue', 'bogus', 'day', ''])
+def test_analytics_report_ranks_by_known_figures(client, by):
+    response = client.get(f'/analytics?by={by}')
+
+    assert response.status_code == 200
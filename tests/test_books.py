@@ -0,0 +1,18 @@
+"""
+Tests of the book pages
+"""
+import json
+from app.models import Book
+
+
+def test_import_selected_skips_rows_that_are_not_books(app, client):
+    book = {'title': 'Imported Book', 'authors': 'Some Author', 'isbn': '9780000000001', 'publisher': 'Press'}
+    response = client.post('/import-books/selected', data={
+        'quantity': 2,
+        'selected': ['1', '[]', '"text"', 'null', '{not json', json.dumps(book)],
+    }, follow_redirects=True)
+
+    assert response.status_code == 200
+    assert 'Skipped 5 invalid book(s)' in response.get_data(as_text=True)
+    imported = Book.query.filter_by(isbn=book['isbn']).one()
+    assert (imported.title, imported.Quantity) == ('Imported Book', 2)
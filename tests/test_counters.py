@@ -0,0 +1,31 @@
+"""
+Tests of the home page counters
+"""
+from datetime import date
+from app.benchmarks import seed_loans
+from app.counters import count_rows, get_counters, reconcile_counters
+from app.models import Book, Counter, Transaction, db
+
+
+def test_triggers_keep_counters_in_step(app):
+    seed_loans(5)
+    db.session.add_all([Transaction(member_id=member_id, book_id=member_id, borrowed_date=date.today())
+                        for member_id in range(1, 4)])
+    db.session.commit()
+    db.session.execute(Transaction.__table__.update().where(Transaction.member_id == 1)
+                       .values(return_date=date.today()))
+    db.session.execute(Book.__table__.delete().where(Book.id == 5))
+    db.session.commit()
+
+    assert get_counters() == count_rows() == {'books': 4, 'members': 5, 'transactions': 3, 'ongoing_issues': 2}
+
+
+def test_counters_sum_their_shards(app):
+    seed_loans(2)
+    # Shards other writers have added to
+    db.session.add_all([Counter(name='books', shard=3, value=5), Counter(name='books', shard=7, value=-1)])
+    db.session.commit()
+    assert get_counters()['books'] == 6
+
+    assert reconcile_counters()['books'] == 2
+    assert get_counters() == count_rows()
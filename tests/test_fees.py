@@ -0,0 +1,53 @@
+"""
+Tests of the fee accrual snapshot
+"""
+from datetime import date, timedelta
+import pytest
+from sqlalchemy import event
+from app.benchmarks import seed_loans
+from app.fees import accrue_fees
+from app.models import Book, FeeAccrual, Member, Transaction, db
+
+
+@pytest.fixture
+def foreign_keys(app):
+    """
+    Enforce foreign keys on the SQLite test database, as PostgreSQL always does
+    """
+    def enable(connection, record):
+        connection.execute('PRAGMA foreign_keys=ON')
+
+    event.listen(db.engine, 'connect', enable)
+    db.session.remove()
+    db.engine.dispose()
+    yield
+    event.remove(db.engine, 'connect', enable)
+
+
+@pytest.fixture
+def accrued_loan(foreign_keys):
+    seed_loans(2)
+    db.session.add(Transaction(member_id=1, book_id=1, borrowed_date=date.today() - timedelta(days=30)))
+    db.session.commit()
+    accrue_fees()
+    return db.session.get(FeeAccrual, 1)
+
+
+def test_deleting_a_member_keeps_their_accrual(accrued_loan, client):
+    response = client.post('/delete-members/1')
+
+    assert response.status_code == 302
+    db.session.expire_all()
+    assert db.session.get(Member, 1) is None
+    assert accrued_loan.member_id is None
+    assert accrued_loan.book_id == 1
+
+
+def test_deleting_a_book_keeps_its_accrual(accrued_loan):
+    db.session.execute(Transaction.__table__.update().values(book_id=None))
+    db.session.execute(Book.__table__.delete().where(Book.id == 1))
+    db.session.commit()
+
+    db.session.expire_all()
+    assert accrued_loan.book_id is None
+    assert accrued_loan.member_id == 1
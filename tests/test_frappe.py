@@ -0,0 +1,125 @@
+"""
+Tests of the Frappe client against a local stub server standing in for frappe.io
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+from app.frappe import fetch_books
+
+# Seconds every page takes to answer, and the timeout of the fetches
+PAGE_DELAY = 0.3
+TIMEOUT = 1.0
+
+
+class StubFrappe(ThreadingHTTPServer):
+    """
+    A server that answers like the Frappe library API, with two books per page. Pages in slow_pages
+    never answer in time, pages in failing_pages answer 500 and pages in malformed_pages answer
+    with the JSON body given for them
+    """
+    daemon_threads = True
+
+    def __init__(self, slow_pages=(), failing_pages=(), malformed_pages=None):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.slow_pages = set(slow_pages)
+        self.failing_pages = set(failing_pages)
+        self.malformed_pages = malformed_pages or {}
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.pages = []
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/api/method/frappe-library'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        page = int(parse_qs(urlparse(self.path).query)['page'][0])
+        with server.lock:
+            server.pages.append(page)
+            server.in_flight += 1
+            server.most_in_flight = max(server.most_in_flight, server.in_flight)
+        try:
+            time.sleep(TIMEOUT * 3 if page in server.slow_pages else PAGE_DELAY)
+            if page in server.failing_pages:
+                self.send_response(500)
+                self.end_headers()
+                return
+            books = [{'bookID': page * 10 + index, 'title': f'Stub book {page}.{index}', 'authors': 'Stub',
+                      'isbn': f'{page:05d}{index:05d}', 'publisher': 'Stub Press'} for index in range(2)]
+            body = json.dumps(server.malformed_pages.get(page, {'message': books})).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server(request):
+    """
+    Start a StubFrappe with the slow and failing pages of the test's stub marker
+    """
+    marker = request.node.get_closest_marker('stub')
+    server = StubFrappe(**(marker.kwargs if marker else {}))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_pages_are_fetched_in_parallel(stub_server):
+    started = time.perf_counter()
+    results = fetch_books('stub', stub_server.url, pages=5, timeout=TIMEOUT)
+    elapsed = time.perf_counter() - started
+
+    assert sorted(stub_server.pages) == [1, 2, 3, 4, 5]
+    assert stub_server.most_in_flight > 1
+    # One after the other, five pages would take five delays
+    assert elapsed < PAGE_DELAY * 3
+    assert results.failed_pages == []
+    assert [book['isbn'] for book in results.books] == [f'{page:05d}{index:05d}'
+                                                        for page in range(1, 6) for index in range(2)]
+
+
+@pytest.mark.stub(slow_pages=[2])
+def test_slow_page_times_out(stub_server):
+    started = time.perf_counter()
+    results = fetch_books('stub', stub_server.url, pages=3, timeout=TIMEOUT)
+    elapsed = time.perf_counter() - started
+
+    assert results.failed_pages == [2]
+    assert elapsed < TIMEOUT * 2.5
+    assert {book['isbn'][:5] for book in results.books} == {'00001', '00003'}
+
+
+@pytest.mark.stub(failing_pages=[1, 4])
+def test_failed_pages_give_partial_results(stub_server):
+    results = fetch_books('stub', stub_server.url, pages=4, timeout=TIMEOUT)
+
+    assert results.failed_pages == [1, 4]
+    assert [book['isbn'] for book in results.books] == ['0000200000', '0000200001', '0000300000', '0000300001']
+
+
+@pytest.mark.stub(malformed_pages={1: {'message': 'no books'}, 2: ['not', 'an', 'object'],
+                                   3: {'message': [1, None, {'isbn': 'valid', 'title': 'Valid'}]}})
+def test_malformed_pages_give_partial_results(stub_server):
+    results = fetch_books('stub', stub_server.url, pages=4, timeout=TIMEOUT)
+
+    assert results.failed_pages == [1, 2]
+    assert [book['isbn'] for book in results.books] == ['valid', '0000400000', '0000400001']
@@ -0,0 +1,39 @@
+"""
+Tests of the password hasher
+"""
+import pytest
+from werkzeug.security import generate_password_hash
+from app import hashing
+from app.hashing import PasswordHasher, method_prefix
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher()
+    hasher.workers = 0
+    return hasher
+
+
+@pytest.mark.parametrize('method', ['scrypt', 'scrypt:16384:8:1', 'pbkdf2', 'pbkdf2:sha256', 'pbkdf2:sha512',
+                                    'pbkdf2:sha256:1000'])
+def test_method_prefix_matches_werkzeug(method):
+    assert method_prefix(method) == generate_password_hash('', method).split('$', 1)[0]
+
+
+@pytest.mark.parametrize('method', ['scrypt', 'pbkdf2', 'pbkdf2:sha256', 'pbkdf2:sha256:600000'])
+def test_fresh_hashes_need_no_rehash(hasher, monkeypatch, method):
+    hasher.method = method
+    password_hash = hasher.hash('password')
+
+    # Checking a hash must not hash anything on the request thread
+    monkeypatch.setattr(hashing, 'generate_password_hash', None)
+    assert not hasher.needs_rehash(password_hash)
+    assert hasher.needs_rehash(generate_password_hash('password', 'pbkdf2:sha256:1000'))
+
+
+def test_hash_errors_are_not_rejections(hasher):
+    with pytest.raises(ValueError):
+        hasher.verify('pbkdf2:sha256:many$salt$hash', 'password')
+
+    stats = hasher.stats()
+    assert (stats['failed'], stats['rejected'], stats['in_flight']) == (1, 0, 0)
@@ -0,0 +1,47 @@
+"""
+Tests of the member pages
+"""
+from app.debts import post_returns
+from app.models import DebtEntry, Member, db
+
+
+def add_member(debt=0.0):
+    member = Member(username='member1', fullname='Member One', email='member1@example.org', outstanding_debt=debt)
+    db.session.add(member)
+    db.session.commit()
+    return member
+
+
+def edit(client, member, **fields):
+    data = {'username': member.username, 'fullname': member.fullname, 'email': member.email}
+    return client.post(f'/update-members/{member.id}', data={**data, **fields})
+
+
+def test_fractional_debt_can_be_edited(client):
+    member = add_member(12.5)
+    assert 'value="12.5"' in client.get(f'/update-members/{member.id}').get_data(as_text=True)
+
+    response = edit(client, member, fullname='Member Renamed', outstanding_debt='12.5', displayed_debt='12.5')
+    assert response.status_code == 302
+    response = edit(client, member, outstanding_debt='10.25', displayed_debt='12.5')
+    assert response.status_code == 302
+
+    db.session.expire_all()
+    assert (member.fullname, member.outstanding_debt) == ('Member Renamed', 10.25)
+    assert [(entry.kind, entry.amount) for entry in DebtEntry.query] == [('adjustment', -2.25)]
+
+
+def test_stale_form_does_not_overwrite_a_charge(client):
+    member = add_member()
+    # A return is charged while the librarian has the form open with a debt of 0
+    assert post_returns([(member.id, None, 50.0, 0.0)])
+    db.session.commit()
+
+    edit(client, member, outstanding_debt='0', displayed_debt='0')
+    db.session.expire_all()
+    assert member.outstanding_debt == 50.0
+
+    edit(client, member, outstanding_debt='10', displayed_debt='0')
+    db.session.expire_all()
+    assert member.outstanding_debt == 50.0
+    assert [(entry.kind, entry.amount) for entry in DebtEntry.query] == [('charge', 50.0)]
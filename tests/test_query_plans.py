@@ -0,0 +1,22 @@
+"""
+Tests that the hot queries use indexes
+"""
+from pathlib import Path
+import pytest
+from flask_migrate import upgrade
+from app import db
+from app.query_plans import check_query_plans
+
+MIGRATIONS = Path(__file__).resolve().parents[1] / 'migrations'
+
+
+@pytest.mark.parametrize('schema', ['models', 'migrations'])
+def test_hot_queries_do_not_scan_tables(app, schema):
+    if schema == 'migrations':
+        db.drop_all()
+        upgrade(directory=str(MIGRATIONS))
+
+    checks = check_query_plans()
+
+    assert checks
+    assert {check.name: check.full_scans for check in checks if check.full_scans} == {}
@@ -0,0 +1,50 @@
+"""
+Tests of the replica reads
+"""
+from datetime import date
+import pytest
+from app import db
+from app.benchmarks import benchmark_app, seed_loans
+from app.models import Transaction
+from app.replicas import sync_sqlite_replica
+
+
+@pytest.fixture
+def replicated_app(tmp_path):
+    """
+    An app whose replica is a second SQLite file, synced from the primary once the members and
+    books are loaded
+    """
+    with benchmark_app(DATABASE_REPLICA_URI=f"sqlite:///{tmp_path / 'replica.db'}",
+                       REPLICA_STICKY_SECONDS=60) as app:
+        seed_loans(3)
+        sync_sqlite_replica(app.config['SQLALCHEMY_DATABASE_URI'], app.config['DATABASE_REPLICA_URI'])
+        yield app
+
+
+def ledger(client):
+    response = client.get('/transactions')
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+def test_replica_reads_and_stickiness(replicated_app):
+    client = replicated_app.test_client()
+    # A loan only on the primary, which the replica has not caught up with
+    db.session.add(Transaction(member_id=1, book_id=1, borrowed_date=date.today()))
+    db.session.commit()
+
+    assert 'Member 1' not in ledger(client)
+
+    # After a write the same browser reads from the primary, including the loan it just issued
+    assert client.post('/issue-book', data={'member': 2, 'book': 2}).status_code == 302
+    page = ledger(client)
+    assert 'Member 1' in page and 'Member 2' in page
+
+    # Other browsers keep reading from the replica until it is synced
+    other = replicated_app.test_client()
+    assert 'Member 2' not in ledger(other)
+    db.session.remove()
+    sync_sqlite_replica(replicated_app.config['SQLALCHEMY_DATABASE_URI'],
+                        replicated_app.config['DATABASE_REPLICA_URI'])
+    assert 'Member 2' in ledger(other)
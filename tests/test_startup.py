@@ -0,0 +1,16 @@
+"""
+Tests of the app's startup time
+"""
+import statistics
+from app.benchmarks import LAZY_MODULES, benchmark_startup
+from config import Config
+
+
+def test_startup_within_budget(monkeypatch, tmp_path):
+    # The app is created in fresh interpreters, which read their settings from the environment
+    monkeypatch.setenv('DATABASE_URI', f"sqlite:///{tmp_path / 'startup.db'}")
+    monkeypatch.setenv('SECRET_KEY', 'startup')
+    timings, imports = benchmark_startup(runs=3)
+
+    assert statistics.median(timings) <= Config.STARTUP_BUDGET_MS
+    assert [name for name in LAZY_MODULES if name in imports] == []
@@ -0,0 +1,112 @@
+"""
+Tests of the transactions ledger
+"""
+import threading
+from datetime import date
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app import db
+from app.benchmarks import QueryCounter, seed_loans
+from app.models import Book, Transaction
+from app.synthetic import generate_library
+
+# Copies of the contended book, and the members trying to borrow it at once
+COPIES = 5
+BORROWERS = 40
+
+# Most statements a ledger page may run, whatever its size: the page query itself, with the members
+# and books joined in, and one spare. Loading a member or book per row would run dozens
+MAX_STATEMENTS = 2
+
+
+@pytest.fixture
+def library(app):
+    return generate_library(books=200, members=100, transactions=2000, seed=1)
+
+
+@pytest.mark.parametrize('query', [
+    '',
+    '?per_page=200',
+    '?status=open',
+    '?status=closed&member=5&per_page=200',
+    '?book=3&borrowed_from=2000-01-01&borrowed_to=2100-01-01',
+    '?status=closed&per_page=10&after=1500',
+])
+def test_ledger_statement_count(library, client, query):
+    counter = QueryCounter(db.engines.values())
+    counter.active = True
+    try:
+        response = client.get(f'/transactions{query}')
+        response.get_data()
+    finally:
+        counter.active = False
+        counter.remove()
+
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).count('<tr') > 1
+    assert counter.count <= MAX_STATEMENTS
+
+
+def test_concurrent_issues_never_oversell(app):
+    seed_loans(BORROWERS)
+    db.session.execute(Book.__table__.update().where(Book.id == 1).values(Quantity=COPIES))
+    db.session.commit()
+
+    barrier = threading.Barrier(BORROWERS)
+    statuses = []
+
+    def borrow(member_id):
+        client = app.test_client()
+        barrier.wait()
+        response = client.post('/issue-book', data={'member': member_id, 'book': 1})
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=borrow, args=(member_id,)) for member_id in range(1, BORROWERS + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    db.session.expire_all()
+    open_loans = db.session.execute(
+        select(func.count()).select_from(Transaction).where(Transaction.book_id == 1, Transaction.return_date.is_(None))
+    ).scalar()
+    assert len(statuses) == BORROWERS
+    assert set(statuses) <= {200, 302}
+    assert open_loans == COPIES
+    assert db.session.get(Book, 1).Quantity == 0
+
+
+def test_second_open_loan_is_rejected(app, client):
+    seed_loans(2)
+    assert client.post('/issue-book', data={'member': 1, 'book': 1}).status_code == 302
+
+    # The route refuses it, and so does the unique index on the open loans of a member
+    client.post('/issue-book', data={'member': 1, 'book': 2})
+    assert db.session.get(Book, 2).Quantity == 1
+    db.session.add(Transaction(member_id=1, book_id=2, borrowed_date=date.today()))
+    with pytest.raises(IntegrityError, match='member_id'):
+        db.session.commit()
+    db.session.rollback()
+
+    # Once the loan is returned the member may borrow again
+    db.session.execute(Transaction.__table__.update().values(return_date=date.today()))
+    db.session.commit()
+    db.session.add(Transaction(member_id=1, book_id=2, borrowed_date=date.today()))
+    db.session.commit()
+
+
+def test_issue_reports_database_errors(client, monkeypatch):
+    seed_loans(1)
+
+    def locked():
+        raise OperationalError('INSERT INTO "transaction"', {}, Exception('database is locked'))
+
+    # A lock timeout while the loan is written
+    monkeypatch.setattr(db.session, 'flush', locked)
+    response = client.post('/issue-book', data={'member': 1, 'book': 1})
+
+    assert response.status_code == 200
+    assert 'database is locked' in response.get_data(as_text=True)
+    assert db.session.get(Book, 1).Quantity == 1
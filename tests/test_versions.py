@@ -0,0 +1,57 @@
+"""
+Tests of the table versions behind the JSON API and the page cache
+"""
+from datetime import date
+from app.benchmarks import seed_loans
+from app.models import Book, Member, Transaction, db
+from app.versions import get_table_version
+
+
+def versions():
+    return {name: get_table_version(name).version for name in ('books', 'members', 'transaction')}
+
+
+def test_a_transaction_bumps_each_table_once(app):
+    seed_loans(20)
+    before = versions()
+    # Many rows over several flushes and statements
+    db.session.add_all([Book(title=f'Extra {number}', author='Author', isbn=f'extra-{number}', publisher='Publisher')
+                        for number in range(10)])
+    db.session.flush()
+    db.session.execute(Book.__table__.update().values(Quantity=Book.Quantity + 1))
+    db.session.add_all([Transaction(member_id=member_id, book_id=member_id, borrowed_date=date.today())
+                        for member_id in range(1, 11)])
+    db.session.commit()
+
+    assert versions() == dict(before, books=before['books'] + 1, transaction=before['transaction'] + 1)
+
+
+def test_untouched_tables_keep_their_version(app):
+    seed_loans(1)
+    db.session.commit()
+    before = versions()
+
+    db.session.get(Member, 1).outstanding_debt = 10.0
+    db.session.commit()
+
+    assert versions() == dict(before, members=before['members'] + 1)
+
+
+def test_rolled_back_writes_do_not_bump(app):
+    before = versions()
+    db.session.add(Member(username='member', fullname='Member', email='member@example.com'))
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+
+    assert versions() == before
+
+
+def test_core_writes_on_the_session_connection_bump(app):
+    before = versions()
+    db.session.connection().execute(Book.__table__.insert(), [
+        {'title': f'Book {number}', 'author': 'Author', 'isbn': f'isbn-{number}', 'publisher': 'Publisher',
+         'Quantity': 1} for number in range(3)])
+    db.session.commit()
+
+    assert versions()['books'] == before['books'] + 1